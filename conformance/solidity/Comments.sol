@@ -0,0 +1,27 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.20;
+
+/// @title A contract with every comment style
+/// @notice NatSpec line comments count as comments
+contract Comments {
+    /**
+     * @dev NatSpec block comment
+
+     * with a blank line inside
+     */
+    uint256 public value; // trailing comment on a code line
+
+    /* single line block */
+    uint256 public other; /* block after code */
+
+    /* block before code */ uint256 public third;
+
+    /*
+    uint256 public commentedOut;
+    */ uint256 public afterBlock;
+
+    function set(uint256 newValue) external {
+        value = newValue; /* starts here
+        ends here */
+    }
+}
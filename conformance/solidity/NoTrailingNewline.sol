@@ -0,0 +1,3 @@
+contract NoTrailingNewline {
+    	
+}
\ No newline at end of file
@@ -0,0 +1,19 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.20;
+
+contract Strings {
+    string public constant URL = "https://example.com/*not a comment*/";
+    string public constant SINGLE = 'it is // not a comment';
+    string public constant ESCAPED = "quote \" then // still a string";
+    bytes public constant HEX = hex"00ff";
+    string public constant UNICODE = unicode"Hello 😃 /* still code */";
+
+    function describe() external pure returns (string memory) {
+        return "/*";
+    }
+
+    // "a string inside a comment" is still a comment
+    function after_() external pure returns (uint256) {
+        return 1;
+    }
+}
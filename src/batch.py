@@ -0,0 +1,17 @@
+import argparse
+import sys
+from modules.batch_module import BatchRunner
+
+if __name__ == '__main__':   # python batch.py manifest.jsonl --output results.jsonl
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Analyse the repositories of a JSONL/CSV manifest without Slack")
+    parser.add_argument("manifest", help="JSONL or CSV with the message fields: Client, Repo, Language, Branch, Commit, Scope, Base (and an optional id)")
+    parser.add_argument("--output", default="batch-results.jsonl", help="JSONL file the results are appended to, finished entries are skipped on the next run")
+    parser.add_argument("--concurrency", type=int, default=2, help="Repositories analysed at the same time")
+    parser.add_argument("--stage-limits", default=None, help="Per-stage limits, e.g. clone=2,install=1,format=2,count=4 (STAGE_LIMITS by default)")
+    parser.add_argument("--no-cache", action="store_true", help="Don't answer from the result cache")
+    args: argparse.Namespace = parser.parse_args()
+
+    runner: BatchRunner = BatchRunner(args.output, args.concurrency, args.stage_limits, args.no_cache)
+    summary: dict = runner.run(BatchRunner.read_manifest(args.manifest))
+    runner.log_info("Batch finished: ", f"{summary['done']} done, {summary['failed']} failed, {summary['skipped']} skipped of {summary['total']}")
+    sys.exit(1 if summary["failed"] else 0)
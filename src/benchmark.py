@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import sys
+
+def parse_scenario(value: str) -> dict:
+    """
+    Parse a scenario like `foundry:contracts=200,lines=300,vendored=500,history=1000`
+    Args:
+        value (str): The scenario from the command line
+    Returns:
+        dict: The keyword arguments of SyntheticRepo
+    """
+    layout, _, options = value.partition(":")
+    spec: dict = {"layout": layout}
+    for option in filter(None, options.split(",")):
+        key, _, number = option.partition("=")
+        spec[key.strip()] = int(number)
+    return spec
+
+
+def configure_environment(workdir: str) -> None:
+    """
+    Point every cache, the temporary directory and the Slack settings of the bot at the benchmark
+    directory. Settings are read when the modules are imported, so this runs before importing them.
+    Args:
+        workdir (str): The benchmark directory
+    """
+    cache_dir: str = os.path.join(workdir, "cache")
+    defaults: dict = {
+        "MIRROR_CACHE_DIR": os.path.join(cache_dir, "mirrors"),
+        "DEPENDENCY_CACHE_DIR": os.path.join(cache_dir, "dependencies"),
+        "FORMATTER_TOOLCHAIN_DIR": os.path.join(cache_dir, "toolchain"),
+        "RESULT_CACHE_PATH": os.path.join(cache_dir, "results.sqlite"),
+        "FORMAT_CACHE_PATH": os.path.join(cache_dir, "formatted.sqlite"),
+        "COUNT_STORE_PATH": os.path.join(cache_dir, "counts.sqlite"),
+        "METRICS_PATH": os.path.join(cache_dir, "metrics.sqlite"),
+        "WORKSPACE_ROOT": os.path.join(workdir, "workspaces"),
+        "SIGNING_SECRET": "benchmark-signing-secret",
+        "SLACK_TOKEN": "xoxb-benchmark"
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    os.makedirs(os.path.join(workdir, "tmp"), exist_ok=True)
+    os.environ["TMPDIR"] = os.path.join(workdir, "tmp")
+
+
+def print_report(report: dict) -> None:
+    """
+    Print the per-stage statistics of a report as a table
+    """
+    print(f"{'Scenario':<36}{'Stage':<22}{'Runs':>5}{'Err':>5}{'Cold s':>9}{'p50 s':>9}{'p95 s':>9}{'Runs/s':>9}{'RSS MiB':>9}{'Disk MiB':>10}")
+    for scenario, details in report["scenarios"].items():
+        for stage, stats in details["stages"].items():
+            disk: str = f"{stats['disk_bytes'] / 1024 ** 2:.1f}" if stats["disk_bytes"] is not None else "-"
+            print(
+                f"{scenario:<36}{stage:<22}{stats['runs']:>5}{stats['errors']:>5}{stats['cold_seconds']:>9.3f}{stats['p50_seconds']:>9.3f}"
+                f"{stats['p95_seconds']:>9.3f}{stats['runs_per_second'] or 0:>9.2f}{stats['peak_rss_bytes'] / 1024 ** 2:>9.1f}{disk:>10}"
+            )
+
+
+def run(args: argparse.Namespace) -> int:
+    """
+    Run the scenarios and write the report
+    """
+    workdir: str = os.path.abspath(os.path.expanduser(args.workdir))
+    configure_environment(workdir)
+    from modules.benchmark_module import Benchmark
+    from modules.fake_slack_module import FakeSlack
+    from modules.synthetic_repo_module import SyntheticRepo
+
+    fake_slack: FakeSlack = FakeSlack(os.environ["SIGNING_SECRET"], channel_interval=args.slack_channel_interval)
+    fake_slack.start()
+    os.environ["SLACK_API_URL"] = fake_slack.url
+    benchmark: Benchmark = Benchmark(workdir, fake_slack, iterations=args.iterations, use_result_cache=args.result_cache)
+    try:
+        for scenario in args.scenario or ["hardhat:contracts=20", "foundry:contracts=20"]:
+            benchmark.run_scenario(SyntheticRepo(**parse_scenario(scenario)))
+    finally:
+        if "bot" in sys.modules:
+            sys.modules["bot"].job_queue.shutdown()
+        fake_slack.stop()
+    report: dict = benchmark.get_report()
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print_report(report)
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    """
+    Compare two reports, the exit code is 1 if a stage regressed
+    """
+    from modules.benchmark_module import Benchmark
+    with open(args.base, "r") as base_file, open(args.current, "r") as current_file:
+        rows: list[dict] = Benchmark.compare(json.load(base_file), json.load(current_file), args.threshold, args.min_seconds)
+    print(f"{'Scenario':<36}{'Stage':<22}{'Metric':<13}{'Base s':>9}{'New s':>9}{'Change':>9}")
+    for row in rows:
+        change: str = f"{row['change']:+.1%}" if row["change"] is not None else "-"
+        print(f"{row['scenario']:<36}{row['stage']:<22}{row['metric']:<13}{row['base']:>9.3f}{row['current']:>9.3f}{change:>9}{'  REGRESSION' if row['regression'] else ''}")
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == '__main__':   # python benchmark.py run ... | python benchmark.py compare base.json current.json
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="End-to-end benchmarks of the bot against synthetic repositories and a fake Slack")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser: argparse.ArgumentParser = commands.add_parser("run", help="Run the benchmark scenarios")
+    run_parser.add_argument("--scenario", action="append", help="layout:contracts=N,lines=N,vendored=N,history=N,seed=N (repeatable)")
+    run_parser.add_argument("--iterations", type=int, default=5, help="Runs of every stage per scenario, the first one is cold")
+    run_parser.add_argument("--workdir", default="~/.cache/pre-audit-bot/benchmark", help="Directory for the repositories and caches")
+    run_parser.add_argument("--output", default="benchmark-results.json", help="The JSON report")
+    run_parser.add_argument("--result-cache", action="store_true", help="Let the bot stages answer from the result cache")
+    run_parser.add_argument("--slack-channel-interval", type=float, default=0.0, help="Rate limit the fake Slack to one message call per channel every this many seconds")
+    run_parser.set_defaults(handler=run)
+    compare_parser: argparse.ArgumentParser = commands.add_parser("compare", help="Compare two JSON reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as a regression")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.05, help="Ignore slowdowns smaller than this")
+    compare_parser.set_defaults(handler=compare)
+    parsed_args: argparse.Namespace = parser.parse_args()
+    sys.exit(parsed_args.handler(parsed_args))
@@ -1,12 +1,16 @@
-import slack
 import os
+import threading
+import time
 from pathlib import Path
 from dotenv import load_dotenv
-from flask import Flask
+from flask import Flask, Response, jsonify, request
 from slackeventsapi import SlackEventAdapter  # To handle events from Slack
-from modules.repository_module import Repository as R
-from modules.framework_module import Framework as F
-from modules.cloc_module import Cloc as C
+from modules.job_module import JobQueue as J
+from modules.analysis_module import do_protocol_analysis, get_request_key
+from modules.metrics_module import Metrics as M
+from modules.dedupe_module import DedupeStore as D
+from modules.slack_client_module import SlackClient as SC
+from modules.workspace_module import WorkspaceManager as W
 
 # Load environment variables
 load_dotenv(dotenv_path="./.env")
@@ -15,12 +19,26 @@ load_dotenv(dotenv_path="./.env")
 app: Flask = Flask(__name__)
 slack_events_adapter: SlackEventAdapter = SlackEventAdapter(os.environ['SIGNING_SECRET'], "/slack/events", app) # `/slack/events` is the endpoint that will receive events from Slack; app - events are sent to this running web server
 
-# Initialise a Slack WebClient instance
-client: slack.WebClient = slack.WebClient(token=os.environ['SLACK_TOKEN'])   # Initialise an instance of the Slack WebClient interface to interract later with Slack API
-BOT_ID = client.api_call("auth.test")['user_id']                             # Get the bot's user ID                     
+# Initialise the Slack client, one pooled HTTP session for every call; nothing is called at import, the bot's
+# user ID is looked up on first use (or by `warm_up`), so the server starts without waiting for Slack
+client: SC = SC(token=os.environ['SLACK_TOKEN'], api_url=os.environ.get('SLACK_API_URL'))   # SLACK_API_URL points it at a stand-in, e.g. in benchmarks
 
 USED_LANGUAGES = ["solidity", "rust"]     
-processed_messages: set = set()
+# Stages shown in the status message of a job, in the order they run
+STAGE_LABELS: dict = {
+    "resolve_commit": "Resolving commit",
+    "clone": "Cloning",
+    "early_count": "Counting unformatted code",
+    "install": "Installing dependencies",
+    "formatter_setup": "Setting up formatter",
+    "format": "Formatting",
+    "count": "Counting"
+}
+status_messages: dict = {}  # The timestamps of the status messages of unfinished jobs, {job_id: ts}
+reply_messages: dict = {}  # The timestamps of the early answers of unfinished jobs, edited into the final result, {job_id: ts}
+CANCEL_WORDS: list = ["cancel", "stop"]  # A reply with one of these in the thread of a request cancels its analysis
+CANCEL_REACTIONS: list = [reaction.strip() for reaction in os.environ.get("CANCEL_REACTIONS", "x,no_entry,octagonal_sign").split(",") if reaction.strip()]
+dedupe_store: D = D()   # Messages already accepted, persisted so redeliveries after a restart are skipped too
 
 def check_language_exists(message: str) -> bool:
     """
@@ -37,61 +55,172 @@ def check_language_exists(message: str) -> bool:
     return False
 
 
-def message_to_dict(slack_message: str) -> dict:
+def check_if_message_already_processed(channel_id: str, message_id: str) -> bool:
     """
-    Convert a message to a dictionary for easier processing
+    Check if the message has already been processed
     Args:
-        slack_message (str): Message bot receive from Slack
+        channel_id (str): The channel of the message
+        message_id (str): The ID (timestamp) of the message
     Returns:
-        dict: The dictionary representation of the message
+        bool: True if the message has already been processed, False otherwise
     """
-    message_dict: dict = {}
-    for line in slack_message.split("\n"):
-        if ":*" in line or "*" in line:
-            key, value = line.split(":", 1)
-            key = key.replace("*", "").strip()
-            value = value.replace("*", "").strip()
-            if key == "Scope":
-                # Split by comma and strip whitespace from each item
-                message_dict[key] = [v.strip() for v in value.split(",")]
-            else:
-                message_dict[key] = value
-    return message_dict
+    return dedupe_store.check_and_add(channel_id, message_id)
 
 
-def check_if_message_already_processed(message_id: str) -> bool:
+def warm_up() -> None:
     """
-    Check if the message has already been processed
+    Look up the bot's user ID in the background, so the first event doesn't wait for `auth.test`.
+    Called by the gunicorn `post_worker_init` hook and before the development server starts
+    """
+    def resolve_bot_id() -> None:
+        try:
+            client.get_bot_id()
+        except Exception as e:
+            client.log_error("Failed to look up the bot user ID, retrying on the first event: ", str(e))
+    threading.Thread(target=resolve_bot_id, daemon=True).start()
+
+
+def check_disk_available() -> bool:
+    """
+    Check if another analysis may start, the workspaces must not be under disk pressure
+    Returns:
+        bool: True if a job may start, False if it should wait on the queue
+    """
+    return not W().is_under_pressure()
+
+
+def render_job_status(job: dict) -> str:
+    """
+    Render the status message of a job: its state and the elapsed time of every stage
     Args:
-        message_id (str): The ID of the message
+        job (dict): The job with the stages reported by the worker
     Returns:
-        bool: True if the message has already been processed, False otherwise
+        str: The message text
     """
-    if message_id in processed_messages:
-        return True
-    processed_messages.add(message_id)
-    return False
+    now: float = job["finished_at"] or time.time()
+    lines: list[str] = [f"*Analysis {job['state']}* ({now - job['submitted_at']:.0f}s)"]
+    queued_until: float = job["started_at"] or now
+    lines.append(f":white_check_mark: Queued: {queued_until - job['submitted_at']:.1f}s" if job["started_at"] else f":hourglass_flowing_sand: Queued: {queued_until - job['submitted_at']:.0f}s")
+    for stage in job["stages"]:
+        label: str | None = STAGE_LABELS.get(stage["stage"])
+        if label is None:
+            continue
+        if stage["state"] == "running" and not job["finished_at"]:
+            detail: str = f" `{job['detail']}`" if job.get("detail") else ""
+            lines.append(f":hourglass_flowing_sand: {label}: {now - stage['started_at']:.0f}s{detail}")
+        elif stage["seconds"] is not None:
+            icon: str = ":white_check_mark:" if stage["state"] == "ok" else ":x:"
+            lines.append(f"{icon} {label}: {stage['seconds']:.1f}s")
+    return "\n".join(lines)
 
 
-def do_protocol_analysis(slack_message: str) -> str:
+def post_job_progress(job: dict) -> None:
     """
-    Analyse the protocol and return a string with CLOC + additional results.
+    Post the status message of a job in the thread of the original message, or update it in place,
+    and the early answer of the analysis once it is known
     Args:
-        slack_message (str): The message from Slack
+        job (dict): A copy of the queued or running job
     Returns:
-        str: The result of the analysis
+        None
+    """
+    text: str = render_job_status(job)
+    if job["id"] in status_messages:
+        client.update_message(job["channel"], status_messages[job["id"]], text)
+    else:
+        response: dict = client.post_message(job["channel"], text, thread_ts=job["thread_ts"])
+        status_messages[job["id"]] = response["ts"]
+    if job.get("early_result") and job["id"] not in reply_messages:
+        response: dict = client.post_message(job["channel"], job["early_result"], thread_ts=job["thread_ts"])
+        reply_messages[job["id"]] = response["ts"]
+
+
+def post_job_result(job: dict) -> None:
+    """
+    Post the result of a finished analysis job in the thread of the original message, after
+    bringing its status message to the final stage times; the early answer is edited into the result,
+    or into the failure so the unformatted count doesn't stand as the answer
+    Args:
+        job (dict): The finished job
+    Returns:
+        None
+    """
+    status_ts: str | None = status_messages.pop(job["id"], None)
+    reply_ts: str | None = reply_messages.pop(job["id"], None)
+    if status_ts is not None:
+        client.update_message(job["channel"], status_ts, render_job_status(job))
+    if job["state"] == "done":
+        text: str = job["result"]
+    elif job["state"] == "cancelled":
+        text: str = "Analysis cancelled."
+    else:
+        text: str = f"Analysis failed: {job['error']}"
+    if reply_ts is not None:
+        client.update_message(job["channel"], reply_ts, text)
+    else:
+        client.post_message(job["channel"], text, thread_ts=job["thread_ts"], mergeable=True)
+
+
+# Initialise the job queue, analyses run in a pool of worker processes outside of the Slack event request
+job_queue: J = J(worker=do_protocol_analysis, on_done=post_job_result, can_start=check_disk_available, on_progress=post_job_progress)
+
+
+@app.route("/jobs", methods=["GET"])
+def get_jobs():
+    """
+    Report the queue depth, the workspace disk usage and the state of every known job
+    """
+    return jsonify({**job_queue.get_stats(), "workspaces": W().get_usage()})
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    """
+    Report the state of a single job
+    """
+    job: dict | None = job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.before_request
+def drop_slack_retries():
     """
-    # Parse the text into a dictionary
-    message: dict = message_to_dict(slack_message)
-    # Define instances of the Repository, Cloc and Framework classes
-    repository: R = R(message["Repo"], message["Client"], message["Language"], message.get("Branch", "main"), message.get("Commit", "latest"), message.get("Scope", "all"))
-    framework: F = F(repository.temp_dir)
-    cloc: C = C(repository.temp_dir, message)
-    # Clone the repository, format the code and count the lines of code
-    repository.clone_repo()
-    framework.detect_framework()
-    framework.format_code()
-    return cloc.get_cloc_result()
+    Acknowledge Slack retry deliveries before the event is verified and parsed: the first delivery was
+    received and queued, the retry only means the acknowledgement was slow. Retries of deliveries
+    that never reached the bot (`connection_failed`) go through and are de-duplicated as usual.
+    """
+    if request.path == "/slack/events" and request.headers.get("X-Slack-Retry-Num") and request.headers.get("X-Slack-Retry-Reason") != "connection_failed":
+        M().inc("slack_retries_dropped_total")
+        return Response(status=200, headers={"X-Slack-No-Retry": "1"})
+    return None
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Report stage latencies, cache hit ratios and job gauges in the Prometheus text format
+    """
+    metrics: M = M()
+    stats: dict = job_queue.get_stats()
+    usage: dict = W().get_usage()
+    hit_ratios: list[tuple[dict, float]] = []
+    for cache in ("result", "mirror", "dependency", "format"):
+        hits: float = metrics.get_counter("cache_requests_total", {"cache": cache, "outcome": "hit"})
+        misses: float = metrics.get_counter("cache_requests_total", {"cache": cache, "outcome": "miss"})
+        hit_ratios.append(({"cache": cache}, round(hits / (hits + misses), 4) if hits + misses else 0.0))
+    gauges: dict = {
+        "analysis_jobs_in_flight": [({"state": "queued"}, stats["queue_depth"]), ({"state": "running"}, stats["running"])],
+        "analysis_workers": [({}, stats["workers"])],
+        "analysis_queue_capacity": [({}, stats["queue_capacity"])],
+        "analysis_jobs_held_back": [({}, int(stats["held_back"]))],
+        "cache_hit_ratio": hit_ratios,
+        "workspace_bytes": [({}, usage["used_bytes"])],
+        "workspace_max_bytes": [({}, usage["max_bytes"])],
+        "workspace_free_disk_bytes": [({}, usage["free_disk_bytes"])],
+        "workspaces": [({"state": "busy"}, usage["busy"]), ({"state": "idle"}, usage["idle"])]
+    }
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
 
 
 @slack_events_adapter.on("message")
@@ -110,13 +239,55 @@ def handle_message(payload) -> None:
     message_id: str = event.get("ts")
     
     # Skip if we've already processed this message
-    if check_if_message_already_processed(message_id):
+    if check_if_message_already_processed(channel_id, message_id):
+        return
+
+    thread_ts: str | None = event.get("thread_ts")
+    if user_id != None and user_id != client.get_bot_id() and thread_ts and thread_ts != message_id and (text or "").strip().lower() in CANCEL_WORDS:
+        cancel_analysis(channel_id, thread_ts)
         return
     
-    if user_id != None and user_id != BOT_ID and check_language_exists(text):
-        analysis_result: str = do_protocol_analysis(text)
-        client.chat_postMessage(channel=channel_id, thread_ts=message_id, text=analysis_result) # Reply in thread if a solidity message was found
+    if user_id != None and user_id != client.get_bot_id() and check_language_exists(text):
+        # Only queue the analysis here, so Slack gets its acknowledgement within 3 seconds and doesn't retry the event
+        if job_queue.submit(channel_id, message_id, text, key=get_request_key(text)) is None:
+            client.post_message(channel_id, "The analysis queue is full at the moment, please repost the message later.", thread_ts=message_id, mergeable=True)
+
+
+def cancel_analysis(channel_id: str, thread_ts: str) -> bool:
+    """
+    Cancel the queued or running analysis requested by a message
+    Args:
+        channel_id (str): The channel of the message
+        thread_ts (str): The timestamp of the message that requested the analysis
+    Returns:
+        bool: True if an analysis was cancelled
+    """
+    job: dict | None = job_queue.find_job(channel_id, thread_ts)
+    if job is None or not job_queue.cancel(job["id"]):
+        client.post_message(channel_id, "There is no analysis in progress to cancel.", thread_ts=thread_ts, mergeable=True)
+        return False
+    return True
+
+
+@slack_events_adapter.on("reaction_added")
+def handle_reaction(payload) -> None:
+    """
+    Cancel the analysis of a message when a user reacts to it with one of the CANCEL_REACTIONS
+    Args:
+        payload (dict): The payload containing the event data
+    Returns:
+        None
+    """
+    event: dict = payload.get("event", {})
+    item: dict = event.get("item", {})
+    if event.get("reaction") not in CANCEL_REACTIONS or item.get("type") != "message" or event.get("user") == client.get_bot_id():
+        return
+    job: dict | None = job_queue.find_job(item.get("channel"), item.get("ts"))
+    if job is not None:
+        job_queue.cancel(job["id"])
 
 
-if __name__ == '__main__':   # If we run this file directly - then start the server     
-    app.run(debug=True, port=3000)
\ No newline at end of file
+if __name__ == '__main__':   # If we run this file directly - then start the development server, in production run `gunicorn -c gunicorn.conf.py bot:app`
+    warm_up()
+    # The reloader would run the module twice, with a second job queue and worker pool
+    app.run(debug=os.environ.get("FLASK_DEBUG", "").lower() in ("1", "true"), use_reloader=False, port=int(os.environ.get("PORT", "3000")))
\ No newline at end of file
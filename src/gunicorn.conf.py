@@ -0,0 +1,33 @@
+# Production server of the bot: gunicorn -c gunicorn.conf.py bot:app
+import os
+
+bind: str = f"0.0.0.0:{os.environ.get('PORT', '3000')}"
+# The job queue, its worker pool and the status messages live in the web process, so one process serves
+# every request and WEB_THREADS threads answer events concurrently; with more processes every one of them
+# would run its own queue and pool, and a cancel reply could reach a process that doesn't own the job
+workers: int = int(os.environ.get("WEB_WORKERS", "1"))
+worker_class: str = "gthread"
+threads: int = int(os.environ.get("WEB_THREADS", "8"))
+# Slack expects the acknowledgement of an event within 3 seconds, a request never waits for an analysis
+timeout: int = 30
+graceful_timeout: int = 30
+keepalive: int = 5
+# Not preloaded: the job queue starts threads that must be created in the worker, not in the master
+preload_app: bool = False
+accesslog: str = "-"
+
+
+def post_worker_init(worker) -> None:
+    """
+    Looks up the bot user ID once the worker imported the app, before the first event arrives
+    """
+    import bot
+    bot.warm_up()
+
+
+def worker_exit(server, worker) -> None:
+    """
+    Stops the job queue of the worker, so its analysis processes don't outlive it
+    """
+    import bot
+    bot.job_queue.shutdown()
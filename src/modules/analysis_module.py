@@ -0,0 +1,260 @@
+import git
+import json
+import re
+import subprocess
+import time
+from modules.cloc_module import Cloc as C
+from modules.estimate_module import LocEstimate as LE
+from modules.framework_module import Framework as F
+from modules.incremental_module import IncrementalCount as IC
+from modules.loc_counter_module import LocCounter as LC
+from modules.log_module import log_context
+from modules.mirror_module import MirrorCache as MC
+from modules.pipeline_module import Pipeline as P
+from modules.progress_module import Progress
+from modules.repository_module import RemoteRepository as RR, Repository as R
+from modules.result_cache_module import ResultCache as RC
+from modules.scope_module import Scope as S
+from modules.single_flight_module import SingleFlight as SF
+from modules.tree_index_module import TreeIndex
+from modules.workspace_module import WorkspaceManager as WM
+
+# The analysis pipeline shared by the Slack bot and the batch CLI, it needs no Slack credentials
+
+class AnalysisError(Exception):
+    """
+    An analysis that can't produce a result, e.g. because the repository can't be cloned
+    """
+
+def message_to_dict(slack_message: str) -> dict:
+    """
+    Convert a message to a dictionary for easier processing
+    Args:
+        slack_message (str): Message bot receive from Slack
+    Returns:
+        dict: The dictionary representation of the message
+    """
+    message_dict: dict = {}
+    for line in slack_message.split("\n"):
+        if ":*" in line or "*" in line:
+            key, value = line.split(":", 1)
+            key = key.replace("*", "").strip()
+            value = value.replace("*", "").strip()
+            if key == "Scope":
+                # Split by comma and strip whitespace from each item
+                message_dict[key] = [v.strip() for v in value.split(",")]
+            else:
+                message_dict[key] = value
+    return message_dict
+
+
+def run_analysis(repository: R, message: dict, result_cache: RC, span: dict, workspaces: WM | None = None) -> str:
+    """
+    Clone the repository, format the code and count the lines of code
+    Args:
+        repository (R): The repository from the message
+        message (dict): The parsed message
+        result_cache (RC): The result cache, for the settings key of the stored per-file counts
+        span (dict): The attributes of the `analysis` span
+        workspaces (WM): The manager the repository's workspace is leased from, enforces the per-job disk quota
+    Returns:
+        str: The result of the analysis
+    """
+    framework: F = F(repository.temp_dir)
+    cloc: C = C(repository.temp_dir, message)
+    base: str | None = message.get("Base")  # Base commit of a fix review, only the files changed since it are recounted
+    if repository.clone_repo() is None:
+        raise AnalysisError(f"Failed to clone repository {repository.repo_ssh}")
+    if workspaces:
+        span["clone_bytes"] = workspaces.check_quota(repository.temp_dir)
+    # One walk of the checkout serves the framework detection and the scope, which leaves out the directories cloc excludes
+    index: TreeIndex = framework.build_index()
+    scope: S = S(repository.temp_dir, repository.scope, repository.language, index)
+    span["framework"] = framework.detect_framework(index)
+    span["projects"] = len(framework.projects)
+    with repository.bind(framework=span["framework"]):
+        incremental: IC = IC(repository, framework, MC.normalise_url(repository.repo_ssh), result_cache.get_settings_key(repository.scope, repository.language), scope)
+        if base:
+            return incremental.run(base)
+        # Resolve the files in scope once, they are both formatted and counted
+        files: list[str] = scope.get_files()
+        span["files"] = len(files)
+
+        def early_count(results: dict) -> list[dict]:
+            # The unformatted count is answered right away, the formatted one edits the reply later
+            with cloc.span("early_count", files=len(files)) as early_span:
+                file_counts: list[dict] = cloc.count_files(files)  # The same engine as the formatted count, for the diff
+                early_span["code_lines"] = LC.get_totals(file_counts)["code"]
+            Progress.report_result(log_context.get().get("job"), cloc.get_early_result(file_counts))
+            return file_counts
+
+        def format_files(results: dict) -> bool:
+            formatted: bool = framework.format_code(files)
+            if workspaces:  # The dependency install is what usually blows up a checkout
+                span["workspace_bytes"] = workspaces.check_quota(repository.temp_dir)
+            return formatted
+
+        # The dependency install doesn't touch the files in scope, it runs while they are counted unformatted
+        results: dict = (
+            P()
+            .add("early_count", early_count)
+            .add("prepare", lambda results: framework.prepare())
+            .add("format", format_files, after=["early_count", "prepare"])
+            .add("count", lambda results: cloc.get_cloc_result(files, formatted=results["format"]), after=["format"])
+            .run()
+        )
+        analysis_result: str = results["count"]
+        span["formatted"] = results["format"]
+        if framework.is_monorepo():
+            frameworks: dict[str, str] = {project["path"]: project["framework"] for project in framework.projects}
+            analysis_result += "\n" + cloc.get_package_result(framework.group_files(files), frameworks)
+        if results["format"]:
+            analysis_result += "\n" + cloc.get_formatting_diff(results["early_count"], files)
+            incremental.save_snapshot(files, cloc.file_counts)
+        return analysis_result
+
+
+def analyse_in_workspace(remote: RR, message: dict, result_cache: RC, span: dict) -> str:
+    """
+    Analyse a repository in a workspace leased for the job, which is kept warm for the next analysis of
+    the repository or reclaimed if the job fails
+    Args:
+        remote (RR): The repository from the message
+        message (dict): The parsed message
+        result_cache (RC): The result cache, for the settings key of the stored per-file counts
+        span (dict): The attributes of the `analysis` span
+    Returns:
+        str: The result of the analysis
+    """
+    repo_key: str = MC.normalise_url(remote.repo_ssh)
+    workspaces: WM = WM.for_repo(repo_key)
+    with workspaces.acquire(repo_key) as workspace:
+        repository: R = R(remote.repo_ssh, remote.client, remote.language, remote.branch, remote.commit, remote.scope, workspace=workspace)
+        return run_analysis(repository, message, result_cache, span, workspaces)
+
+
+def analyse_repository(remote: RR, message: dict, bypass_cache: bool, commit_sha: str | None, span: dict) -> str:
+    """
+    Analyse a repository inside the `analysis` span of a job, answering from the result cache when possible
+    and running at most one analysis of the same commit, scope and language at a time across all workers.
+    The workspace is only leased once the single-flight lock is held, a waiting job doesn't keep one
+    Args:
+        remote (RR): The repository from the message
+        message (dict): The parsed message
+        bypass_cache (bool): Don't answer from the result cache
+        commit_sha (str): The resolved commit SHA, None if it can only be resolved after cloning
+        span (dict): The attributes of the `analysis` span
+    Returns:
+        str: The result of the analysis
+    """
+    requested_at: float = time.time()
+    base: str | None = message.get("Base")
+    result_cache: RC = RC()
+    cache_key: str | None = None
+    if commit_sha and (base is None or re.fullmatch(r"[0-9a-f]{40}", base.lower())):
+        cache_key = result_cache.build_key(f"{base.lower()}..{commit_sha}" if base else commit_sha, remote.scope, remote.language)
+    if cache_key is None:
+        return analyse_in_workspace(remote, message, result_cache, span)
+    with SF().lock(cache_key) as waited:
+        span["coalesced"] = waited
+        # Reply from the result cache if the same commit and scope were analysed before, a bypassing
+        # request only takes the result of an identical analysis it waited for
+        if not bypass_cache or waited:
+            cached_result: str | None = result_cache.get(cache_key, not_before=requested_at if bypass_cache else None)
+            span["result_cache_hit"] = cached_result is not None
+            if cached_result is not None:
+                return cached_result
+        analysis_result: str = analyse_in_workspace(remote, message, result_cache, span)
+        if span.get("formatted", True):  # A formatting failure may not last, the next request retries it
+            result_cache.put(cache_key, analysis_result)
+        return analysis_result
+
+
+def get_request_key(slack_message: str) -> str | None:
+    """
+    Build the key of identical requests from the unresolved message fields, so concurrent duplicates
+    are coalesced on the queue without a network call in the Slack event handler
+    Args:
+        slack_message (str): The message from Slack
+    Returns:
+        str: The key, or None if the message can't be parsed
+    """
+    try:
+        message: dict = message_to_dict(slack_message)
+    except ValueError:
+        return None
+    if not message.get("Repo") or not message.get("Language"):
+        return None
+    return json.dumps([
+        MC.normalise_url(message["Repo"]),
+        message.get("Branch", "main").lower(),
+        message.get("Commit", "latest").lower(),
+        message.get("Base", "").lower(),
+        message.get("Mode", "").lower(),
+        RC.normalise_scope(message.get("Scope", "all")),
+        message["Language"].lower(),
+        RC.is_bypassed(slack_message)
+    ])
+
+
+def estimate_message(message: dict, bypass_cache: bool = False) -> str:
+    """
+    Estimate the lines of code in scope from the git objects of the requested commit, without a checkout
+    Args:
+        message (dict): The fields as returned by `message_to_dict`, the base commit of a fix review is ignored
+        bypass_cache (bool): Don't answer from the result cache
+    Returns:
+        str: The result of the estimate
+    """
+    repository: RR = RR(message["Repo"], message["Client"], message["Language"], message.get("Branch", "main"), message.get("Commit", "latest"), message.get("Scope", "all"))
+    result_cache: RC = RC()
+    with repository.bind(repo=repository.repo_ssh, branch=repository.branch):
+        with repository.span("estimate", language=repository.language) as span:
+            try:
+                with repository.open_objects() as (git_dir, commit_sha):
+                    span["commit"] = commit_sha
+                    cache_key: str = result_cache.build_key(f"estimate:{commit_sha}", repository.scope, repository.language)
+                    if not bypass_cache:
+                        cached_result: str | None = result_cache.get(cache_key)
+                        span["result_cache_hit"] = cached_result is not None
+                        if cached_result is not None:
+                            return cached_result
+                    estimate_result: str = LE(repository).get_result(git_dir, commit_sha)
+            except (git.GitCommandError, subprocess.TimeoutExpired) as e:
+                repository.log_error("Failed to fetch repository: ", str(e))
+                raise AnalysisError(f"Failed to fetch repository {repository.repo_ssh} or commit {repository.commit}")
+            result_cache.put(cache_key, estimate_result)
+            return estimate_result
+
+
+def analyse_message(message: dict, bypass_cache: bool = False) -> str:
+    """
+    Analyse the protocol described by the fields of a message. The commit is resolved and identical analyses
+    are coalesced before a workspace is leased for the job. Every stage is logged as a timed JSON span carrying the repository, commit and framework.
+    Args:
+        message (dict): The fields as returned by `message_to_dict` (Client, Repo, Language, Branch, Commit, Scope, Base, Mode)
+        bypass_cache (bool): Don't answer from the result cache
+    Returns:
+        str: The result of the analysis
+    """
+    if message.get("Mode", "").lower() == "estimate":
+        return estimate_message(message, bypass_cache)
+    remote: RR = RR(message["Repo"], message["Client"], message["Language"], message.get("Branch", "main"), message.get("Commit", "latest"), message.get("Scope", "all"))
+    with remote.span("resolve_commit", repo=remote.repo_ssh, branch=remote.branch) as span:
+        commit_sha: str | None = remote.resolve_commit()
+        span["resolved"] = commit_sha is not None
+    with remote.bind(repo=remote.repo_ssh, branch=remote.branch, commit=commit_sha or remote.commit):
+        with remote.span("analysis", language=remote.language) as span:
+            return analyse_repository(remote, message, bypass_cache, commit_sha, span)
+
+
+def do_protocol_analysis(slack_message: str) -> str:
+    """
+    Analyse the protocol and return a string with CLOC + additional results.
+    Args:
+        slack_message (str): The message from Slack
+    Returns:
+        str: The result of the analysis
+    """
+    # Parse the text into a dictionary
+    return analyse_message(message_to_dict(slack_message), RC.is_bypassed(slack_message))
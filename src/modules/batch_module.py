@@ -0,0 +1,175 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from modules.analysis_module import analyse_message
+from modules.cancel_module import Cancellation
+from modules.log_module import Log
+from modules.stage_limit_module import StageLimits
+
+def run_entry(entry: dict, bypass_cache: bool) -> dict:
+    """
+    Analyse one manifest entry in a worker process, stopped at JOB_TIMEOUT_SECONDS like a Slack job
+    Args:
+        entry (dict): The manifest entry with its `id`
+        bypass_cache (bool): Don't answer from the result cache
+    Returns:
+        dict: The output record of the entry
+    """
+    started_at: float = time.time()
+    record: dict = {"id": entry["id"], "input": entry, "started_at": round(started_at, 3)}
+    try:
+        with Log().bind(job=entry["id"]), Cancellation.watch(entry["id"]):
+            record["result"] = analyse_message(entry, bypass_cache)
+        record["status"] = "done"
+    except Exception as e:
+        record["error"] = str(e) or e.__class__.__name__
+        record["status"] = "failed"
+    record["seconds"] = round(time.time() - started_at, 3)
+    return record
+
+
+class BatchRunner(Log):
+    """
+    Analyses the repositories of a JSONL or CSV manifest with bounded concurrency and streams one JSONL
+    record per repository as it completes. Entries already done in the output file are skipped, so an
+    interrupted batch continues where it stopped.
+    """
+    FIELDS: list[str] = ["Client", "Repo", "Language", "Branch", "Commit", "Scope", "Base", "Mode"]
+    REQUIRED_FIELDS: list[str] = ["Client", "Repo", "Language"]
+
+
+    def __init__(self, output_path: str, concurrency: int = 2, stage_limits: str | None = None, bypass_cache: bool = False) -> None:
+        """
+        Initialize the runner
+        Args:
+            output_path (str): The JSONL file the records are appended to
+            concurrency (int): The number of repositories analysed at the same time
+            stage_limits (str): Per-stage limits like `clone=2,install=1`, STAGE_LIMITS by default
+            bypass_cache (bool): Don't answer from the result cache
+        """
+        self.output_path: str = output_path
+        self.concurrency: int = concurrency
+        self.stage_limits: str | None = stage_limits
+        self.bypass_cache: bool = bypass_cache
+
+
+    @classmethod
+    def normalise_entry(cls, raw_entry: dict, line_number: int) -> dict:
+        """
+        Returns a manifest entry with the fields `message_to_dict` produces and a stable `id`
+        Args:
+            raw_entry (dict): The entry as read from the manifest (keys are matched case-insensitively)
+            line_number (int): The position in the manifest, for error messages
+        Returns:
+            dict: The entry
+        """
+        fields: dict = {key.strip().lower(): value for key, value in raw_entry.items() if key and value not in (None, "")}
+        entry: dict = {}
+        for field in cls.FIELDS:
+            value = fields.get(field.lower())
+            if value is None:
+                continue
+            if field == "Scope":
+                # Like in a Slack message, a scope is a comma separated list (a JSON list is accepted too)
+                entry[field] = [item.strip() for item in value] if isinstance(value, list) else [item.strip() for item in str(value).split(",")]
+            else:
+                entry[field] = str(value).strip()
+        missing: list[str] = [field for field in cls.REQUIRED_FIELDS if field not in entry]
+        if missing:
+            raise ValueError(f"Manifest entry {line_number} is missing {', '.join(missing)}")
+        entry["id"] = str(fields.get("id") or hashlib.sha256(json.dumps(entry, sort_keys=True).encode()).hexdigest()[:16])
+        return entry
+
+
+    @classmethod
+    def read_manifest(cls, manifest_path: str) -> list[dict]:
+        """
+        Reads a JSONL (one object per line) or CSV (header row) manifest
+        Args:
+            manifest_path (str): The path to the manifest, the format is picked by the extension
+        Returns:
+            list[dict]: The entries
+        """
+        with open(manifest_path, "r", newline="") as manifest_file:
+            if manifest_path.lower().endswith(".csv"):
+                raw_entries: list[dict] = list(csv.DictReader(manifest_file))
+            else:
+                raw_entries: list[dict] = [json.loads(line) for line in manifest_file if line.strip()]
+        entries: list[dict] = [cls.normalise_entry(raw_entry, index + 1) for index, raw_entry in enumerate(raw_entries)]
+        ids: list[str] = [entry["id"] for entry in entries]
+        duplicates: set[str] = {entry_id for entry_id in ids if ids.count(entry_id) > 1}
+        if duplicates:
+            raise ValueError(f"Duplicate manifest entries: {', '.join(sorted(duplicates))}")
+        return entries
+
+
+    def get_done_ids(self) -> set[str]:
+        """
+        Returns the IDs of the entries the output file already has a successful record of
+        """
+        done: set[str] = set()
+        if not os.path.isfile(self.output_path):
+            return done
+        with open(self.output_path, "r") as output_file:
+            for line in output_file:
+                try:
+                    record: dict = json.loads(line)
+                except ValueError:
+                    continue  # A line cut off by the interruption
+                if record.get("status") == "done":
+                    done.add(record["id"])
+        return done
+
+
+    def __open_output(self):
+        """
+        Opens the output for appending, terminating a line cut off by an interruption first
+        """
+        output_file = open(self.output_path, "a+")
+        output_file.seek(0, os.SEEK_END)
+        if output_file.tell() > 0:
+            output_file.seek(output_file.tell() - 1)
+            if output_file.read(1) != "\n":
+                output_file.write("\n")
+        return output_file
+
+
+    def run(self, entries: list[dict]) -> dict:
+        """
+        Analyses the entries that aren't done yet, writing each record as soon as it completes
+        Args:
+            entries (list[dict]): The manifest entries
+        Returns:
+            dict: The number of entries {"total", "skipped", "done", "failed"}
+        """
+        done_ids: set[str] = self.get_done_ids()
+        pending: list[dict] = [entry for entry in entries if entry["id"] not in done_ids]
+        summary: dict = {"total": len(entries), "skipped": len(entries) - len(pending), "done": 0, "failed": 0}
+        self.log_info("Entries to analyse: ", f"{len(pending)} ({summary['skipped']} already done)")
+        if not pending:
+            return summary
+        executor: ProcessPoolExecutor = ProcessPoolExecutor(
+            max_workers=max(1, min(self.concurrency, len(pending))),
+            initializer=StageLimits.configure,
+            initargs=(StageLimits.create(self.stage_limits),)
+        )
+        try:
+            with self.__open_output() as output_file:
+                futures: list[Future] = [executor.submit(run_entry, entry, self.bypass_cache) for entry in pending]
+                for future in as_completed(futures):
+                    record: dict = future.result()
+                    record["finished_at"] = round(time.time(), 3)
+                    output_file.write(json.dumps(record) + "\n")
+                    output_file.flush()
+                    summary[record["status"]] += 1
+                    if record["status"] == "done":
+                        self.log_success("Analysed: ", f"{record['id']} {record['input']['Repo']} ({record['seconds']}s)")
+                    else:
+                        self.log_error("Analysis failed: ", f"{record['id']} {record['input']['Repo']}: {record['error']}")
+        finally:
+            # On an interruption, queued entries are cancelled and picked up again by the next run
+            executor.shutdown(wait=True, cancel_futures=True)
+        return summary
@@ -0,0 +1,312 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from modules.analysis_module import do_protocol_analysis, message_to_dict
+from modules.cache_module import DiskCache
+from modules.cloc_module import Cloc
+from modules.fake_slack_module import FakeSlack
+from modules.framework_module import Framework
+from modules.log_module import Log
+from modules.mirror_module import MirrorCache
+from modules.repository_module import Repository
+from modules.result_cache_module import ResultCache
+from modules.scope_module import Scope
+from modules.synthetic_repo_module import SyntheticRepo
+from modules.tree_index_module import TreeIndex
+from modules.workspace_module import WorkspaceManager
+
+class RssSampler:
+    """
+    Samples the resident set size of this process and all its descendants (worker pools, git, npm, forge)
+    in a background thread and keeps the peak.
+    """
+    INTERVAL_SECONDS: float = 0.01
+
+
+    def __init__(self) -> None:
+        self.peak_bytes: int = 0
+        self.stopped: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.__sample, daemon=True)
+
+
+    @staticmethod
+    def get_tree_rss(pid: int) -> int:
+        """
+        Returns the summed RSS in bytes of a process and its descendants (Linux /proc)
+        """
+        total: int = 0
+        stack: list[int] = [pid]
+        while stack:
+            current: int = stack.pop()
+            try:
+                with open(f"/proc/{current}/status", "r") as status_file:
+                    for line in status_file:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+                            break
+                for task in os.listdir(f"/proc/{current}/task"):
+                    with open(f"/proc/{current}/task/{task}/children", "r") as children_file:
+                        stack += [int(child) for child in children_file.read().split()]
+            except (OSError, ValueError):
+                continue  # The process exited while we were reading it
+        return total
+
+
+    def __sample(self) -> None:
+        while not self.stopped.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.get_tree_rss(os.getpid()))
+            self.stopped.wait(self.INTERVAL_SECONDS)
+
+
+    def __enter__(self) -> "RssSampler":
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self.peak_bytes = max(self.peak_bytes, self.get_tree_rss(os.getpid()))
+
+
+class Benchmark(Log):
+    """
+    Runs the analysis stages against synthetic repositories and reports, per stage, the throughput,
+    p50/p95 latency, peak RSS and disk usage. The first iteration of a scenario runs with cold caches,
+    the following ones with the caches the earlier iterations filled.
+    """
+    STAGES: list[str] = ["clone_repo", "format_code", "get_cloc_result", "do_protocol_analysis", "bot_startup", "early_reply", "handle_message", "slack_reply"]
+    CHANNEL: str = "CBENCH"
+
+
+    def __init__(self, workdir: str, fake_slack: FakeSlack, iterations: int = 5, use_result_cache: bool = False) -> None:
+        """
+        Initialize the benchmark
+        Args:
+            workdir (str): The directory for the synthetic repositories and the caches
+            fake_slack (FakeSlack): The running fake Slack the bot is pointed at
+            iterations (int): The number of runs of every stage per scenario
+            use_result_cache (bool): Let the bot stages answer from the result cache instead of bypassing it
+        """
+        self.workdir: str = workdir
+        self.fake_slack: FakeSlack = fake_slack
+        self.iterations: int = iterations
+        self.use_result_cache: bool = use_result_cache
+        self.samples: dict[str, dict[str, list[dict]]] = {}
+        self.scenarios: dict[str, dict] = {}
+
+
+    @contextmanager
+    def measure(self, scenario: str, stage: str, disk_path: str | None = None, files: int | None = None) -> Iterator[dict]:
+        """
+        Times a stage and records its peak RSS and the disk usage of `disk_path` afterwards
+        Args:
+            scenario (str): The scenario name
+            stage (str): The stage name
+            disk_path (str): The directory whose size is the disk usage of the stage
+            files (int): The number of files the stage processes
+        Returns:
+            dict: The sample, the stage may set `status`
+        """
+        sample: dict = {"status": "ok", "files": files}
+        start: float = time.perf_counter()
+        with RssSampler() as sampler:
+            try:
+                yield sample
+            except Exception as e:
+                # A failing stage (e.g. a missing formatter) is recorded, not fatal for the whole run
+                sample["status"] = "error"
+                sample["error"] = str(e) or e.__class__.__name__
+                self.log_error(f"Stage {stage} failed: ", sample["error"])
+        sample["seconds"] = time.perf_counter() - start
+        sample["peak_rss_bytes"] = sampler.peak_bytes
+        sample["disk_bytes"] = DiskCache.get_dir_size(disk_path) if disk_path else None
+        self.samples.setdefault(scenario, {}).setdefault(stage, []).append(sample)
+
+
+    def build_message(self, repo_path: str) -> str:
+        """
+        Returns the Slack message asking for an analysis of the repository
+        """
+        lines: list[str] = ["*Client:* bench", "*Language:* Solidity", f"*Repo:* {repo_path}", "*Branch:* main", "*Commit:* latest", "*Scope:* all"]
+        if not self.use_result_cache:
+            lines.append(ResultCache.BYPASS_KEYWORD)
+        return "\n".join(lines)
+
+
+    def __run_module_stages(self, scenario: str, repo_path: str, message: dict) -> None:
+        """
+        Runs the clone, format and count stages directly on the modules, in a workspace leased like the bot's
+        """
+        repo_key: str = MirrorCache.normalise_url(repo_path)
+        with WorkspaceManager.for_repo(repo_key).acquire(repo_key) as workspace:
+            repository: Repository = Repository(repo_path, message["Client"], message["Language"], message["Branch"], message["Commit"], message["Scope"], workspace=workspace)
+            with self.measure(scenario, "clone_repo", disk_path=repository.temp_dir) as sample:
+                if repository.clone_repo() is None:
+                    sample["status"] = "error"
+            framework: Framework = Framework(repository.temp_dir)
+            index: TreeIndex = framework.build_index()
+            framework.detect_framework(index)
+            files: list[str] = Scope(repository.temp_dir, repository.scope, repository.language, index).get_files()
+            with self.measure(scenario, "format_code", disk_path=repository.temp_dir, files=len(files)) as sample:
+                formatted: bool = framework.format_code(files)
+                if not formatted:
+                    sample["status"] = "error"
+            with self.measure(scenario, "get_cloc_result", files=len(files)):
+                Cloc(repository.temp_dir, message).get_cloc_result(files, formatted)
+
+
+    def __run_bot_stages(self, scenario: str, text: str, iteration: int) -> None:
+        """
+        Runs the full analysis in-process and through the Slack events endpoint, the job queue and the reply.
+        Both lease their checkout from the workspace manager, so after the first iteration they run on a warm workspace.
+        """
+        with self.measure(scenario, "do_protocol_analysis", disk_path=WorkspaceManager.ROOT):
+            do_protocol_analysis(text)
+        with self.measure(scenario, "bot_startup"):
+            # A fresh interpreter importing the app and answering its first request
+            subprocess.run([sys.executable, "-c", "import bot; bot.app.test_client().get('/jobs')"], cwd=os.path.dirname(os.path.dirname(__file__)), check=True, capture_output=True, timeout=120)
+        import bot  # Imported late: the Slack client reads SLACK_API_URL at import, so it has to point at the fake Slack
+        ts: str = f"{time.time():.6f}"
+        body, headers = self.fake_slack.build_event(text, self.CHANNEL, ts)
+        first_reply: dict | None = None
+        with self.measure(scenario, "handle_message", disk_path=WorkspaceManager.ROOT) as sample:
+            with self.measure(scenario, "early_reply") as early_sample:
+                response = bot.app.test_client().post("/slack/events", data=body, headers=headers)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Events endpoint answered {response.status_code}")
+                # The early answer, or the result of an analysis without one (e.g. from the result cache),
+                # not the status message the bot posts while the job runs
+                first_reply = self.fake_slack.wait_for_call("chat.postMessage", thread_ts=ts, match=lambda params: not str(params.get("text")).startswith("*Analysis "))
+                if first_reply is None:
+                    early_sample["status"] = "error"
+            reply: dict | None = first_reply
+            if first_reply is not None and str(first_reply["params"].get("text")).startswith("*Unformatted count"):
+                # The final result edits the early answer, a failure is posted as a new reply
+                reply_ts: str = first_reply["response"]["ts"]
+                reply = self.fake_slack.wait_for_call(
+                    ("chat.update", "chat.postMessage"),
+                    match=lambda params: params.get("ts") == reply_ts or (params.get("thread_ts") == ts and str(params.get("text")).startswith("Analysis "))
+                )
+            if reply is None or "Analysis failed" in str(reply["params"].get("text")):
+                sample["status"] = "error"
+        with self.measure(scenario, "slack_reply"):
+            # The reply alone, through the pooled Slack client
+            bot.post_job_result({"id": f"bench-{ts}", "channel": self.CHANNEL, "thread_ts": ts, "state": "done", "result": reply["params"]["text"] if reply else ""})
+        self.log_info(f"Iteration {iteration + 1} of {scenario} finished")
+
+
+    def run_scenario(self, synthetic_repo: SyntheticRepo) -> None:
+        """
+        Generates the repository of a scenario and runs every stage `iterations` times
+        Args:
+            synthetic_repo (SyntheticRepo): The repository generator
+        """
+        scenario: str = synthetic_repo.get_name()
+        repo_path: str = synthetic_repo.generate(os.path.join(self.workdir, "repos", f"{scenario}.git"))
+        self.scenarios[scenario] = {"spec": synthetic_repo.spec}
+        text: str = self.build_message(repo_path)
+        message: dict = message_to_dict(text)
+        for iteration in range(self.iterations):
+            self.__run_module_stages(scenario, repo_path, message)
+            self.__run_bot_stages(scenario, text, iteration)
+        self.scenarios[scenario]["cache_bytes"] = DiskCache.get_dir_size(os.path.join(self.workdir, "cache"))
+
+
+    @staticmethod
+    def percentile(values: list[float], fraction: float) -> float:
+        """
+        Returns a percentile with linear interpolation between the closest ranks
+        """
+        ordered: list[float] = sorted(values)
+        position: float = (len(ordered) - 1) * fraction
+        lower: int = int(position)
+        upper: int = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+    @classmethod
+    def summarise(cls, samples: list[dict]) -> dict:
+        """
+        Returns the statistics of the samples of one stage
+        """
+        seconds: list[float] = [sample["seconds"] for sample in samples]
+        total_seconds: float = sum(seconds)
+        files: int = sum(sample["files"] or 0 for sample in samples)
+        disk: list[int] = [sample["disk_bytes"] for sample in samples if sample["disk_bytes"] is not None]
+        return {
+            "runs": len(samples),
+            "errors": sum(1 for sample in samples if sample["status"] != "ok"),
+            "cold_seconds": round(seconds[0], 4),
+            "p50_seconds": round(cls.percentile(seconds, 0.5), 4),
+            "p95_seconds": round(cls.percentile(seconds, 0.95), 4),
+            "max_seconds": round(max(seconds), 4),
+            "runs_per_second": round(len(samples) / total_seconds, 4) if total_seconds else None,
+            "files_per_second": round(files / total_seconds, 2) if files and total_seconds else None,
+            "peak_rss_bytes": max(sample["peak_rss_bytes"] for sample in samples),
+            "disk_bytes": max(disk) if disk else None
+        }
+
+
+    def get_report(self) -> dict:
+        """
+        Returns the results with the environment they were measured in
+        """
+        try:
+            revision: str = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__), capture_output=True, text=True).stdout.strip()
+        except OSError:
+            revision: str = ""
+        return {
+            "meta": {
+                "revision": revision,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "iterations": self.iterations,
+                "result_cache": self.use_result_cache
+            },
+            "scenarios": {
+                scenario: {**details, "stages": {stage: self.summarise(stage_samples) for stage, stage_samples in self.samples.get(scenario, {}).items()}}
+                for scenario, details in self.scenarios.items()
+            }
+        }
+
+
+    @staticmethod
+    def compare(base: dict, current: dict, threshold: float = 0.1, min_seconds: float = 0.05) -> list[dict]:
+        """
+        Compares the latencies of two reports
+        Args:
+            base (dict): The report of the reference run
+            current (dict): The report of the new run
+            threshold (float): The relative slowdown reported as a regression
+            min_seconds (float): Slowdowns below this many seconds are noise, never regressions
+        Returns:
+            list[dict]: One row per scenario, stage and metric present in both reports
+        """
+        rows: list[dict] = []
+        for scenario, details in current["scenarios"].items():
+            base_stages: dict = base["scenarios"].get(scenario, {}).get("stages", {})
+            for stage, stats in details["stages"].items():
+                if stage not in base_stages:
+                    continue
+                for metric in ("p50_seconds", "p95_seconds"):
+                    old, new = base_stages[stage][metric], stats[metric]
+                    change: float | None = (new - old) / old if old else None
+                    rows.append({
+                        "scenario": scenario,
+                        "stage": stage,
+                        "metric": metric,
+                        "base": old,
+                        "current": new,
+                        "change": round(change, 4) if change is not None else None,
+                        "regression": change is not None and change > threshold and new - old > min_seconds
+                    })
+        return rows
@@ -0,0 +1,181 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from modules.log_module import Log
+
+class DiskCache(Log):
+    """
+    Base class for on-disk caches shared between worker processes.
+    Every entry is a directory under `root` with a metadata file (size, last use) and a lock file,
+    entries are evicted in LRU order once the cache grows over `max_bytes`.
+    """
+    LOCKS_DIR: str = ".locks"
+    META_DIR: str = ".meta"
+
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        """
+        Initialize the cache in the given directory
+        Args:
+            root (str): The directory holding the cache entries
+            max_bytes (int): The size the cache is trimmed down to on eviction
+        """
+        self.root: str = root
+        self.max_bytes: int = max_bytes
+        os.makedirs(os.path.join(self.root, self.LOCKS_DIR), exist_ok=True)
+        os.makedirs(os.path.join(self.root, self.META_DIR), exist_ok=True)
+
+
+    def get_entry_path(self, name: str) -> str:
+        """
+        Returns the path of a cache entry
+        """
+        return os.path.join(self.root, name)
+
+
+    @contextmanager
+    def lock(self, name: str, exclusive: bool = True, blocking: bool = True) -> Iterator[bool]:
+        """
+        Locks a cache entry across processes with `flock`
+        Args:
+            name (str): The name of the entry
+            exclusive (bool): Take an exclusive (writer) lock instead of a shared (reader) one
+            blocking (bool): Wait for the lock instead of giving up immediately
+        Yields:
+            bool: True if the lock was acquired, False if `blocking` is off and the entry is busy
+        """
+        lock_path: str = os.path.join(self.root, self.LOCKS_DIR, f"{name}.lock")
+        flags: int = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def __get_meta_path(self, name: str) -> str:
+        return os.path.join(self.root, self.META_DIR, f"{name}.json")
+
+
+    def read_meta(self, name: str) -> dict:
+        """
+        Returns the metadata of an entry (empty if it was never recorded)
+        """
+        try:
+            with open(self.__get_meta_path(name), "r") as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return {}
+
+
+    def write_meta(self, name: str, **fields) -> None:
+        """
+        Updates the metadata of an entry
+        """
+        meta: dict = self.read_meta(name)
+        meta.update(fields)
+        meta_path: str = self.__get_meta_path(name)
+        temp_path: str = f"{meta_path}.{os.getpid()}-{threading.get_ident()}.tmp"  # Readers of an entry share its lock
+        with open(temp_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_path, meta_path)
+
+
+    def touch(self, name: str) -> None:
+        """
+        Marks an entry as recently used
+        """
+        self.write_meta(name, last_used=time.time())
+
+
+    @staticmethod
+    def get_dir_size(path: str) -> int:
+        """
+        Returns the size in bytes of all files below a directory, without following symlinks
+        """
+        total: int = 0
+        stack: list[str] = [path]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+        return total
+
+
+    def record_size(self, name: str) -> int:
+        """
+        Measures an entry and stores its size in the metadata
+        """
+        size: int = self.get_dir_size(self.get_entry_path(name))
+        self.write_meta(name, size=size)
+        return size
+
+
+    def list_entries(self) -> list[str]:
+        """
+        Returns the names of all entries in the cache, without the ones still being written
+        """
+        return [entry.name for entry in os.scandir(self.root) if entry.is_dir() and not entry.name.startswith(".") and not entry.name.endswith(".partial")]
+
+
+    def remove(self, name: str) -> None:
+        """
+        Deletes an entry and its metadata (the caller must hold the entry lock)
+        """
+        shutil.rmtree(self.get_entry_path(name), ignore_errors=True)
+        try:
+            os.remove(self.__get_meta_path(name))
+        except OSError:
+            pass
+
+
+    def evict(self) -> list[str]:
+        """
+        Removes the least recently used entries until the cache fits into `max_bytes`.
+        Entries locked by a running job are skipped.
+        Returns:
+            list[str]: The names of the removed entries
+        """
+        removed: list[str] = []
+        with self.lock(".evict", blocking=False) as acquired:
+            if not acquired:  # Another process is already evicting
+                return removed
+            entries: list[tuple[float, int, str]] = []
+            for name in self.list_entries():
+                meta: dict = self.read_meta(name)
+                size: int = meta["size"] if "size" in meta else self.record_size(name)
+                entries.append((meta.get("last_used", 0.0), size, name))
+            total: int = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with self.lock(name, blocking=False) as entry_acquired:
+                    if not entry_acquired:
+                        continue
+                    self.remove(name)
+                total -= size
+                removed.append(name)
+        if removed:
+            self.log_info("Evicted cache entries: ", ", ".join(removed))
+        return removed
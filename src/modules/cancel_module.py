@@ -0,0 +1,151 @@
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from modules.config_module import Config
+
+class JobCancelledError(Exception):
+    """
+    The job was cancelled from Slack while it ran
+    """
+
+
+class JobTimeoutError(Exception):
+    """
+    The job ran longer than JOB_TIMEOUT_SECONDS
+    """
+
+
+class Cancellation:
+    """
+    Cancellation and the wall-clock deadline of the job running in a worker process. The web process
+    requests a cancellation with a flag file, a watchdog thread in the worker notices it (or the deadline),
+    kills every process the job spawned (git, npm, forge) and the next stage refuses to start, so the worker
+    and its pool slot are free within seconds. Plain class (not Log) because the log module checks it.
+    """
+    CANCEL_DIR: str = Config.get_path("CANCEL_DIR", "~/.cache/pre-audit-bot/cancel")
+    JOB_TIMEOUT_SECONDS: float = Config.get_float("JOB_TIMEOUT_SECONDS", 3600.0)
+    POLL_SECONDS: float = 1.0
+    deadlines: dict = {}  # The deadlines of the jobs running in this process, {job_id: time}
+
+
+    @classmethod
+    def get_flag_path(cls, job_id: str) -> str:
+        return os.path.join(cls.CANCEL_DIR, job_id)
+
+
+    @classmethod
+    def request(cls, job_id: str) -> None:
+        """
+        Asks the worker running a job to stop it
+        """
+        os.makedirs(cls.CANCEL_DIR, exist_ok=True)
+        with open(cls.get_flag_path(job_id), "w"):
+            pass
+
+
+    @classmethod
+    def is_requested(cls, job_id: str) -> bool:
+        return os.path.exists(cls.get_flag_path(job_id))
+
+
+    @classmethod
+    def clear(cls, job_id: str) -> None:
+        try:
+            os.remove(cls.get_flag_path(job_id))
+        except OSError:
+            pass
+
+
+    @classmethod
+    def check(cls, job_id: str | None) -> None:
+        """
+        Raises if the job was cancelled or is past its deadline, called before every stage
+        """
+        if job_id is None:
+            return
+        if cls.is_requested(job_id):
+            raise JobCancelledError("Cancelled")
+        if time.time() > cls.deadlines.get(job_id, float("inf")):
+            raise JobTimeoutError(f"Timed out after {cls.JOB_TIMEOUT_SECONDS:.0f}s")
+
+
+    @staticmethod
+    def get_descendants(pid: int) -> list[int]:
+        """
+        Returns the PIDs of all descendants of a process (Linux /proc)
+        """
+        descendants: list[int] = []
+        stack: list[int] = [pid]
+        while stack:
+            current: int = stack.pop()
+            try:
+                for task in os.listdir(f"/proc/{current}/task"):
+                    with open(f"/proc/{current}/task/{task}/children", "r") as children_file:
+                        children: list[int] = [int(child) for child in children_file.read().split()]
+                        descendants += children
+                        stack += children
+            except (OSError, ValueError):
+                continue  # The process exited while we were reading it
+        return descendants
+
+
+    @classmethod
+    def kill_descendants(cls) -> int:
+        """
+        Kills every process this worker spawned, twice to catch the ones forked in between
+        Returns:
+            int: The number of processes signalled
+        """
+        killed: int = 0
+        for _ in range(2):
+            for pid in cls.get_descendants(os.getpid()):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    killed += 1
+                except OSError:
+                    pass
+        return killed
+
+
+    @classmethod
+    @contextmanager
+    def watch(cls, job_id: str, timeout: float | None = None) -> Iterator[None]:
+        """
+        Runs a job under a watchdog that stops it on a cancellation request or at its deadline
+        Args:
+            job_id (str): The ID of the job
+            timeout (float): The wall-clock limit in seconds, JOB_TIMEOUT_SECONDS by default
+        Raises:
+            JobCancelledError, JobTimeoutError: The watchdog stopped the job
+        """
+        cls.deadlines[job_id] = time.time() + (timeout or cls.JOB_TIMEOUT_SECONDS)
+        stopped: threading.Event = threading.Event()
+        reason: list[Exception] = []
+
+        def watchdog() -> None:
+            while not stopped.wait(cls.POLL_SECONDS):
+                try:
+                    cls.check(job_id)
+                except (JobCancelledError, JobTimeoutError) as e:
+                    reason.append(e)
+                    cls.kill_descendants()
+                    return
+
+        thread: threading.Thread = threading.Thread(target=watchdog, daemon=True)
+        thread.start()
+        try:
+            yield
+        except Exception as e:
+            # Whatever the killed processes made fail, report why they were killed
+            if reason:
+                raise reason[0] from e
+            raise
+        finally:
+            stopped.set()
+            thread.join()
+            cls.deadlines.pop(job_id, None)
+        if reason:
+            raise reason[0]
@@ -1,8 +1,15 @@
+import json
 import os
 import subprocess
+import tempfile
+from modules.config_module import Config
+from modules.loc_counter_module import LocCounter
 from modules.log_module import Log
+from modules.process_module import ProcessRunner
 
 class Cloc(Log):
+    # Counting engine: "cloc" (the external binary) or "python" (the in-process LocCounter)
+    ENGINE: str = Config.get_str("CLOC_ENGINE", "cloc").lower()
     # Cloc exclusions
     CLOC_CONFIG: dict = {
         "solidity": {
@@ -11,6 +18,7 @@ class Cloc(Log):
             "exclude_files": ["[Ss]cripts?", "[Ii]nterfaces?", "[Mm]ocks?", "[Tt]ests?"]
         }
     }
+    DIFF_MAX_FILES: int = 20  # Files listed in the formatting diff, the biggest changes first
     
 
     def __init__(self, repo_path: str, slack_message: dict) -> None:
@@ -32,28 +40,59 @@ class Cloc(Log):
         self.scope = slack_message.get("Scope", "all")
         self.exclude_dirs: str = "|".join(self.CLOC_CONFIG[self.language]["exclude_dirs"])
         self.exclude_files:str = "|".join(self.CLOC_CONFIG[self.language]["exclude_files"])
+        self.file_counts: list[dict] | None = None  # Structured per-file result of the last count of resolved files
 
 
-    def __count_loc(self) -> str:
+    def __count_loc(self, files: list[str] | None = None) -> str:
         """
         Count the lines of code in all solidity files across the protocol.
+        Args:
+            files (list[str]): The resolved files in scope, cloc selects the files itself if not provided
         Returns:
             str: The total lines of code
+        Raises:
+            subprocess.CalledProcessError: cloc failed
+            subprocess.TimeoutExpired: cloc ran over the timeout of the count stage
         """
         try:
             self.log_info("\nCounting lines of code...\n")
-            result: str = subprocess.run(
-                self.__construct_cloc_command(self.scope),
-                cwd=self.repo_path,
-                capture_output=True,
-                text=True
-            )
-            self.log_info(result.stdout)
-            return result.stdout
-        except subprocess.CalledProcessError as clocException:
+            if files is None and self.ENGINE != "python":
+                output: str = ProcessRunner().run(self.__construct_cloc_command(self.scope), cwd=self.repo_path, stage="count", keep_output=True) + "\n"
+                self.log_info(output)
+                return output
+            if files is None:
+                from modules.scope_module import Scope  # Scope imports this module for CLOC_CONFIG
+                files = Scope(self.repo_path, self.scope, self.language).get_files()
+            # Count exactly the files that were formatted instead of walking the tree again, and keep the per-file result
+            self.file_counts = self.count_files(files)
+            table: str = LocCounter.format_table(self.file_counts)
+            self.log_info(table)
+            return table
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as clocException:
             self.log_error("Error running cloc: ", str(clocException))
-            return {}
-        
+            raise  # An empty count must not be answered (and cached) as the result
+
+
+    def count_files(self, files: list[str]) -> list[dict]:
+        """
+        Count the lines of every file with the configured engine, without keeping the result
+        Args:
+            files (list[str]): The files to count, relative to the repository root
+        Returns:
+            list[dict]: One {"file", "blank", "comment", "code"} result per counted file, duplicates are counted once
+        Raises:
+            subprocess.CalledProcessError: cloc failed
+            subprocess.TimeoutExpired: cloc ran over the timeout of the count stage
+        """
+        if self.ENGINE == "python":
+            return LocCounter().count_files(self.repo_path, LocCounter.unique_files(self.repo_path, files))
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as list_file:
+            list_file.write("\n".join(files))
+            list_file.flush()
+            output: str = ProcessRunner().run(["cloc", f"--list-file={list_file.name}", "--by-file", "--json", "--quiet"], cwd=self.repo_path, stage="count", keep_output=True)
+        # Standard error is merged into the output, warnings about unreadable files come before the JSON
+        return LocCounter.from_cloc_json(json.loads(output[output.find("{"):] if "{" in output else "{}"))
+
 
     def __construct_cloc_command(self, scope) -> list[str]:
         """
@@ -63,23 +102,93 @@ class Cloc(Log):
         Returns:
             str: The cloc command
         """
+        scope = [scope] if isinstance(scope, str) else scope
         if ".sol" in scope[0]:  # check if the scope are files
             scope_files: str = "|".join(scope)
             return ["cloc", f"--include-ext={self.CLOC_CONFIG[self.language]["extension"]}", ".", "--by-file", f"--match-f={scope_files}", f"--not-match-d={self.exclude_dirs}", f"--not-match-f={self.exclude_files}"]
-        elif ".sol" not in scope[0] and scope[0] == "all":  # check if the scope are directories
+        elif ".sol" not in scope[0] and scope[0].lower() != "all":  # check if the scope are directories
             scope_dirs: str = "|".join(scope)
             return ["cloc", f"--include-ext={self.CLOC_CONFIG[self.language]["extension"]}", ".", "--by-file", f"--match-d={scope_dirs}", f"--not-match-d={self.exclude_dirs}", f"--not-match-f={self.exclude_files}"]
         return ["cloc", f"--include-ext={self.CLOC_CONFIG[self.language]["extension"]}", ".", "--by-file", f"--not-match-d={self.exclude_dirs}", f"--not-match-f={self.exclude_files}"]
 
 
-    def get_cloc_result(self) -> str:
+    def get_cloc_result(self, files: list[str] | None = None, formatted: bool = True) -> str:
         """
         Get the result of the cloc command
+        Args:
+            files (list[str]): The resolved files in scope
+            formatted (bool): The files were formatted, the result says the code wasn't otherwise
         Returns:
             str: The result of the cloc command
         """
-        return f"""```{self.__count_loc()}```\nCode formatted\nBranch: {self.branch}\nCommit: {self.commit}"""
+        with self.span("count", engine=self.ENGINE) as span:
+            if files is not None:
+                span["files"] = len(files)
+                span["bytes"] = sum(os.path.getsize(os.path.join(self.repo_path, file)) for file in files)
+            loc_result: str = self.__count_loc(files)
+            if self.file_counts is not None:
+                span["code_lines"] = LocCounter.get_totals(self.file_counts)["code"]
+        formatting: str = "Code formatted" if formatted else "Code not formatted, formatting failed"
+        return f"""```{loc_result}```\n{formatting}\nBranch: {self.branch}\nCommit: {self.commit}"""
+
+
+    def get_package_result(self, groups: dict[str | None, list[str]], frameworks: dict[str, str]) -> str:
+        """
+        Get the counts of a monorepo per package and overall, from the per-file counts of the last count
+        Args:
+            groups (dict[str | None, list[str]]): {package path: its counted files}, None for files outside of every package
+            frameworks (dict[str, str]): {package path: its framework}
+        Returns:
+            str: The package table
+        """
+        if self.file_counts is None:
+            self.file_counts = self.count_files([file for package_files in groups.values() for file in package_files])
+        counts: dict[str, dict] = {file_counts["file"]: file_counts for file_counts in self.file_counts}
+        packages: dict[str, list[dict]] = {}
+        for path, files in sorted(groups.items(), key=lambda item: (item[0] is None, item[0] or "")):
+            name: str = f"{path or '.'} ({frameworks[path]})" if path is not None else "(outside of packages)"
+            packages[name] = [counts[file] for file in files if file in counts]
+        return f"""Packages:\n```{LocCounter.format_package_table(packages)}```"""
 
 
+    def get_early_result(self, file_counts: list[dict]) -> str:
+        """
+        Get the early answer of an analysis, from the counts of the files before formatting
+        Args:
+            file_counts (list[dict]): The per-file counts of the unformatted files in scope
+        Returns:
+            str: The table of the unformatted counts
+        """
+        return f"""*Unformatted count, the formatted one follows:*\n```{LocCounter.format_table(file_counts)}```\nCode not formatted\nBranch: {self.branch}\nCommit: {self.commit}"""
+
 
-        
+    def get_formatting_diff(self, before: list[dict], files: list[str]) -> str:
+        """
+        Get the difference formatting made to the early answer, from the per-file counts of the last count
+        Args:
+            before (list[dict]): The per-file counts of the early answer, from `count_files`
+            files (list[str]): The counted files in scope
+        Returns:
+            str: The totals before and after formatting and the files that changed most
+        """
+        if self.file_counts is None:
+            self.file_counts = self.count_files(files)
+        before_code: dict[str, int] = {counts["file"]: counts["code"] for counts in before}
+        after_code: dict[str, int] = {counts["file"]: counts["code"] for counts in self.file_counts}
+        changed: list[tuple[str, int, int]] = [
+            (path, before_code.get(path, 0), after_code.get(path, 0))
+            for path in sorted(before_code.keys() | after_code.keys())
+            if before_code.get(path, 0) != after_code.get(path, 0)
+        ]
+        before_total: int = sum(before_code.values())
+        after_total: int = sum(after_code.values())
+        summary: str = f"Formatting changed the code lines: {before_total} -> {after_total} ({after_total - before_total:+d})"
+        if not changed:
+            return f"{summary}, no file changed"
+        rows: list[str] = [f"{'File':<58}{'Before':>8}{'After':>8}{'Delta':>8}", "-" * 82]
+        for path, before_lines, after_lines in sorted(changed, key=lambda row: -abs(row[2] - row[1]))[:self.DIFF_MAX_FILES]:
+            file_name: str = path if len(path) <= 56 else "..." + path[-53:]
+            rows.append(f"{file_name:<58}{before_lines:>8}{after_lines:>8}{after_lines - before_lines:>+8}")
+        if len(changed) > self.DIFF_MAX_FILES:
+            rows.append(f"... and {len(changed) - self.DIFF_MAX_FILES} more files")
+        return f"""{summary} in {len(changed)} file{"s" if len(changed) > 1 else ""}:\n```{chr(10).join(rows)}```"""
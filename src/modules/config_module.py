@@ -0,0 +1,85 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables before any module reads its settings at import time
+load_dotenv(dotenv_path="./.env")
+
+class Config:
+    """
+    A small helper to read typed settings from the environment with defaults.
+    """
+    TRUE_VALUES: tuple = ("1", "true", "yes", "on")
+
+
+    @staticmethod
+    def get_str(name: str, default: str = "") -> str:
+        """
+        Get a string setting
+        Args:
+            name (str): The name of the environment variable
+            default (str): The value to use if the variable is not set
+        Returns:
+            str: The value of the setting
+        """
+        return os.environ.get(name, default)
+
+
+    @staticmethod
+    def get_int(name: str, default: int) -> int:
+        """
+        Get an integer setting, falling back to the default if the value is not a number
+        Args:
+            name (str): The name of the environment variable
+            default (int): The value to use if the variable is not set
+        Returns:
+            int: The value of the setting
+        """
+        try:
+            return int(os.environ.get(name, default))
+        except ValueError:
+            return default
+
+
+    @staticmethod
+    def get_float(name: str, default: float) -> float:
+        """
+        Get a float setting, falling back to the default if the value is not a number
+        Args:
+            name (str): The name of the environment variable
+            default (float): The value to use if the variable is not set
+        Returns:
+            float: The value of the setting
+        """
+        try:
+            return float(os.environ.get(name, default))
+        except ValueError:
+            return default
+
+
+    @staticmethod
+    def get_bool(name: str, default: bool = False) -> bool:
+        """
+        Get a boolean setting ("1", "true", "yes" and "on" are truthy)
+        Args:
+            name (str): The name of the environment variable
+            default (bool): The value to use if the variable is not set
+        Returns:
+            bool: The value of the setting
+        """
+        value: str | None = os.environ.get(name)
+        if value is None:
+            return default
+        return value.strip().lower() in Config.TRUE_VALUES
+
+
+    @staticmethod
+    def get_path(name: str, default: str) -> str:
+        """
+        Get a filesystem path setting with `~` expanded
+        Args:
+            name (str): The name of the environment variable
+            default (str): The path to use if the variable is not set
+        Returns:
+            str: The absolute path
+        """
+        return os.path.abspath(os.path.expanduser(os.environ.get(name, default)))
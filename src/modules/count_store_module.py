@@ -0,0 +1,112 @@
+import time
+from modules.config_module import Config
+from modules.log_module import Log
+from modules.sqlite_module import SqliteDatabase
+
+class CountStore(Log):
+    """
+    A persistent store of per-file line counts of analysed commits, so a later commit
+    of the same repository only needs to recount the files that changed. The counts of
+    unformatted blobs are kept by blob SHA as well, shared by every repository and commit.
+    """
+    DB_PATH: str = Config.get_path("COUNT_STORE_PATH", "~/.cache/pre-audit-bot/counts.sqlite")
+    TTL_SECONDS: int = Config.get_int("COUNT_STORE_TTL", 90 * 24 * 3600)
+    QUERY_BATCH_SIZE: int = 500  # Blob SHAs looked up per query, below SQLite's limit of bound parameters
+
+
+    def __init__(self, db_path: str | None = None) -> None:
+        """
+        Initialize the store and create its tables if needed
+        Args:
+            db_path (str): The path to the SQLite database
+        """
+        self.db_path: str = db_path or self.DB_PATH
+        self.database: SqliteDatabase = SqliteDatabase(self.db_path)
+        with self.database.connect() as connection:
+            # A snapshot marks a complete set of file counts of a commit for one set of settings (scope, formatter, ...)
+            connection.execute("CREATE TABLE IF NOT EXISTS snapshots (repo TEXT NOT NULL, commit_sha TEXT NOT NULL, settings_key TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (repo, commit_sha, settings_key))")
+            connection.execute("CREATE TABLE IF NOT EXISTS file_counts (repo TEXT NOT NULL, commit_sha TEXT NOT NULL, settings_key TEXT NOT NULL, file TEXT NOT NULL, blank INTEGER NOT NULL, comment INTEGER NOT NULL, code INTEGER NOT NULL, PRIMARY KEY (repo, commit_sha, settings_key, file))")
+            # Counts of raw git blobs, the content of a blob never changes so neither do its counts
+            connection.execute("CREATE TABLE IF NOT EXISTS blob_counts (blob_sha TEXT PRIMARY KEY, blank INTEGER NOT NULL, comment INTEGER NOT NULL, code INTEGER NOT NULL, created_at REAL NOT NULL)")
+
+
+
+    def get_snapshot(self, repo: str, commit_sha: str, settings_key: str) -> list[dict] | None:
+        """
+        Returns the stored per-file counts of a commit
+        Args:
+            repo (str): The normalised repository URL
+            commit_sha (str): The full commit SHA
+            settings_key (str): The key of the scope and formatter settings
+        Returns:
+            list[dict]: The {"file", "blank", "comment", "code"} counts, or None if the commit was never counted
+        """
+        with self.database.connect() as connection:
+            snapshot: tuple | None = connection.execute(
+                "SELECT 1 FROM snapshots WHERE repo = ? AND commit_sha = ? AND settings_key = ? AND created_at > ?",
+                (repo, commit_sha, settings_key, time.time() - self.TTL_SECONDS)
+            ).fetchone()
+            if snapshot is None:
+                return None
+            rows: list[tuple] = connection.execute(
+                "SELECT file, blank, comment, code FROM file_counts WHERE repo = ? AND commit_sha = ? AND settings_key = ? ORDER BY file",
+                (repo, commit_sha, settings_key)
+            ).fetchall()
+        return [{"file": file, "blank": blank, "comment": comment, "code": code} for file, blank, comment, code in rows]
+
+
+    def put_snapshot(self, repo: str, commit_sha: str, settings_key: str, file_counts: list[dict]) -> None:
+        """
+        Stores the per-file counts of a commit and drops expired snapshots
+        Args:
+            repo (str): The normalised repository URL
+            commit_sha (str): The full commit SHA
+            settings_key (str): The key of the scope and formatter settings
+            file_counts (list[dict]): The {"file", "blank", "comment", "code"} counts
+        """
+        with self.database.connect() as connection:
+            connection.execute("DELETE FROM file_counts WHERE repo = ? AND commit_sha = ? AND settings_key = ?", (repo, commit_sha, settings_key))
+            connection.executemany(
+                "INSERT INTO file_counts (repo, commit_sha, settings_key, file, blank, comment, code) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(repo, commit_sha, settings_key, counts["file"], counts["blank"], counts["comment"], counts["code"]) for counts in file_counts]
+            )
+            connection.execute("INSERT OR REPLACE INTO snapshots (repo, commit_sha, settings_key, created_at) VALUES (?, ?, ?, ?)", (repo, commit_sha, settings_key, time.time()))
+            expired: list[tuple] = connection.execute("SELECT repo, commit_sha, settings_key FROM snapshots WHERE created_at <= ?", (time.time() - self.TTL_SECONDS,)).fetchall()
+            for expired_snapshot in expired:
+                connection.execute("DELETE FROM file_counts WHERE repo = ? AND commit_sha = ? AND settings_key = ?", expired_snapshot)
+                connection.execute("DELETE FROM snapshots WHERE repo = ? AND commit_sha = ? AND settings_key = ?", expired_snapshot)
+        self.log_info("Stored per-file counts of commit: ", commit_sha[:10])
+
+
+    def get_blob_counts(self, blob_shas: list[str]) -> dict[str, dict]:
+        """
+        Returns the stored counts of git blobs
+        Args:
+            blob_shas (list[str]): The blob SHAs
+        Returns:
+            dict[str, dict]: {blob SHA: {"blank", "comment", "code"}} for the blobs counted before
+        """
+        counts: dict[str, dict] = {}
+        with self.database.connect() as connection:
+            for start in range(0, len(blob_shas), self.QUERY_BATCH_SIZE):
+                batch: list[str] = blob_shas[start:start + self.QUERY_BATCH_SIZE]
+                rows: list[tuple] = connection.execute(
+                    f"SELECT blob_sha, blank, comment, code FROM blob_counts WHERE blob_sha IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for blob_sha, blank, comment, code in rows:
+                    counts[blob_sha] = {"blank": blank, "comment": comment, "code": code}
+        return counts
+
+
+    def put_blob_counts(self, counts: dict[str, dict]) -> None:
+        """
+        Stores the counts of git blobs and drops expired ones
+        Args:
+            counts (dict[str, dict]): {blob SHA: {"blank", "comment", "code"}}
+        """
+        with self.database.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO blob_counts (blob_sha, blank, comment, code, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(blob_sha, blob_counts["blank"], blob_counts["comment"], blob_counts["code"], time.time()) for blob_sha, blob_counts in counts.items()]
+            )
+            connection.execute("DELETE FROM blob_counts WHERE created_at <= ?", (time.time() - self.TTL_SECONDS,))
@@ -0,0 +1,49 @@
+import time
+from modules.config_module import Config
+from modules.log_module import Log
+from modules.sqlite_module import SqliteDatabase
+
+class DedupeStore(Log):
+    """
+    A persistent record of the Slack messages the bot already accepted, keyed by channel and timestamp.
+    Entries expire after a TTL and the number of entries is capped, so the store stays small in a
+    long-running process and still catches redeliveries after a restart.
+    """
+    DB_PATH: str = Config.get_path("DEDUPE_PATH", "~/.cache/pre-audit-bot/dedupe.sqlite")
+    TTL_SECONDS: int = Config.get_int("DEDUPE_TTL", 24 * 3600)
+    MAX_ENTRIES: int = Config.get_int("DEDUPE_MAX_ENTRIES", 100000)
+
+
+    def __init__(self, db_path: str | None = None) -> None:
+        """
+        Initialize the store and create its table if needed
+        Args:
+            db_path (str): The path to the SQLite database
+        """
+        self.db_path: str = db_path or self.DB_PATH
+        self.database: SqliteDatabase = SqliteDatabase(self.db_path)
+        with self.database.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS messages (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS messages_seen_at ON messages (seen_at)")
+
+
+
+    def check_and_add(self, channel_id: str, message_ts: str) -> bool:
+        """
+        Records a message and tells if it was recorded before, atomically across processes
+        Args:
+            channel_id (str): The channel of the message
+            message_ts (str): The timestamp of the message
+        Returns:
+            bool: True if the message was already seen (a duplicate), False if it is new
+        """
+        now: float = time.time()
+        with self.database.connect() as connection:
+            connection.execute("DELETE FROM messages WHERE seen_at <= ?", (now - self.TTL_SECONDS,))
+            inserted: int = connection.execute("INSERT OR IGNORE INTO messages (key, seen_at) VALUES (?, ?)", (f"{channel_id}:{message_ts}", now)).rowcount
+            if inserted:
+                connection.execute(
+                    "DELETE FROM messages WHERE key IN (SELECT key FROM messages ORDER BY seen_at DESC LIMIT -1 OFFSET ?)",
+                    (self.MAX_ENTRIES,)
+                )
+        return not inserted
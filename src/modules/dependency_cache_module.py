@@ -0,0 +1,182 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from modules.cache_module import DiskCache
+from modules.config_module import Config
+from modules.metrics_module import Metrics
+from modules.process_module import ProcessRunner
+
+class DependencyCache(DiskCache):
+    """
+    A shared cache of installed dependency trees (`node_modules`, `lib`) keyed by the hash of the
+    lockfiles, the submodule SHAs and the framework config. Trees are copied in and out with reflinks where
+    the filesystem supports them (plain copies elsewhere), so a hit costs no network and, on copy-on-write
+    filesystems, almost no disk. They are never hardlinked: a later install, postinstall or patch step in a
+    warm workspace writes in place and would change the cache and every workspace restored from it.
+    """
+    CACHE_DIR: str = Config.get_path("DEPENDENCY_CACHE_DIR", "~/.cache/pre-audit-bot/dependencies")
+    MAX_BYTES: int = Config.get_int("DEPENDENCY_CACHE_MAX_BYTES", 20 * 1024 ** 3)
+    STATS_FILE: str = "stats.json"
+
+
+    def __init__(self, root: str | None = None, max_bytes: int | None = None) -> None:
+        super().__init__(root or self.CACHE_DIR, max_bytes or self.MAX_BYTES)
+
+
+    def get_key(self, repo_path: str, framework: str, key_files: list[str]) -> str | None:
+        """
+        Builds the cache key of a project from its lockfiles and submodule SHAs
+        Args:
+            repo_path (str): The path to the cloned repository
+            framework (str): The detected framework
+            key_files (list[str]): The files describing the dependencies (lockfiles, .gitmodules, foundry.toml, ...)
+        Returns:
+            str: The cache key, or None if the project has none of the key files
+        """
+        digest = hashlib.sha256(framework.encode())
+        found: bool = False
+        for file_name in key_files:
+            file_path: str = os.path.join(repo_path, file_name)
+            if os.path.isfile(file_path):
+                found = True
+                digest.update(file_name.encode())
+                with open(file_path, "rb") as key_file:
+                    digest.update(hashlib.sha256(key_file.read()).digest())
+        # Submodules are pinned by the gitlinks in the index, not by .gitmodules
+        try:
+            index: str = ProcessRunner().run(["git", "ls-files", "-s"], cwd=repo_path, stage="install", keep_output=True)
+        except subprocess.CalledProcessError:
+            index: str = ""
+        for line in index.splitlines():
+            if line.startswith("160000 "):
+                found = True
+                digest.update(line.encode())
+        return f"{framework}-{digest.hexdigest()[:32]}" if found else None
+
+
+    @staticmethod
+    def __copy_tree(source: str, destination: str) -> None:
+        """
+        Copies a directory tree, sharing the blocks with `cp --reflink=auto` until either copy is written
+        """
+        os.makedirs(destination, exist_ok=True)
+        ProcessRunner().run(["cp", "-a", "--reflink=auto", f"{source}/.", destination], stage="install")
+
+
+    @staticmethod
+    def __clear(path: str) -> None:
+        """
+        Removes a dependency directory left in a warm workspace, so a restore doesn't merge into a stale tree
+        """
+        if os.path.islink(path) or os.path.isfile(path):
+            os.remove(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
+
+
+    @staticmethod
+    def __checkout_tracked(repo_path: str, name: str) -> None:
+        """
+        Brings back the files of a dependency directory that are committed into the repository (e.g. vendored into `lib`)
+        """
+        tracked: str = ProcessRunner().run(["git", "ls-files", "--", name], cwd=repo_path, stage="install", keep_output=True)
+        if tracked.strip():
+            ProcessRunner().run(["git", "checkout", "--", name], cwd=repo_path, stage="install")
+
+
+    def __count(self, outcome: str) -> None:
+        """
+        Increments the persisted hit/miss counter
+        """
+        Metrics().inc("cache_requests_total", {"cache": "dependency", "outcome": {"hits": "hit", "misses": "miss"}[outcome]})
+        stats_path: str = os.path.join(self.root, self.META_DIR, self.STATS_FILE)
+        with open(stats_path, "a+") as stats_file:
+            fcntl.flock(stats_file, fcntl.LOCK_EX)
+            stats_file.seek(0)
+            try:
+                stats: dict = json.loads(stats_file.read() or "{}")
+            except ValueError:
+                stats: dict = {}
+            stats[outcome] = stats.get(outcome, 0) + 1
+            stats_file.seek(0)
+            stats_file.truncate()
+            stats_file.write(json.dumps(stats))
+
+
+    def get_stats(self) -> dict:
+        """
+        Returns the number of hits and misses and the hit ratio
+        """
+        try:
+            with open(os.path.join(self.root, self.META_DIR, self.STATS_FILE), "r") as stats_file:
+                stats: dict = json.loads(stats_file.read() or "{}")
+        except (OSError, ValueError):
+            stats: dict = {}
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+        return {"hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses) if hits + misses else 0.0}
+
+
+    def restore(self, key: str, repo_path: str) -> bool:
+        """
+        Restores the cached dependency directories into the project
+        Args:
+            key (str): The cache key
+            repo_path (str): The path to the cloned repository
+        Returns:
+            bool: True on a cache hit
+        """
+        entry_path: str = self.get_entry_path(key)
+        with self.lock(key, exclusive=False):
+            if not os.path.isdir(entry_path):
+                self.__count("misses")
+                self.log_info("Dependency cache miss: ", key)
+                return False
+            try:
+                for entry in os.scandir(entry_path):
+                    destination: str = os.path.join(repo_path, entry.name)
+                    self.__clear(destination)
+                    self.__copy_tree(entry.path, destination)
+                    self.__checkout_tracked(repo_path, entry.name)
+            except (OSError, shutil.Error, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                self.log_error("Failed to restore dependencies from cache: ", str(e))
+                self.__count("misses")
+                return False
+            self.touch(key)
+        self.__count("hits")
+        self.log_success("Dependencies restored from cache: ", key)
+        return True
+
+
+    def save(self, key: str, repo_path: str, dependency_dirs: list[str]) -> None:
+        """
+        Stores the installed dependency directories of the project
+        Args:
+            key (str): The cache key computed before the install
+            repo_path (str): The path to the cloned repository
+            dependency_dirs (list[str]): The directories to cache, e.g. ["node_modules"]
+        """
+        entry_path: str = self.get_entry_path(key)
+        with self.lock(key):
+            if os.path.isdir(entry_path):
+                return
+            partial_path: str = f"{entry_path}.partial"
+            shutil.rmtree(partial_path, ignore_errors=True)
+            try:
+                for dependency_dir in dependency_dirs:
+                    source: str = os.path.join(repo_path, dependency_dir)
+                    if os.path.isdir(source):
+                        self.__copy_tree(source, os.path.join(partial_path, dependency_dir))
+                if not os.path.isdir(partial_path):
+                    return
+                os.rename(partial_path, entry_path)
+            except (OSError, shutil.Error, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                self.log_error("Failed to save dependencies to cache: ", str(e))
+                shutil.rmtree(partial_path, ignore_errors=True)
+                return
+            self.touch(key)
+            self.record_size(key)
+        self.log_info("Dependencies saved to cache: ", key)
+        self.evict()
@@ -0,0 +1,140 @@
+import threading
+from typing import Iterator
+from modules.count_store_module import CountStore
+from modules.loc_counter_module import LocCounter
+from modules.log_module import Log
+from modules.process_module import ProcessRunner
+from modules.repository_module import RemoteRepository
+from modules.scope_module import Scope
+
+class LocEstimate(Log):
+    """
+    Counts the lines of code in scope straight from the git objects of a commit, without a checkout,
+    a dependency install or formatting: `git ls-tree -r` lists the paths, one `git cat-file --batch`
+    stream reads the blobs that were never counted, and the counts are kept by blob SHA, so vendored
+    contracts shared between repositories and commits are only counted once. The code isn't formatted,
+    so the numbers estimate those of a full analysis. The git commands run through the ProcessRunner, under
+    the timeout of the count stage.
+    """
+
+
+    def __init__(self, repository: RemoteRepository, count_store: CountStore | None = None) -> None:
+        """
+        Initialize the estimate of a repository
+        Args:
+            repository (RemoteRepository): The repository from the message, it is never cloned
+            count_store (CountStore): The store of the blob counts
+        """
+        self.repository: RemoteRepository = repository
+        # Scope only matches paths here, there is no tree to walk
+        self.scope: Scope = Scope("", repository.scope, repository.language)
+        self.count_store: CountStore = count_store or CountStore()
+
+
+    def list_files(self, git_dir: str, commit_sha: str) -> dict[str, str]:
+        """
+        Lists the files in scope of a commit
+        Args:
+            git_dir (str): The path to the (bare) repository
+            commit_sha (str): The commit
+        Returns:
+            dict[str, str]: {path relative to the repository root: blob SHA}
+        """
+        output: str = ProcessRunner().run(["git", "ls-tree", "-r", "-z", "--full-tree", commit_sha], cwd=git_dir, stage="count", keep_output=True)
+        files: dict[str, str] = {}
+        for entry in output.split("\0"):
+            if not entry.strip():
+                continue
+            meta, relative_path = entry.split("\t", 1)
+            mode, object_type, blob_sha = meta.split()
+            # Symlinks are blobs holding the target path, submodules are commits
+            if object_type != "blob" or mode == "120000":
+                continue
+            if self.scope.is_in_scope(relative_path):
+                files[relative_path] = blob_sha
+        return files
+
+
+    @staticmethod
+    def read_blobs(git_dir: str, blob_shas: list[str]) -> Iterator[tuple[str, bytes]]:
+        """
+        Reads blobs through a single `git cat-file --batch` process
+        Args:
+            git_dir (str): The path to the (bare) repository
+            blob_shas (list[str]): The blobs to read
+        Yields:
+            tuple[str, bytes]: The blob SHA and its content, missing blobs are skipped
+        """
+        with ProcessRunner().open(["git", "cat-file", "--batch", "--buffer"], cwd=git_dir, stage="count") as process:
+
+            def write_requests() -> None:
+                # Written from a thread, so git never blocks on a full stdout pipe while we are still writing
+                try:
+                    process.stdin.write("".join(f"{blob_sha}\n" for blob_sha in blob_shas).encode())
+                    process.stdin.close()
+                except (OSError, ValueError):
+                    pass  # git exited, the reader notices the missing output
+
+            writer: threading.Thread = threading.Thread(target=write_requests, daemon=True)
+            writer.start()
+            try:
+                for _ in blob_shas:
+                    header: list[bytes] = process.stdout.readline().split()
+                    if not header:
+                        break
+                    if len(header) < 3:  # "<sha> missing"
+                        continue
+                    content: bytes = process.stdout.read(int(header[2]))
+                    process.stdout.read(1)  # The newline after the content
+                    yield header[0].decode(), content
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                writer.join()
+
+
+    def count(self, git_dir: str, commit_sha: str) -> list[dict]:
+        """
+        Counts the files in scope of a commit, only blobs without stored counts are read
+        Args:
+            git_dir (str): The path to the (bare) repository
+            commit_sha (str): The commit
+        Returns:
+            list[dict]: The {"file", "blank", "comment", "code"} counts, sorted by path
+        """
+        with self.span("count", engine="objects") as span:
+            files: dict[str, str] = self.list_files(git_dir, commit_sha)
+            blob_shas: list[str] = sorted(set(files.values()))
+            counts: dict[str, dict] = self.count_store.get_blob_counts(blob_shas)
+            missing: list[str] = [blob_sha for blob_sha in blob_shas if blob_sha not in counts]
+            span["files"] = len(files)
+            span["blobs"] = len(blob_shas)
+            span["memo_hits"] = len(blob_shas) - len(missing)
+            span["bytes"] = 0
+            if missing:
+                read_shas: list[str] = []
+                sources: list[str] = []
+                for blob_sha, content in self.read_blobs(git_dir, missing):
+                    read_shas.append(blob_sha)
+                    sources.append(content.decode("utf-8", "replace"))
+                    span["bytes"] += len(content)
+                new_counts: dict[str, dict] = dict(zip(read_shas, LocCounter().count_sources(sources)))
+                self.count_store.put_blob_counts(new_counts)
+                counts.update(new_counts)
+            file_counts: list[dict] = [{"file": path, **counts[blob_sha]} for path, blob_sha in sorted(files.items()) if blob_sha in counts]
+            span["code_lines"] = LocCounter.get_totals(file_counts)["code"]
+        self.log_info("Blobs counted: ", f"{len(missing)} of {len(blob_shas)} ({len(blob_shas) - len(missing)} known)")
+        return file_counts
+
+
+    def get_result(self, git_dir: str, commit_sha: str) -> str:
+        """
+        Returns the reply of the estimate
+        Args:
+            git_dir (str): The path to the (bare) repository
+            commit_sha (str): The commit
+        Returns:
+            str: A cloc style table of the unformatted counts with the branch and commit
+        """
+        table: str = LocCounter.format_table(self.count(git_dir, commit_sha))
+        return f"""```{table}```\nEstimate from git objects, code not formatted\nBranch: {self.repository.branch}\nCommit: {commit_sha}"""
@@ -0,0 +1,186 @@
+import hashlib
+import hmac
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qsl
+from modules.log_module import Log
+
+class FakeSlack(Log):
+    """
+    A local stand-in for Slack used by the benchmarks: a Web API server (`auth.test`, `chat.postMessage`, ...)
+    the bot's WebClient is pointed at with SLACK_API_URL, and signed Events API requests for the bot's
+    `/slack/events` endpoint. With a channel interval it answers message calls that come faster than Slack's
+    per-channel limit with HTTP 429 and `Retry-After`, like Slack does.
+    """
+    BOT_USER_ID: str = "UBENCHBOT"
+
+
+    def __init__(self, signing_secret: str, host: str = "127.0.0.1", port: int = 0, channel_interval: float = 0.0) -> None:
+        """
+        Initialize the server, port 0 picks a free port
+        Args:
+            signing_secret (str): The secret the bot verifies events with (SIGNING_SECRET)
+            host (str): The interface to listen on
+            port (int): The port to listen on
+            channel_interval (float): The minimum seconds between message calls to a channel, 0 for no rate limit
+        """
+        self.signing_secret: str = signing_secret
+        self.channel_interval: float = channel_interval
+        self.channel_calls: dict[str, float] = {}  # The time of the last accepted message call per channel
+        self.rate_limited: int = 0  # Calls answered with HTTP 429
+        self.calls: list[dict] = []  # Every Web API call as {"method", "params", "time"}
+        self.condition: threading.Condition = threading.Condition()
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), self.__build_handler())
+        self.thread: threading.Thread | None = None
+
+
+    @property
+    def url(self) -> str:
+        """
+        The Web API base URL, e.g. `http://127.0.0.1:41234/api/`
+        """
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+
+    def __build_handler(self) -> type:
+        """
+        Returns the request handler class bound to this instance
+        """
+        fake_slack: FakeSlack = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                body: str = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+                if "json" in (self.headers.get("Content-Type") or ""):
+                    params: dict = json.loads(body or "{}")
+                else:
+                    params: dict = dict(parse_qsl(body))
+                method: str = self.path.rsplit("/", 1)[-1]
+                retry_after: float | None = fake_slack.check_rate_limit(method, params)
+                if retry_after is not None:
+                    payload: bytes = json.dumps({"ok": False, "error": "ratelimited"}).encode()
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(math.ceil(retry_after)))
+                else:
+                    payload: bytes = json.dumps(fake_slack.record_call(method, params)).encode()
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, format: str, *args) -> None:
+                pass  # Keep the benchmark output readable
+
+        return Handler
+
+
+    def check_rate_limit(self, method: str, params: dict) -> float | None:
+        """
+        Checks a message call against the per-channel limit
+        Args:
+            method (str): The API method
+            params (dict): The parameters of the call
+        Returns:
+            float: The seconds until the channel accepts the next message, None if the call is accepted
+        """
+        if not self.channel_interval or not method.startswith("chat."):
+            return None
+        with self.condition:
+            channel: str = params.get("channel")
+            now: float = time.time()
+            wait: float = self.channel_calls.get(channel, 0.0) + self.channel_interval - now
+            if wait > 0:
+                self.rate_limited += 1
+                return wait
+            self.channel_calls[channel] = now
+            return None
+
+
+    def record_call(self, method: str, params: dict) -> dict:
+        """
+        Records a Web API call and returns the response Slack would send
+        Args:
+            method (str): The API method, e.g. `chat.postMessage`
+            params (dict): The parameters of the call
+        Returns:
+            dict: The response
+        """
+        if method == "auth.test":
+            response: dict = {"ok": True, "user_id": self.BOT_USER_ID, "user": "bench-bot", "team_id": "TBENCH"}
+        else:
+            response: dict = {"ok": True, "channel": params.get("channel"), "ts": params.get("ts") or f"{time.time():.6f}"}
+        with self.condition:
+            self.calls.append({"method": method, "params": params, "response": response, "time": time.time()})
+            self.condition.notify_all()
+        return response
+
+
+    def start(self) -> None:
+        """
+        Starts serving in a background thread
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.log_info("Fake Slack API listening on: ", self.url)
+
+
+    def stop(self) -> None:
+        """
+        Stops the server
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def wait_for_call(self, method: str | tuple[str, ...], thread_ts: str | None = None, timeout: float = 600, match: Callable[[dict], bool] | None = None) -> dict | None:
+        """
+        Waits until the bot made a Web API call, e.g. the reply in the thread of a message
+        Args:
+            method (str | tuple[str, ...]): The API method, or any of several
+            thread_ts (str): Only match calls in this thread
+            timeout (float): The maximum number of seconds to wait
+            match (Callable[[dict], bool]): Only match calls whose parameters pass this check
+        Returns:
+            dict: The call, or None on timeout
+        """
+        methods: tuple[str, ...] = (method,) if isinstance(method, str) else method
+        deadline: float = time.time() + timeout
+        with self.condition:
+            while True:
+                for call in self.calls:
+                    if call["method"] in methods and (thread_ts is None or call["params"].get("thread_ts") == thread_ts) and (match is None or match(call["params"])):
+                        return call
+                remaining: float = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+
+    def build_event(self, text: str, channel: str, ts: str, user: str = "UBENCHUSER") -> tuple[bytes, dict]:
+        """
+        Builds a signed Events API request with a message event
+        Args:
+            text (str): The message text
+            channel (str): The channel ID
+            ts (str): The message timestamp
+            user (str): The user ID of the author
+        Returns:
+            tuple[bytes, dict]: The request body and headers
+        """
+        body: bytes = json.dumps({
+            "type": "event_callback",
+            "event_id": f"Ev{ts.replace('.', '')}",
+            "event": {"type": "message", "channel": channel, "user": user, "text": text, "ts": ts}
+        }).encode()
+        timestamp: str = str(int(time.time()))
+        signature: str = "v0=" + hmac.new(self.signing_secret.encode(), f"v0:{timestamp}:".encode() + body, hashlib.sha256).hexdigest()
+        headers: dict = {"Content-Type": "application/json", "X-Slack-Request-Timestamp": timestamp, "X-Slack-Signature": signature}
+        return body, headers
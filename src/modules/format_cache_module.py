@@ -0,0 +1,77 @@
+import hashlib
+import time
+from modules.config_module import Config
+from modules.log_module import Log
+from modules.sqlite_module import SqliteDatabase
+
+class FormatCache(Log):
+    """
+    A persistent set of content hashes that are already formatted for a given formatter signature
+    (formatter, version and config), so unchanged files are never sent to the formatter again.
+    """
+    DB_PATH: str = Config.get_path("FORMAT_CACHE_PATH", "~/.cache/pre-audit-bot/formatted.sqlite")
+    MAX_ENTRIES: int = Config.get_int("FORMAT_CACHE_MAX_ENTRIES", 500000)
+
+
+    def __init__(self, db_path: str | None = None) -> None:
+        """
+        Initialize the cache and create its table if needed
+        Args:
+            db_path (str): The path to the SQLite database
+        """
+        self.db_path: str = db_path or self.DB_PATH
+        self.database: SqliteDatabase = SqliteDatabase(self.db_path)
+        with self.database.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS formatted (signature TEXT NOT NULL, content_hash TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (signature, content_hash))")
+            connection.execute("CREATE INDEX IF NOT EXISTS formatted_created_at ON formatted (created_at)")
+
+
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """
+        Returns the SHA-256 of a file's content
+        """
+        with open(file_path, "rb") as source_file:
+            return hashlib.sha256(source_file.read()).hexdigest()
+
+
+    def filter_unformatted(self, signature: str, file_hashes: dict[str, str]) -> list[str]:
+        """
+        Returns the files whose content is not known to be formatted
+        Args:
+            signature (str): The formatter signature
+            file_hashes (dict[str, str]): Content hash by file path
+        Returns:
+            list[str]: The paths that still need formatting
+        """
+        hashes: list[str] = list(set(file_hashes.values()))
+        known: set[str] = set()
+        with self.database.connect() as connection:
+            for start in range(0, len(hashes), 500):  # Stay below SQLite's variable limit
+                chunk: list[str] = hashes[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT content_hash FROM formatted WHERE signature = ? AND content_hash IN ({','.join('?' * len(chunk))})",
+                    (signature, *chunk)
+                ).fetchall()
+                known.update(row[0] for row in rows)
+        return [path for path, content_hash in file_hashes.items() if content_hash not in known]
+
+
+    def add(self, signature: str, content_hashes: list[str]) -> None:
+        """
+        Records the hashes of formatted contents and trims the oldest entries
+        Args:
+            signature (str): The formatter signature
+            content_hashes (list[str]): The hashes of the formatted contents
+        """
+        now: float = time.time()
+        with self.database.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO formatted (signature, content_hash, created_at) VALUES (?, ?, ?)",
+                [(signature, content_hash, now) for content_hash in set(content_hashes)]
+            )
+            connection.execute(
+                "DELETE FROM formatted WHERE created_at < (SELECT created_at FROM formatted ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+                (self.MAX_ENTRIES,)
+            )
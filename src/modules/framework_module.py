@@ -1,23 +1,57 @@
 import os
 import subprocess
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from contextvars import copy_context
+from functools import lru_cache
 from pathlib import Path
+from modules.config_module import Config
+from modules.dependency_cache_module import DependencyCache
+from modules.format_cache_module import FormatCache
 from modules.log_module import Log
+from modules.metrics_module import Metrics
+from modules.process_module import ProcessRunner
+from modules.toolchain_module import FormatterToolchain
+from modules.tree_index_module import TreeIndex
 
 class Framework(Log):
+    # Formatter settings, they also take part in the result cache key
+    PRETTIER_CONFIG_PATH: Path = Path(__file__).parent.parent.parent / "prettier_config" / "config.json"
+    FOUNDRY_FMT_LINE_LENGTH: str = "80"
+    # "skip" formats the in-scope files with the bot's pinned toolchain and installs the project's dependencies only if that fails, "full" always installs them
+    INSTALL_MODE: str = Config.get_str("INSTALL_MODE", "skip").lower()
+    # Formatting is sharded into batches of files run in parallel
+    FORMAT_BATCH_SIZE: int = Config.get_int("FORMAT_BATCH_SIZE", 100)
+    FORMAT_WORKERS: int = Config.get_int("FORMAT_WORKERS", os.cpu_count() or 2)
+    # Sub-projects of a monorepo are detected down to this directory depth and installed and formatted in parallel
+    MONOREPO_MAX_DEPTH: int = Config.get_int("MONOREPO_MAX_DEPTH", 3)
+    MONOREPO_WORKERS: int = Config.get_int("MONOREPO_WORKERS", 4)
+    # Files that make the root an npm/yarn/pnpm workspace, its JS sub-projects then share one node_modules
+    JS_WORKSPACE_FILES: list[str] = ["pnpm-workspace.yaml", "lerna.json"]
+    # Project files that change what the formatters write, the lockfiles pin the project's own prettier of a full install
+    FORMATTER_CONFIG_FILES: list[str] = ["foundry.toml", ".prettierrc"]
+    FORMATTER_LOCK_FILES: list[str] = ["package.json", "package-lock.json", "yarn.lock", "pnpm-lock.yaml"]
      # Framework definitions with their detection files and potential variants
     FRAMEWORK_DEFINITIONS: dict = {
         "hardhat": {
             "config_files": ["hardhat.config.ts", "hardhat.config.js"],
-            "dependencies": ["npm", "install"]
+            "dependencies": ["npm", "install", "--prefer-offline", "--no-audit", "--no-fund"],
+            "lock_files": ["package.json", "package-lock.json", "yarn.lock", "pnpm-lock.yaml"],
+            "dependency_dirs": ["node_modules"]
         },
         "foundry": {
             "config_files": ["foundry.toml", "remappings.txt"],
-            "dependencies": ["forge", "install"]
+            "dependencies": ["forge", "install"],
+            "lock_files": ["foundry.toml", "remappings.txt", ".gitmodules", "package.json", "package-lock.json", "yarn.lock", "pnpm-lock.yaml"],
+            "dependency_dirs": ["lib", "node_modules"]
         },
         "truffle": {  # Added for extensibility
             "config_files": ["truffle-config.js", "truffle.js"],
-            "dependencies": ["npm", "install"]
+            "dependencies": ["npm", "install", "--prefer-offline", "--no-audit", "--no-fund"],
+            "lock_files": ["package.json", "package-lock.json", "yarn.lock", "pnpm-lock.yaml"],
+            "dependency_dirs": ["node_modules"]
         }
     }
 
@@ -27,26 +61,148 @@ class Framework(Log):
         Initialize the framework handler with the path to the cloned repository
         """
         self.repo_path: str = repo_path
-        self.framework: str
+        self.framework: str = "unknown"
+        self.dependency_cache: DependencyCache = DependencyCache()
+        self.dependency_cache_key: str | None = None  # Set when the dependencies have to be installed and saved to the cache
+        self.toolchain: FormatterToolchain = FormatterToolchain()
+        self.format_cache: FormatCache = FormatCache()
+        self.runner: ProcessRunner = ProcessRunner()
+        self.projects: list[dict] = []  # Every detected project as {"path", "framework"}, "" is the root
+        self.install_lock: threading.Lock | None = None  # Serializes the installs of sub-projects sharing a JS workspace
+        self.toolchain_ready: bool = False  # The bot's formatter toolchain was set up by `prepare`
+        self.project_ready: bool = False  # The project's dependencies and formatter were set up by `prepare`
 
 
-    def detect_framework(self) -> str:
+    def build_index(self) -> TreeIndex:
         """
-        Detects which framework is being used in the project
+        Walks the checkout once for the framework detection and the scope, pruned only of the dependency directories
+        (which cloc excludes too). The directories cloc excludes are walked: a sub-project in one (e.g. `contracts-lib`)
+        still has to be installed, the scope leaves their files out
 
         Returns:
-            str: Framework name ('hardhat', 'foundry', 'truffle', or 'unknown')
+            TreeIndex: The index of the whole checkout
         """
+        dependency_dirs: set[str] = {directory for info in self.FRAMEWORK_DEFINITIONS.values() for directory in info["dependency_dirs"]}
+        return TreeIndex(self.repo_path, lambda name: name in dependency_dirs).build()
+
+
+    def detect_framework(self, index: TreeIndex | None = None) -> str:
+        """
+        Detects which framework is being used in the project and in every sub-project of a monorepo
+
+        Args:
+            index (TreeIndex): The index of `build_index`, to share the walk with the scope, walked here if not provided
+
+        Returns:
+            str: Framework name of the root ('hardhat', 'foundry', 'truffle', or 'unknown'),
+                of the shallowest sub-project if the root has none
+        """
+        if index is None:
+            index = self.build_index()
+        config_frameworks: dict[str, str] = {}
         for framework_name, framework_info in self.FRAMEWORK_DEFINITIONS.items():
             for config in framework_info["config_files"]:
-                config_path = Path(self.repo_path) / config
-                if config_path.exists():
-                    self.framework = framework_name
-                    self.log_info("\nDetected framework: ", framework_name)
-                    return framework_name
-        # If no framework is detected, return "unknown"
-        self.log_error("No known framework detected (neither Hardhat nor Foundry)")
-        return "unknown"
+                config_frameworks.setdefault(config, framework_name)
+        found: dict[str, str] = index.find_dirs_with(list(config_frameworks), self.MONOREPO_MAX_DEPTH)
+        # The root first, then by depth, so the framework of the repository is the one closest to the root
+        self.projects = [
+            {"path": directory, "framework": config_frameworks[config]}
+            for directory, config in sorted(found.items(), key=lambda item: (item[0].count(os.sep) if item[0] else -1, item[0]))
+        ]
+        if not self.projects:
+            # If no framework is detected, return "unknown"
+            self.log_error("No known framework detected (neither Hardhat nor Foundry)")
+            return "unknown"
+        self.framework = self.projects[0]["framework"]
+        self.log_info("\nDetected framework: ", self.framework)
+        if self.is_monorepo():
+            self.log_info("Detected sub-projects: ", ", ".join(f"{project['path'] or '.'} ({project['framework']})" for project in self.projects))
+        return self.framework
+
+
+    def is_monorepo(self) -> bool:
+        """
+        Checks if the projects have to be handled one by one: several of them, or a single one below the root
+        """
+        return len(self.projects) > 1 or bool(self.projects and self.projects[0]["path"])
+
+
+    def group_files(self, files: list[str]) -> dict[str, list[str]]:
+        """
+        Assigns files to the deepest detected project containing them
+
+        Args:
+            files (list[str]): Paths relative to the repository root
+
+        Returns:
+            dict[str, list[str]]: {project path: its files}, files outside of every project are under None
+        """
+        groups: dict[str | None, list[str]] = {}
+        paths: list[str] = sorted((project["path"] for project in self.projects), key=len, reverse=True)
+        for file in files:
+            owner: str | None = next((path for path in paths if not path or file.startswith(path + os.sep)), None)
+            groups.setdefault(owner, []).append(file)
+        return groups
+
+
+    def __is_js_workspace(self) -> bool:
+        """
+        Checks if the root declares JS workspaces, the installs of its sub-projects then write the same node_modules
+        """
+        if any(os.path.exists(os.path.join(self.repo_path, file_name)) for file_name in self.JS_WORKSPACE_FILES):
+            return True
+        try:
+            return "workspaces" in json.loads(self.__read_project_file("package.json") or "{}")
+        except (ValueError, TypeError):
+            return False
+
+
+    def __format_project(self, project: dict, files: list[str], install_lock: "threading.Lock | None") -> bool:
+        """
+        Installs and formats one sub-project of a monorepo with its own framework handler
+
+        Args:
+            project (dict): The sub-project, {"path", "framework"}
+            files (list[str]): Its files in scope, relative to the repository root
+            install_lock (threading.Lock): Shared by the sub-projects of a JS workspace
+
+        Returns:
+            bool: True if the files were formatted successfully
+        """
+        sub_framework: Framework = Framework(os.path.join(self.repo_path, project["path"]))
+        sub_framework.framework = project["framework"]
+        sub_framework.projects = [{"path": "", "framework": project["framework"]}]
+        if project["framework"] != "foundry":
+            sub_framework.install_lock = install_lock
+        prefix: str = project["path"] + os.sep if project["path"] else ""
+        with self.bind(project=project["path"] or "."):
+            return sub_framework.format_code([file[len(prefix):] for file in files])
+
+
+    def __format_projects(self, files: list[str]) -> bool:
+        """
+        Formats every sub-project of a monorepo in parallel, each with its own dependency install and formatter
+
+        Args:
+            files (list[str]): The files in scope, relative to the repository root
+
+        Returns:
+            bool: True if every sub-project was formatted successfully
+        """
+        groups: dict[str | None, list[str]] = self.group_files(files)
+        outside: list[str] = groups.pop(None, [])
+        if outside:
+            self.log_info("Files outside of every sub-project, not formatted: ", str(len(outside)))
+        projects: list[dict] = [project for project in self.projects if groups.get(project["path"])]
+        install_lock: threading.Lock | None = threading.Lock() if self.__is_js_workspace() else None
+        with ThreadPoolExecutor(max_workers=max(1, min(self.MONOREPO_WORKERS, len(projects)))) as executor:
+            # Every thread runs in a copy of the context, so its stages still report to the job and can be cancelled
+            futures: list = [
+                executor.submit(copy_context().run, self.__format_project, project, groups[project["path"]], install_lock)
+                for project in projects
+            ]
+            results: list[bool] = [future.result() for future in futures]
+        return all(results)
     
     
     def __install_dependencies(self) -> bool:
@@ -57,20 +213,27 @@ class Framework(Log):
             framework_name (str): Name of the framework to install dependencies for
             
         """
-        self.log_info("Installing dependencies for ", self.framework)
-        try:
-            subprocess.run(
-                self.FRAMEWORK_DEFINITIONS[self.framework]["dependencies"],
-                cwd=self.repo_path,
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            self.log_info("Dependencies installed successfully")
-            return True
-        except subprocess.CalledProcessError as e:
-            self.log_error("Error installing dependencies: ", str(e))
+        if self.framework not in self.FRAMEWORK_DEFINITIONS:
+            self.log_error("Can't install dependencies for framework: ", self.framework)
             return False
+        cache_key: str | None = self.dependency_cache.get_key(self.repo_path, self.framework, self.FRAMEWORK_DEFINITIONS[self.framework]["lock_files"])
+        with self.span("install", framework=self.framework) as span:
+            span["cache_hit"] = bool(cache_key and self.dependency_cache.restore(cache_key, self.repo_path))
+            if span["cache_hit"]:
+                return True
+            self.dependency_cache_key = cache_key
+            self.log_info("Installing dependencies for ", self.framework)
+            try:
+                # Streamed, an install can print hundreds of thousands of lines
+                with self.install_lock or nullcontext():
+                    self.runner.run(self.FRAMEWORK_DEFINITIONS[self.framework]["dependencies"], cwd=self.repo_path, stage="install")
+                span["bytes"] = sum(DependencyCache.get_dir_size(os.path.join(self.repo_path, directory)) for directory in self.FRAMEWORK_DEFINITIONS[self.framework]["dependency_dirs"])
+                self.log_info("Dependencies installed successfully")
+                return True
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                span["status"] = "error"
+                self.log_error("Error installing dependencies: ", f"{e}\n{e.output}")
+                return False
         
 
     def __create_prettier_config(self) -> bool:
@@ -87,9 +250,8 @@ class Framework(Log):
                 return True
             else: 
                 self.log_info("Creating Prettier configuration...")
-                prettier_config_path: Path = Path(__file__).parent.parent.parent / "prettier_config" / "config.json"
                 # Load the JSON configuration
-                with open(prettier_config_path, "r") as config_file:
+                with open(self.PRETTIER_CONFIG_PATH, "r") as config_file:
                     prettier_config_data: dict = json.load(config_file)
                 # Write the configuration using Path.write_text()
                 prettierrc_path.write_text(json.dumps(prettier_config_data, indent=2))
@@ -109,84 +271,233 @@ class Framework(Log):
         """
         try:
             if self.framework == "hardhat":
-                result = subprocess.run(
-                    ["npm", "list", "--depth=0", "prettier"],
-                    cwd=self.repo_path,
-                    check=False,
-                    capture_output=True,
-                    text=True
-                )
-                if result.returncode == 0 and "prettier" in result.stdout: 
+                try:
+                    installed: bool = "prettier" in self.runner.run(["npm", "list", "--depth=0", "prettier"], cwd=self.repo_path, stage="formatter_setup")
+                except subprocess.CalledProcessError:
+                    installed: bool = False  # npm exits non-zero when the package is missing
+                if installed: 
                     self.log_info("Prettier is already installed")
                     self.__create_prettier_config()
                     return True
                 else:
                     self.log_info("Installing Prettier...")
-                    subprocess.run(
-                        ["npm", "install", "prettier", "prettier-plugin-solidity"],
-                        cwd=self.repo_path,
-                        check=True,
-                        capture_output=True,
-                        text=True
-                    )
+                    self.runner.run(["npm", "install", "prettier", "prettier-plugin-solidity"], cwd=self.repo_path, stage="formatter_setup")
                     self.log_success("Prettier installed successfully")
                     self.__create_prettier_config()
                     return True
             elif self.framework == "foundry":
                 self.log_info("Foundry framework don't need formatter detection")
                 return True
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
             self.log_error("Error setting up formatter: ", str(e))
             return False
             
             
-    def __run_formatter(self) -> bool:
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def __get_forge_version() -> str:
+        """
+        Returns the version of forge (computed once per process)
+        """
+        try:
+            return ProcessRunner().run(["forge", "--version"], timeout=30).strip()
+        except (OSError, subprocess.SubprocessError):
+            return "missing"
+
+
+    @classmethod
+    def get_formatter_config_files(cls) -> list[str]:
+        """
+        Returns the names of the project files (in any directory) the formatting of the project depends on
+        """
+        return cls.FORMATTER_CONFIG_FILES + (cls.FORMATTER_LOCK_FILES if cls.INSTALL_MODE != "skip" else [])
+
+
+    def __read_project_file(self, file_name: str) -> str:
+        """
+        Returns the content of a file in the repository root, empty if it doesn't exist
+        """
+        file_path: Path = Path(self.repo_path) / file_name
+        return file_path.read_text(errors="replace") if file_path.is_file() else ""
+
+
+    def __get_formatter_signature(self, formatter: str, config_path: str | None = None) -> str:
+        """
+        Returns what determines the formatter output: the formatter, its version and its config
+
+        Args:
+            formatter (str): "toolchain", "prettier" (the project's own) or "forge"
+            config_path (str): The prettier config used with the toolchain
+        """
+        if formatter == "forge":
+            parts: list[str] = [formatter, self.__get_forge_version(), self.FOUNDRY_FMT_LINE_LENGTH, self.__read_project_file("foundry.toml")]
+        elif formatter == "toolchain":
+            parts: list[str] = [formatter, json.dumps(self.toolchain.get_versions()), Path(config_path).read_text()]
+        else:
+            parts: list[str] = [formatter, self.__read_project_file("node_modules/prettier/package.json"), self.__read_project_file(".prettierrc")]
+        return json.dumps(parts)
+
+
+    def __format_files(self, command: list[str], files: list[str], signature: str, env: dict | None = None) -> None:
+        """
+        Formats the files whose content isn't known to be formatted yet, in batches run in parallel
+
+        Args:
+            command (list[str]): The formatter command, the files of a batch are appended to it
+            files (list[str]): The files to format, relative to the repository root
+            signature (str): The formatter signature the formatted contents are recorded under
+            env (dict): The environment for the formatter
+        """
+        with self.span("format", framework=self.framework, formatter=command[0], files=len(files)) as span:
+            file_hashes: dict[str, str] = {file: self.format_cache.hash_file(os.path.join(self.repo_path, file)) for file in files}
+            pending: list[str] = self.format_cache.filter_unformatted(signature, file_hashes)
+            span["formatted_files"] = 0
+            span["bytes"] = sum(os.path.getsize(os.path.join(self.repo_path, file)) for file in pending)
+            Metrics().inc("cache_requests_total", {"cache": "format", "outcome": "hit"}, len(files) - len(pending))
+            Metrics().inc("cache_requests_total", {"cache": "format", "outcome": "miss"}, len(pending))
+            self.log_info("Files to format: ", f"{len(pending)} ({len(files) - len(pending)} already formatted)")
+            if not pending:
+                return
+            batches: list[list[str]] = [pending[start:start + self.FORMAT_BATCH_SIZE] for start in range(0, len(pending), self.FORMAT_BATCH_SIZE)]
+            formatted: list[str] = []
+            error: Exception | None = None
+            with ThreadPoolExecutor(max_workers=max(1, min(self.FORMAT_WORKERS, len(batches)))) as executor:
+                futures: list = [executor.submit(self.runner.run, command + batch, cwd=self.repo_path, env=env, stage="format") for batch in batches]
+                for batch, future in zip(batches, futures):
+                    try:
+                        future.result()
+                        formatted += batch
+                    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                        error = error or e
+            # Only the batches the formatter got through count as formatted, the others are retried next time
+            span["formatted_files"] = len(formatted)
+            self.format_cache.add(signature, [self.format_cache.hash_file(os.path.join(self.repo_path, file)) for file in formatted])
+            if error is not None:
+                raise error
+
+
+    def __get_foundry_env(self) -> dict:
+        """
+        Returns the environment for `forge fmt`
+        """
+        # Create a copy of the current environment
+        env: dict = os.environ.copy()
+        # Set the environment variable
+        env["FOUNDRY_FMT_LINE_LENGTH"] = self.FOUNDRY_FMT_LINE_LENGTH
+        return env
+
+
+    def __run_formatter(self, files: list[str]) -> bool:
         """
         Runs the formatting command for the detected framework
 
+        Args:
+            files (list[str]): The files to format, relative to the repository root
+
         Returns:
             bool: True if code was formatted successfully, False otherwise
         """
         try:
             if self.framework == "hardhat":
-                subprocess.run(
-                    ["npx", "prettier", "--write", "**/*.sol"],
-                    cwd=self.repo_path,
-                    check=True,
-                    capture_output=True,
-                    text=True
-                )
+                self.__format_files(["npx", "prettier", "--write"], files, self.__get_formatter_signature("prettier"))
                 self.log_success("Hardhat code formatted successfully\n")
                 return True
             elif self.framework == "foundry":
-                # Create a copy of the current environment
-                env: dict = os.environ.copy()
-                # Set the environment variable
-                env["FOUNDRY_FMT_LINE_LENGTH"] = "80"
-
-                subprocess.run(
-                    ["forge", "fmt"],
-                    cwd=self.repo_path,
-                    env=env, # Pass the modified environment
-                    check=True,
-                    capture_output=True,
-                    text=True
-                )
+                self.__format_files(["forge", "fmt"], files, self.__get_formatter_signature("forge"), self.__get_foundry_env())
                 self.log_success("Foundry code formatted successfully\n")
                 return True
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
             self.log_error("Error formatting code: ", str(e))
             return False
-        
-        
-        
-    def format_code(self) -> bool:
+        self.log_error("No formatter for framework: ", self.framework)
+        return False
+
+
+    def __run_toolchain_formatter(self, files: list[str]) -> bool:
         """
-        Formats the code for the detected framework
+        Formats the given files without installing the project's dependencies:
+        `forge fmt` for Foundry, the bot's pinned prettier toolchain for the npm based frameworks
+
+        Args:
+            files (list[str]): The files to format, relative to the repository root
+
+        Returns:
+            bool: True if code was formatted successfully, False otherwise
+        """
+        if not files:
+            self.log_info("No files in scope to format")
+            return True
+        try:
+            if self.framework == "foundry":
+                self.__format_files(["forge", "fmt"], files, self.__get_formatter_signature("forge"), self.__get_foundry_env())
+            else:
+                if not self.__ensure_toolchain():
+                    return False
+                config_path: str = self.toolchain.write_prettier_config(self.repo_path, self.PRETTIER_CONFIG_PATH)
+                self.__format_files(self.toolchain.get_prettier_command(config_path), files, self.__get_formatter_signature("toolchain", config_path))
+            self.log_success(f"{self.framework.capitalize()} code formatted without installing dependencies\n")
+            return True
+        except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            self.log_error("Error formatting with the formatter toolchain: ", str(e))
+            return False
+
+
+    def format_code(self, files: list[str]) -> bool:
+        """
+        Formats the in-scope code for the detected framework
+
+        Args:
+            files (list[str]): The files in scope, the same list cloc counts
 
         Returns:
             bool: True if code was formatted successfully, False otherwise
         """
+        if self.is_monorepo():
+            return self.__format_projects(files)
+        if self.INSTALL_MODE == "skip" and self.framework in self.FRAMEWORK_DEFINITIONS:
+            if self.__run_toolchain_formatter(files):
+                return True
+            self.log_info("Falling back to a full dependency install")
+        if not self.project_ready:
+            self.__setup_project()
+        return self.__run_formatter(files)
+
+
+    def __ensure_toolchain(self) -> bool:
+        """
+        Sets up the bot's pinned prettier toolchain once per handler
+        """
+        if not self.toolchain_ready:
+            with self.span("formatter_setup", framework=self.framework, formatter="toolchain") as span:
+                self.toolchain_ready = self.toolchain.ensure()
+                span["status"] = "ok" if self.toolchain_ready else "error"
+        return self.toolchain_ready
+
+
+    def __setup_project(self) -> None:
+        """
+        Installs the project's dependencies and its formatter
+        """
         self.__install_dependencies()
-        self.__setup_formatter()
-        self.__run_formatter()
+        with self.span("formatter_setup", framework=self.framework, formatter="project"):
+            self.__setup_formatter()
+        # Save after the formatter setup, so a cache hit already has prettier and never writes into the linked trees
+        if self.dependency_cache_key:
+            self.dependency_cache.save(self.dependency_cache_key, self.repo_path, self.FRAMEWORK_DEFINITIONS[self.framework]["dependency_dirs"])
+            self.dependency_cache_key = None
+        self.project_ready = True
+
+
+    def prepare(self) -> None:
+        """
+        Gets the formatter ready without touching the files in scope, so it can run while they are counted
+        unformatted: the bot's toolchain in skip mode (nothing for `forge fmt`), the project's dependencies and
+        formatter in full mode. `format_code` reuses what is ready; sub-projects of a monorepo are set up there
+        """
+        if self.is_monorepo() or self.framework not in self.FRAMEWORK_DEFINITIONS:
+            return
+        if self.INSTALL_MODE == "skip":
+            if self.framework != "foundry":
+                self.__ensure_toolchain()
+            return
+        self.__setup_project()
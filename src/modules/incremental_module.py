@@ -0,0 +1,199 @@
+import git
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from modules.cloc_module import Cloc
+from modules.count_store_module import CountStore
+from modules.framework_module import Framework
+from modules.loc_counter_module import LocCounter
+from modules.log_module import Log
+from modules.repository_module import Repository
+from modules.scope_module import Scope
+
+class BaseCommitNotFoundError(Exception):
+    """
+    The base commit of a fix review isn't in the repository, so there is nothing to recount against
+    """
+
+
+class IncrementalCount(Log):
+    """
+    Recounts a "fix review" commit against a base commit of the same repository: the stored per-file
+    counts of the base are reused and only the files changed in `git diff --name-status base..target`
+    are formatted and counted again. Snapshots are counted with the configured engine and keyed by the
+    formatter config files of their commit too, a change to those recounts every file.
+    """
+    STATUS_NAMES: dict = {"A": "added", "M": "modified", "R": "renamed", "D": "deleted", "C": "copied", "T": "modified"}
+
+
+    def __init__(self, repository: Repository, framework: Framework, repo_key: str, settings_key: str, scope: Scope | None = None) -> None:
+        """
+        Initialize the recount of a cloned repository checked out at the target commit
+        Args:
+            repository (Repository): The cloned repository
+            framework (Framework): The framework handler of the checkout, with the framework detected
+            repo_key (str): The normalised repository URL
+            settings_key (str): The key of the scope, engine and formatter settings
+            scope (Scope): The scope of the checkout, reuses its index of the tree
+        """
+        self.repository: Repository = repository
+        self.framework: Framework = framework
+        self.repo_key: str = repo_key
+        self.settings_key: str = settings_key
+        self.scope: Scope | None = scope
+        self.count_store: CountStore = CountStore()
+
+
+    def __get_changes(self, base_sha: str, target_sha: str) -> dict[str, tuple[str, str | None]]:
+        """
+        Returns the changed files of the target commit with their status and, for renames, the old path
+        Returns:
+            dict: {target path (old path for deletions): (status letter, old path or None)}
+        """
+        output: str = git.Repo(self.repository.temp_dir).git.diff("--name-status", "-M", "-z", base_sha, target_sha)
+        fields: list[str] = [field for field in output.split("\0") if field]
+        changes: dict[str, tuple[str, str | None]] = {}
+        index: int = 0
+        while index < len(fields):
+            status: str = fields[index]
+            if status[0] in ("R", "C"):  # Renames and copies carry the similarity and two paths
+                changes[fields[index + 2]] = (status, fields[index + 1])
+                index += 3
+            else:
+                changes[fields[index + 1]] = (status, None)
+                index += 2
+        return changes
+
+
+    def __get_snapshot_key(self, commit_sha: str) -> str:
+        """
+        Returns the key of the snapshot of a commit: the settings key and the formatter config files the commit carries
+        """
+        config_names: set[str] = set(Framework.get_formatter_config_files())
+        listing: str = git.Repo(self.repository.temp_dir).git.ls_tree("-r", "-z", commit_sha)
+        # Entries are "<mode> <type> <blob sha>\t<path>", the blob SHA changes with the content
+        config_files: list[str] = sorted(entry.split(" ", 2)[2] for entry in listing.split("\0") if entry and os.path.basename(entry.split("\t", 1)[1]) in config_names)
+        return hashlib.sha256(json.dumps([self.settings_key, config_files]).encode()).hexdigest()
+
+
+    def __count(self, repo_path: str, files: list[str]) -> list[dict]:
+        """
+        Counts the files with the configured engine, like the full analysis whose snapshots are reused
+        """
+        return Cloc(repo_path, {"Language": self.repository.language}).count_files(files)
+
+
+    def __count_base(self, base_sha: str, snapshot_key: str) -> list[dict]:
+        """
+        Counts the base commit in a separate worktree when no stored counts exist
+        """
+        self.log_info("No stored counts for base commit, counting it: ", base_sha[:10])
+        worktree_path: str = tempfile.mkdtemp(prefix="repo_base_")
+        repo: git.Repo = git.Repo(self.repository.temp_dir)
+        try:
+            repo.git.worktree("add", "--detach", "--force", worktree_path, base_sha)
+            base_framework: Framework = Framework(worktree_path)
+            base_framework.detect_framework()
+            files: list[str] = Scope(worktree_path, self.repository.scope, self.repository.language).get_files()
+            base_framework.format_code(files)
+            file_counts: list[dict] = self.__count(worktree_path, files)
+        finally:
+            repo.git.worktree("remove", "--force", worktree_path)
+            shutil.rmtree(worktree_path, ignore_errors=True)
+        self.count_store.put_snapshot(self.repo_key, base_sha, snapshot_key, file_counts)
+        return file_counts
+
+
+    def __format_report(self, base_sha: str, target_sha: str, base_counts: dict[str, dict], target_counts: dict[str, dict], changes: dict) -> str:
+        """
+        Formats the totals and the per-file delta table
+        """
+        rows: list[str] = [f"{'Status':<10}{'File':<48}{'Base':>8}{'Target':>8}{'Delta':>8}", "-" * 82]
+        changed_loc: int = 0
+        for path, (status, old_path) in sorted(changes.items()):
+            base_code: int = base_counts.get(old_path or path, {}).get("code", 0)
+            target_code: int = target_counts.get(path, {}).get("code", 0)
+            if (old_path or path) not in base_counts and path not in target_counts:
+                continue  # Not in scope in either commit
+            if status[0] != "D" and status != "R100":  # Deletions and pure renames don't add code to review
+                changed_loc += target_code
+            file_name: str = path if len(path) <= 46 else "..." + path[-43:]
+            rows.append(f"{self.STATUS_NAMES.get(status[0], status):<10}{file_name:<48}{base_code:>8}{target_code:>8}{target_code - base_code:>+8}")
+        if len(rows) == 2:
+            rows.append("No in-scope files changed")
+        base_total: int = sum(counts["code"] for counts in base_counts.values())
+        target_total: int = sum(counts["code"] for counts in target_counts.values())
+        return (
+            f"Fix review {base_sha[:10]}..{target_sha[:10]}\n"
+            f"```{chr(10).join(rows)}```\n"
+            f"Base: {base_total} code lines in {len(base_counts)} files\n"
+            f"Target: {target_total} code lines in {len(target_counts)} files\n"
+            f"Net change: {target_total - base_total:+d}\n"
+            f"Changed LOC (added and modified files): {changed_loc}"
+        )
+
+
+    def save_snapshot(self, files: list[str], file_counts: list[dict] | None = None) -> None:
+        """
+        Stores the per-file counts of a full analysis, so a later fix review of this commit is incremental
+        Args:
+            files (list[str]): The formatted files in scope
+            file_counts (list[dict]): The counts if the analysis already produced them with the configured engine
+        """
+        if file_counts is None:
+            file_counts = self.__count(self.repository.temp_dir, files)
+        head_sha: str = self.repository.get_head_sha()
+        self.count_store.put_snapshot(self.repo_key, head_sha, self.__get_snapshot_key(head_sha), file_counts)
+
+
+    def run(self, base: str) -> str:
+        """
+        Recounts the target commit against the base commit and stores the target counts
+        Args:
+            base (str): The base commit hash or ref from the message
+        Returns:
+            str: The report with the totals and the per-file delta table
+        Raises:
+            BaseCommitNotFoundError: The base commit isn't in the repository
+        """
+        base_sha: str | None = self.repository.ensure_commit(base)
+        if base_sha is None:
+            raise BaseCommitNotFoundError(f"Base commit {base} was not found in the repository")
+        target_sha: str = self.repository.get_head_sha()
+
+        base_key: str = self.__get_snapshot_key(base_sha)
+        target_key: str = self.__get_snapshot_key(target_sha)
+        base_file_counts: list[dict] | None = self.count_store.get_snapshot(self.repo_key, base_sha, base_key)
+        if base_file_counts is None:
+            base_file_counts = self.__count_base(base_sha, base_key)
+        base_counts: dict[str, dict] = {counts["file"]: counts for counts in base_file_counts}
+        reusable: bool = base_key == target_key  # Otherwise the unchanged files may be formatted differently now
+        if not reusable:
+            self.log_info("Formatter config changed since the base commit, recounting every file")
+
+        changes: dict[str, tuple[str, str | None]] = self.__get_changes(base_sha, target_sha)
+        target_files: list[str] = (self.scope or Scope(self.repository.temp_dir, self.repository.scope, self.repository.language)).get_files()
+        # Duplicates are dropped across the whole scope, as in the full count, not only among the recounted files
+        target_files = LocCounter.unique_files(self.repository.temp_dir, target_files)
+        target_counts: dict[str, dict] = {}
+        to_count: list[str] = []
+        for path in target_files:
+            status, old_path = changes.get(path, ("", None))
+            reused: dict | None = None
+            if reusable and not status:
+                reused = base_counts.get(path)
+            elif reusable and status == "R100":  # Pure rename, the content is unchanged
+                reused = base_counts.get(old_path)
+            if reused is None:
+                to_count.append(path)
+            else:
+                target_counts[path] = {**reused, "file": path}
+        self.log_info("Files to recount: ", f"{len(to_count)} of {len(target_files)}")
+
+        self.framework.format_code(to_count)
+        for counts in self.__count(self.repository.temp_dir, to_count):
+            target_counts[counts["file"]] = counts
+        self.count_store.put_snapshot(self.repo_key, target_sha, target_key, list(target_counts.values()))
+        return self.__format_report(base_sha, target_sha, base_counts, target_counts, changes)
@@ -0,0 +1,558 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable
+from modules.cancel_module import Cancellation, JobCancelledError
+from modules.config_module import Config
+from modules.log_module import Log
+from modules.metrics_module import Metrics
+from modules.progress_module import Progress
+from modules.stage_limit_module import StageLimits
+
+def init_worker(semaphores: dict, progress_queue) -> None:
+    """
+    Installs the per-stage limits and the progress queue in a worker process
+    """
+    StageLimits.configure(semaphores)
+    Progress.configure(progress_queue)
+
+
+def run_job(worker: Callable[[str], str], job_id: str, text: str) -> str:
+    """
+    Runs the worker of a job in a worker process with the job bound to the log context, so every span
+    of the analysis reports its progress to the job, under the watchdog of its cancellation and deadline
+    """
+    with Log().bind(job=job_id), Cancellation.watch(job_id):
+        return worker(text)
+
+
+class JobQueue(Log):
+    """
+    A bounded queue of analysis jobs executed by a pool of worker processes.
+    The Slack event is acknowledged as soon as the job is queued, the result is delivered via `on_done`.
+    A job submitted with the key of a job that is still queued or running is coalesced with it: it doesn't
+    run, it gets the result of the first job and its own `on_done` call. Jobs are handed to the pool only
+    while a worker is free and `can_start` allows it, so under disk pressure new jobs wait on the queue.
+    The stages the workers report are collected on the job and handed to `on_progress`, throttled per job
+    and overall to stay within the Slack rate limits. A cancelled job leaves the queue at once, or has its
+    processes killed by the worker's watchdog if it is running, which frees its worker within seconds.
+    A cancelled job that others are coalesced with hands its analysis over to the first of them instead.
+    """
+    MAX_WORKERS: int = Config.get_int("WORKER_COUNT", os.cpu_count() or 2)
+    MAX_QUEUE_SIZE: int = Config.get_int("JOB_QUEUE_SIZE", 50)
+    JOB_HISTORY_SIZE: int = Config.get_int("JOB_HISTORY_SIZE", 200)  # How many finished jobs to keep for reporting
+    ADMISSION_RETRY_SECONDS: float = Config.get_float("JOB_ADMISSION_RETRY_SECONDS", 5.0)  # How often held back jobs are retried
+    PROGRESS_INTERVAL_SECONDS: float = Config.get_float("JOB_PROGRESS_INTERVAL_SECONDS", 3.0)  # Minimum time between progress updates of a job
+    PROGRESS_MAX_PER_MINUTE: int = Config.get_int("JOB_PROGRESS_MAX_PER_MINUTE", 40)  # Progress updates of all jobs together
+
+
+    def __init__(self, worker: Callable[[str], str], on_done: Callable[[dict], None], max_workers: int | None = None, max_queue_size: int | None = None, can_start: Callable[[], bool] | None = None, on_progress: Callable[[dict], None] | None = None) -> None:
+        """
+        Initialize the job queue
+        Args:
+            worker (Callable[[str], str]): Top-level (picklable) function that runs the analysis of a Slack message
+            on_done (Callable[[dict], None]): Callback invoked in this process with the finished job
+            max_workers (int): The number of worker processes
+            max_queue_size (int): The number of jobs that may wait for a free worker
+            can_start (Callable[[], bool]): Tells if another job may start now, e.g. False while the workspaces are short of disk
+            on_progress (Callable[[dict], None]): Callback invoked in this process with a copy of a queued or running job whose stages changed
+        """
+        self.worker: Callable[[str], str] = worker
+        self.on_done: Callable[[dict], None] = on_done
+        self.max_workers: int = max_workers or self.MAX_WORKERS
+        self.max_queue_size: int = max_queue_size if max_queue_size is not None else self.MAX_QUEUE_SIZE
+        self.jobs: dict[str, dict] = {}
+        self.futures: dict[str, Future] = {}  # The futures of the running analyses, by the ID they run under
+        self.can_start: Callable[[], bool] | None = can_start
+        self.backlog: list[str] = []  # The IDs of the queued jobs not handed to the pool yet, oldest first
+        self.held_back: bool = False  # `can_start` refused the last job
+        self.retry_timer: threading.Timer | None = None
+        self.on_progress: Callable[[dict], None] | None = on_progress
+        self.progress_queue = None  # Created with the progress thread on the first submit
+        self.progress_thread: threading.Thread | None = None
+        self.progress_dirty: set[str] = set()  # Jobs with progress not handed to `on_progress` yet
+        self.progress_urgent: set[str] = set()  # Jobs with an early answer not handed over yet, sent without waiting for the interval
+        self.progress_sent: deque[float] = deque()  # When the progress updates of the last minute were handed over
+        self.lock: threading.Lock = threading.Lock()
+        self.delivery_lock: threading.Lock = threading.Lock()  # Progress and results of a job are delivered one at a time, never progress after the result
+        self.executor: ProcessPoolExecutor | None = None  # Created lazily so importing the bot doesn't start workers
+        # The web process runs threads (progress, timers, the server's), which a forked worker would inherit
+        # mid-operation, so workers are started from a clean fork server instead
+        self.mp_context = multiprocessing.get_context("forkserver")
+        self.done_queue: queue.Queue = queue.Queue()  # Finished futures, delivered off the pool's management thread
+        self.done_thread: threading.Thread | None = None
+        self.closed: bool = False  # Shut down, queued jobs are no longer dispatched
+
+
+    def __get_executor(self) -> ProcessPoolExecutor:
+        """
+        Returns the worker pool, creating it on first use
+        """
+        if self.executor is None:
+            self.log_info("Starting worker pool with workers: ", str(self.max_workers))
+            # The workers share the per-stage concurrency limits (STAGE_LIMITS) and report their progress to this process
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context, initializer=init_worker, initargs=(StageLimits.create(context=self.mp_context), self.progress_queue))
+        return self.executor
+
+
+    def __start_progress(self) -> None:
+        """
+        Starts the threads collecting the progress and the results of the workers, on first use
+        """
+        if self.progress_thread is None:
+            self.progress_queue = Progress.create(self.mp_context)
+            self.progress_thread = threading.Thread(target=self.__collect_progress, daemon=True)
+            self.progress_thread.start()
+            self.done_thread = threading.Thread(target=self.__collect_done, daemon=True)
+            self.done_thread.start()
+
+
+    def __collect_done(self) -> None:
+        """
+        Delivers the finished jobs; `on_done` calls Slack, which must not block the pool's management thread
+        """
+        while True:
+            item: tuple[str, Future] | None = self.done_queue.get()
+            if item is None:  # Shutdown
+                return
+            self.__finish(*item)
+
+
+    def __find_worker_job(self, work_id: str) -> dict | None:
+        """
+        Returns the job an analysis runs for, the job it was started for or the follower that took it over
+        """
+        for job in self.jobs.values():
+            if job["work"] == work_id:
+                return job
+        return None
+
+
+    def __apply_progress(self, event: dict) -> None:
+        """
+        Records a progress event on its job and the jobs coalesced with it
+        """
+        job: dict | None = self.__find_worker_job(event["job"])
+        if job is None or job["state"] not in ("queued", "running"):
+            return
+        if event["state"] == "early_result":
+            job["early_result"] = event["result"]
+            self.progress_urgent.add(job["id"])
+        elif event["state"] == "running":
+            job["stages"].append({"stage": event["stage"], "state": "running", "started_at": event["at"], "seconds": None})
+        elif event["state"] == "output":
+            job["detail"] = event["detail"]
+        else:
+            for stage in reversed(job["stages"]):
+                if stage["stage"] == event["stage"] and stage["state"] == "running":
+                    stage["state"] = event["state"]
+                    stage["seconds"] = event["seconds"]
+                    break
+            job["detail"] = None
+        self.progress_dirty.add(job["id"])
+        for follower_id in job["followers"]:
+            if follower_id in self.jobs:
+                self.jobs[follower_id]["detail"] = job["detail"]
+                self.jobs[follower_id]["early_result"] = job["early_result"]
+                self.progress_dirty.add(follower_id)
+                if job["id"] in self.progress_urgent:
+                    self.progress_urgent.add(follower_id)
+
+
+    def __collect_progress(self) -> None:
+        """
+        Applies the progress events of the workers and hands the changed jobs to `on_progress`, at most every
+        PROGRESS_INTERVAL_SECONDS per job and PROGRESS_MAX_PER_MINUTE overall; the latest state wins
+        """
+        last_sent: dict[str, float] = {}
+        while True:
+            try:
+                event: dict | None = self.progress_queue.get(timeout=min(1.0, self.PROGRESS_INTERVAL_SECONDS))
+                if event is None:  # Shutdown
+                    return
+                with self.lock:
+                    self.__apply_progress(event)
+            except queue.Empty:
+                pass
+            if self.on_progress is None:
+                continue
+            now: float = time.time()
+            while self.progress_sent and now - self.progress_sent[0] > 60:
+                self.progress_sent.popleft()
+            with self.lock:
+                # An early answer is the point of the message, it goes out first and skips the throttling
+                due: list[str] = sorted(self.progress_urgent) + sorted(
+                    (job_id for job_id in self.progress_dirty - self.progress_urgent if now - last_sent.get(job_id, 0.0) >= self.PROGRESS_INTERVAL_SECONDS),
+                    key=lambda job_id: last_sent.get(job_id, 0.0)
+                )[:max(0, self.PROGRESS_MAX_PER_MINUTE - len(self.progress_sent))]
+                self.progress_dirty.difference_update(due)
+                self.progress_urgent.clear()
+            for job_id in due:
+                with self.delivery_lock:
+                    with self.lock:
+                        job: dict | None = self.jobs.get(job_id)
+                        if job is None or job["state"] not in ("queued", "running"):
+                            continue  # The result is delivered instead
+                        self.__refresh_state(job)
+                        snapshot: dict = self.__snapshot(job)
+                    last_sent[job_id] = now
+                    self.progress_sent.append(now)
+                    try:
+                        self.on_progress(snapshot)
+                    except Exception as e:
+                        self.log_error("Error delivering job progress: ", str(e))
+            for job_id in [job_id for job_id in last_sent if job_id not in self.jobs]:
+                del last_sent[job_id]
+
+
+    def __snapshot(self, job: dict) -> dict:
+        """
+        Returns a copy of a job without the message text, a coalesced job shows the stages of the job doing its work
+        """
+        leader: dict = self.jobs.get(job["coalesced_with"], job) if job["coalesced_with"] else job
+        snapshot: dict = {key: value for key, value in job.items() if key != "text"}
+        snapshot["stages"] = [dict(stage) for stage in leader["stages"]]
+        snapshot["early_result"] = leader["early_result"]
+        return snapshot
+
+
+    def __refresh_state(self, job: dict) -> None:
+        """
+        Moves a coalesced job to the running state once the job doing its work has started
+        """
+        if job["coalesced_with"]:
+            leader: dict | None = self.jobs.get(job["coalesced_with"])
+            if leader is not None and job["state"] == "queued" and leader["state"] == "running":
+                job["state"] = "running"
+                job["started_at"] = leader["started_at"]
+
+
+    def __dispatch(self) -> None:
+        """
+        Hands queued jobs to the pool while workers are free and `can_start` allows it. A refused job
+        stays first on the queue and is retried after ADMISSION_RETRY_SECONDS or when a job finishes.
+        """
+        while True:
+            with self.lock:
+                if self.closed or not self.backlog or sum(1 for job in self.jobs.values() if job["state"] == "running" and not job["coalesced_with"]) >= self.max_workers:
+                    return
+            # Checked without the lock, it may have to measure or evict workspaces
+            if self.can_start is not None and not self.can_start():
+                with self.lock:
+                    if not self.held_back:
+                        self.log_info("Holding back queued jobs: ", f"{len(self.backlog)} waiting for disk space")
+                    self.held_back = True
+                    if self.retry_timer is None:
+                        self.retry_timer = threading.Timer(self.ADMISSION_RETRY_SECONDS, self.__retry_dispatch)
+                        self.retry_timer.daemon = True
+                        self.retry_timer.start()
+                return
+            with self.lock:
+                running: int = sum(1 for job in self.jobs.values() if job["state"] == "running" and not job["coalesced_with"])
+                if not self.backlog or running >= self.max_workers:  # Another thread dispatched in the meantime
+                    return
+                self.held_back = False
+                job: dict = self.jobs[self.backlog.pop(0)]
+                job["state"] = "running"
+                job["started_at"] = time.time()
+                job["work"] = job["id"]
+                for follower_id in job["followers"]:
+                    self.__refresh_state(self.jobs[follower_id])
+                future: Future = self.__get_executor().submit(run_job, self.worker, job["work"], job["text"])
+                self.futures[job["work"]] = future
+            future.add_done_callback(lambda done, work_id=job["work"]: self.done_queue.put((work_id, done)))
+
+
+    def __retry_dispatch(self) -> None:
+        with self.lock:
+            self.retry_timer = None
+        self.__dispatch()
+
+
+    def __count_pending(self) -> int:
+        """
+        Returns the number of jobs that are queued or running, coalesced jobs don't take a worker
+        """
+        return sum(1 for job in self.jobs.values() if job["state"] in ("queued", "running") and not job["coalesced_with"])
+
+
+    def __find_in_flight(self, key: str) -> dict | None:
+        """
+        Returns the queued or running job that does the work for a key, not one whose analysis is being cancelled
+        """
+        for job in self.jobs.values():
+            if job["key"] == key and job["state"] in ("queued", "running") and not job["coalesced_with"]:
+                if job["work"] is not None and Cancellation.is_requested(job["work"]):
+                    continue
+                return job
+        return None
+
+
+    def __prune_history(self) -> None:
+        """
+        Forgets the oldest finished jobs once the history is full
+        """
+        finished: list[dict] = [job for job in self.jobs.values() if job["state"] in ("done", "failed", "cancelled")]
+        for job in sorted(finished, key=lambda job: job["finished_at"])[:max(0, len(finished) - self.JOB_HISTORY_SIZE)]:
+            self.jobs.pop(job["id"], None)
+
+
+    def submit(self, channel_id: str, thread_ts: str, text: str, key: str | None = None) -> dict | None:
+        """
+        Puts a new analysis job on the queue
+        Args:
+            channel_id (str): The channel the message was posted in
+            thread_ts (str): The timestamp of the message to reply to
+            text (str): The text of the Slack message
+            key (str): The key of identical requests, a job with the key of an in-flight job is coalesced with it
+        Returns:
+            dict: The queued job, or None if the queue is full
+        """
+        with self.lock:
+            leader: dict | None = self.__find_in_flight(key) if key else None
+            if leader is None and self.__count_pending() >= self.max_workers + self.max_queue_size:
+                self.log_error("Job queue is full, rejecting message: ", thread_ts)
+                Metrics().inc("analysis_jobs_total", {"state": "rejected"})
+                return None
+            job: dict = {
+                "id": uuid.uuid4().hex[:12],
+                "channel": channel_id,
+                "thread_ts": thread_ts,
+                "text": text,
+                "state": "queued",
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "key": key,
+                "coalesced_with": leader["id"] if leader else None,
+                "followers": [],
+                "work": None,  # The ID the analysis runs under in the worker, a follower taking it over keeps it
+                "stages": [],  # The stages reported by the worker: {"stage", "state", "started_at", "seconds"}
+                "detail": None,  # The latest output line of the running stage
+                "early_result": None  # The early answer of the analysis, before formatting (see `Progress.report_result`)
+            }
+            self.__start_progress()
+            self.jobs[job["id"]] = job
+            self.progress_dirty.add(job["id"])
+            if leader is not None:
+                leader["followers"].append(job["id"])
+                self.__refresh_state(job)
+                self.log_info("Coalesced job with in-flight job: ", f"{job['id']} -> {leader['id']}")
+                Metrics().inc("analysis_jobs_total", {"state": "coalesced"})
+                return job
+            self.backlog.append(job["id"])
+        self.log_info("Queued analysis job: ", job["id"])
+        self.__dispatch()
+        return job
+
+
+    def __finish(self, work_id: str, future: Future) -> None:
+        """
+        Records the outcome of an analysis on its job and the coalesced jobs and hands each over to the `on_done` callback
+        """
+        with self.delivery_lock:
+            self.__deliver(work_id, future)
+        self.__dispatch()
+
+
+    def __deliver(self, work_id: str, future: Future) -> None:
+        """
+        Records the outcome with the progress events already reported, and calls `on_done` for the job and its followers
+        """
+        with self.lock:
+            while True:  # The last stages of the job may still be on the progress queue
+                try:
+                    event: dict | None = self.progress_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None:
+                    self.progress_queue.put(None)  # Shutdown, leave it to the progress thread
+                    break
+                self.__apply_progress(event)
+            self.futures.pop(work_id, None)
+            Cancellation.clear(work_id)
+            job: dict | None = self.__find_worker_job(work_id)
+            if job is None:
+                return
+            job["work"] = None
+            job["started_at"] = job["started_at"] or job["submitted_at"]
+            job["finished_at"] = time.time()
+            try:
+                job["result"] = future.result()
+                job["state"] = "done"
+            except JobCancelledError:
+                job["error"] = "Cancelled"
+                job["state"] = "cancelled"
+            except Exception as e:
+                job["error"] = str(e) or e.__class__.__name__
+                job["state"] = "failed"
+            finished: list[dict] = [job]
+            for follower_id in job["followers"]:
+                follower: dict | None = self.jobs.get(follower_id)
+                if follower is not None:
+                    follower.update({key: job[key] for key in ("state", "started_at", "finished_at", "result", "error", "stages", "early_result")})
+                    finished.append(follower)
+            self.progress_dirty.difference_update(finished_job["id"] for finished_job in finished)
+            self.progress_urgent.difference_update(finished_job["id"] for finished_job in finished)
+            self.__prune_history()
+        self.__announce(finished)
+
+
+    def __announce(self, finished: list[dict]) -> None:
+        """
+        Records the metrics of finished jobs and hands each over to the `on_done` callback
+        """
+        for finished_job in finished:
+            Metrics().inc("analysis_jobs_total", {"state": finished_job["state"]})
+            Metrics().observe("analysis_job_duration_seconds", {"state": finished_job["state"]}, finished_job["finished_at"] - finished_job["submitted_at"])
+            if finished_job["state"] == "done":
+                self.log_success("Finished analysis job: ", finished_job["id"])
+            elif finished_job["state"] == "cancelled":
+                self.log_info("Cancelled analysis job: ", finished_job["id"])
+            else:
+                self.log_error("Analysis job failed: ", f"{finished_job['id']} ({finished_job['error']})")
+            try:
+                self.on_done(finished_job)
+            except Exception as e:
+                self.log_error("Error delivering job result: ", str(e))
+
+
+    def find_job(self, channel_id: str, thread_ts: str) -> dict | None:
+        """
+        Returns the queued or running job answering a message
+        Args:
+            channel_id (str): The channel of the message
+            thread_ts (str): The timestamp of the message
+        Returns:
+            dict: A copy of the job, or None if no job for the message is in flight
+        """
+        with self.lock:
+            for job in self.jobs.values():
+                if job["channel"] == channel_id and job["thread_ts"] == thread_ts and job["state"] in ("queued", "running"):
+                    return self.__snapshot(job)
+        return None
+
+
+    def __promote_follower(self, job: dict) -> dict | None:
+        """
+        Hands the analysis of a job that is being cancelled over to the first job coalesced with it, which
+        takes its place on the queue or its running analysis, the other followers now wait for it
+        Returns:
+            dict: The follower doing the work now, or None if no job is coalesced with this one
+        """
+        followers: list[dict] = [self.jobs[follower_id] for follower_id in job["followers"] if follower_id in self.jobs]
+        if not followers:
+            return None
+        successor: dict = followers[0]
+        successor.update({
+            "coalesced_with": None,
+            "followers": [follower["id"] for follower in followers[1:]],
+            "work": job["work"],
+            "stages": [dict(stage) for stage in job["stages"]],
+            "detail": job["detail"],
+            "early_result": job["early_result"]
+        })
+        for follower in followers[1:]:
+            follower["coalesced_with"] = successor["id"]
+        if job["id"] in self.backlog:
+            self.backlog[self.backlog.index(job["id"])] = successor["id"]
+        job["followers"] = []
+        job["work"] = None
+        self.log_info("Cancelled job handed its analysis to a coalesced job: ", f"{job['id']} -> {successor['id']}")
+        return successor
+
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a queued or running job. A coalesced job only stops waiting for the shared analysis, a job
+        doing the work for others hands it over to them and only an analysis nobody waits for is stopped.
+        Args:
+            job_id (str): The ID of the job
+        Returns:
+            bool: True if the job was in flight
+        """
+        with self.delivery_lock:
+            with self.lock:
+                job: dict | None = self.jobs.get(job_id)
+                if job is None or job["state"] not in ("queued", "running"):
+                    return False
+                if job["coalesced_with"]:
+                    leader: dict | None = self.jobs.get(job["coalesced_with"])
+                    if leader is not None and job["id"] in leader["followers"]:
+                        leader["followers"].remove(job["id"])
+                elif self.__promote_follower(job) is None:
+                    if job["work"] is not None:
+                        # Running: the watchdog of the worker kills its processes, the job finishes as cancelled
+                        Cancellation.request(job["work"])
+                        self.log_info("Cancelling running analysis job: ", job["id"])
+                        return True
+                    if job["id"] in self.backlog:
+                        self.backlog.remove(job["id"])
+                job.update({"state": "cancelled", "error": "Cancelled", "finished_at": time.time()})
+                job["started_at"] = job["started_at"] or job["finished_at"]
+                self.progress_dirty.discard(job["id"])
+                self.progress_urgent.discard(job["id"])
+            self.__announce([job])
+        return True
+
+
+    def get_job(self, job_id: str) -> dict | None:
+        """
+        Returns the current state of a job
+        Args:
+            job_id (str): The ID of the job
+        Returns:
+            dict: A copy of the job without the message text, or None if the job is unknown
+        """
+        with self.lock:
+            job: dict | None = self.jobs.get(job_id)
+            if job is None:
+                return None
+            self.__refresh_state(job)
+            return self.__snapshot(job)
+
+
+    def get_stats(self) -> dict:
+        """
+        Returns the queue depth and the state of every known job
+        """
+        with self.lock:
+            for job in self.jobs.values():
+                self.__refresh_state(job)
+            states: list[str] = [job["state"] for job in self.jobs.values()]
+            return {
+                "workers": self.max_workers,
+                "queue_capacity": self.max_queue_size,
+                "queue_depth": states.count("queued"),
+                "running": states.count("running"),
+                "held_back": self.held_back,
+                "jobs": [{key: value for key, value in job.items() if key not in ("text", "result")} for job in self.jobs.values()]
+            }
+
+
+    def shutdown(self) -> None:
+        """
+        Waits for running jobs and stops the worker pool
+        """
+        with self.lock:
+            self.closed = True
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        if self.done_thread is not None:
+            self.done_queue.put(None)  # After the results of the jobs the pool still finished
+            self.done_thread.join()
+            self.done_thread = None
+        if self.progress_thread is not None:
+            self.progress_queue.put(None)
+            self.progress_thread.join()
+            self.progress_thread = None
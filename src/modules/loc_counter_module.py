@@ -0,0 +1,294 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from modules.config_module import Config
+from modules.log_module import Log
+
+class LocCounter(Log):
+    """
+    An in-process line counter for Solidity (and other C-like) sources following cloc's rules:
+    whitespace-only lines are blank (also inside block comments), a line is code if anything
+    outside `//`, `///`, `/* */` and NatSpec comments remains, otherwise it is a comment line.
+    Comment markers inside string literals don't start comments. Like cloc, files with the same content are
+    counted once (see unique_files).
+    """
+    PARALLEL_THRESHOLD: int = Config.get_int("LOC_PARALLEL_THRESHOLD", 200)  # Count in a process pool from this many files
+    WORKERS: int = Config.get_int("LOC_WORKERS", os.cpu_count() or 2)
+    # Everything that changes the state of the scanner outside a block comment
+    TOKEN_PATTERN: re.Pattern = re.compile(r"//|/\*|[\"']")
+    TABLE_WIDTH: int = 79
+    HASH_CHUNK_BYTES: int = 1 << 20
+    # Counting runs in the threads of a worker process, forking one of those would copy the locks other threads hold
+    MP_CONTEXT = multiprocessing.get_context("forkserver")
+    # The counts of the conformance corpus worked out by hand from cloc's rules (not generated by cloc), to check
+    # the corpus without the binary. Where cloc is installed the corpus is checked against cloc itself
+    EXPECTED_FILE: str = "expected.json"
+
+
+    @staticmethod
+    def count_source(source: str) -> dict:
+        """
+        Counts the blank, comment and code lines of a source text
+        Args:
+            source (str): The content of the file
+        Returns:
+            dict: {"blank": int, "comment": int, "code": int}
+        """
+        counts: dict = {"blank": 0, "comment": 0, "code": 0}
+        in_block_comment: bool = False
+        lines: list[str] = source.split("\n")
+        if lines[-1] == "":  # The final newline doesn't start another line
+            lines.pop()
+        for line in lines:
+            if not line.strip():
+                counts["blank"] += 1
+                continue
+            has_code: bool = False
+            position: int = 0
+            length: int = len(line)
+            while position < length:
+                if in_block_comment:
+                    end: int = line.find("*/", position)
+                    if end == -1:
+                        break
+                    in_block_comment = False
+                    position = end + 2
+                    continue
+                match: re.Match | None = LocCounter.TOKEN_PATTERN.search(line, position)
+                if match is None:
+                    has_code = has_code or bool(line[position:].strip())
+                    break
+                has_code = has_code or bool(line[position:match.start()].strip())
+                token: str = match.group()
+                if token == "//":
+                    break
+                if token == "/*":
+                    in_block_comment = True
+                    position = match.end()
+                    continue
+                # A string literal: skip to the closing quote, honouring escapes (an unterminated string ends the line)
+                has_code = True
+                position = match.end()
+                while position < length:
+                    if line[position] == "\\":
+                        position += 2
+                    elif line[position] == token:
+                        position += 1
+                        break
+                    else:
+                        position += 1
+            counts["code" if has_code else "comment"] += 1
+        return counts
+
+
+    @staticmethod
+    def count_file(file_path: str) -> dict:
+        """
+        Counts the lines of a file
+        Args:
+            file_path (str): The path to the file
+        Returns:
+            dict: {"blank": int, "comment": int, "code": int}
+        """
+        with open(file_path, "r", encoding="utf-8", errors="replace") as source_file:
+            return LocCounter.count_source(source_file.read())
+
+
+    @staticmethod
+    def unique_files(repo_path: str, files: list[str]) -> list[str]:
+        """
+        Drops the files whose content equals the content of another file, as cloc does unless given
+        `--skip-uniqueness`: only files of the same size are hashed, the first in sorted order is kept
+        Args:
+            repo_path (str): The path to the repository
+            files (list[str]): The files, relative to the repository root
+        Returns:
+            list[str]: The files with distinct content, in the order of `files`
+        """
+        by_size: dict[int, list[str]] = {}
+        for file in sorted(files):
+            by_size.setdefault(os.path.getsize(os.path.join(repo_path, file)), []).append(file)
+        duplicates: set[str] = set()
+        for same_size in by_size.values():
+            if len(same_size) < 2:
+                continue
+            seen: set[str] = set()
+            for file in same_size:
+                digest = hashlib.md5()
+                with open(os.path.join(repo_path, file), "rb") as source_file:
+                    while chunk := source_file.read(LocCounter.HASH_CHUNK_BYTES):
+                        digest.update(chunk)
+                if digest.hexdigest() in seen:
+                    duplicates.add(file)
+                seen.add(digest.hexdigest())
+        return [file for file in files if file not in duplicates]
+
+
+    def count_files(self, repo_path: str, files: list[str]) -> list[dict]:
+        """
+        Counts the lines of every file, in a process pool for large trees
+        Args:
+            repo_path (str): The path to the repository
+            files (list[str]): The files to count, relative to the repository root
+        Returns:
+            list[dict]: One {"file", "blank", "comment", "code"} result per file, in the order of `files`
+        """
+        paths: list[str] = [os.path.join(repo_path, file) for file in files]
+        if len(paths) >= self.PARALLEL_THRESHOLD and self.WORKERS > 1:
+            with ProcessPoolExecutor(max_workers=self.WORKERS, mp_context=self.MP_CONTEXT) as executor:
+                counts: list[dict] = list(executor.map(LocCounter.count_file, paths, chunksize=max(1, len(paths) // (self.WORKERS * 4))))
+        else:
+            counts: list[dict] = [self.count_file(path) for path in paths]
+        return [{"file": file, **file_counts} for file, file_counts in zip(files, counts)]
+
+
+    def count_sources(self, sources: list[str]) -> list[dict]:
+        """
+        Counts the lines of source texts read elsewhere (e.g. git blobs), in a process pool for many of them
+        Args:
+            sources (list[str]): The contents to count
+        Returns:
+            list[dict]: One {"blank", "comment", "code"} result per source, in order
+        """
+        if len(sources) >= self.PARALLEL_THRESHOLD and self.WORKERS > 1:
+            with ProcessPoolExecutor(max_workers=self.WORKERS, mp_context=self.MP_CONTEXT) as executor:
+                return list(executor.map(LocCounter.count_source, sources, chunksize=max(1, len(sources) // (self.WORKERS * 4))))
+        return [self.count_source(source) for source in sources]
+
+
+    @staticmethod
+    def get_totals(results: list[dict]) -> dict:
+        """
+        Returns the summed counts of per-file results
+        """
+        return {key: sum(result[key] for result in results) for key in ("blank", "comment", "code")}
+
+
+    @classmethod
+    def format_table(cls, results: list[dict]) -> str:
+        """
+        Formats per-file results as a cloc style `--by-file` table
+        Args:
+            results (list[dict]): The per-file results
+        Returns:
+            str: The table
+        """
+        separator: str = "-" * cls.TABLE_WIDTH
+        name_width: int = cls.TABLE_WIDTH - 3 * 15
+        rows: list[str] = [separator, f"{'File':<{name_width}}{'blank':>15}{'comment':>15}{'code':>15}", separator]
+        for result in sorted(results, key=lambda result: (-result["code"], result["file"])):
+            file_name: str = f"./{result['file']}"
+            if len(file_name) > name_width - 1:
+                file_name = "..." + file_name[-(name_width - 4):]
+            rows.append(f"{file_name:<{name_width}}{result['blank']:>15}{result['comment']:>15}{result['code']:>15}")
+        totals: dict = cls.get_totals(results)
+        rows += [separator, f"{'SUM:':<{name_width}}{totals['blank']:>15}{totals['comment']:>15}{totals['code']:>15}", separator]
+        return f"{len(results)} text files.\n" + "\n".join(rows) + "\n"
+
+
+    @classmethod
+    def format_package_table(cls, packages: dict[str, list[dict]]) -> str:
+        """
+        Formats per-file results summed per package of a monorepo, with the overall total
+        Args:
+            packages (dict[str, list[dict]]): {package name: the per-file results of its files}
+        Returns:
+            str: The table
+        """
+        separator: str = "-" * cls.TABLE_WIDTH
+        name_width: int = cls.TABLE_WIDTH - 4 * 12
+        rows: list[str] = [separator, f"{'Package':<{name_width}}{'files':>12}{'blank':>12}{'comment':>12}{'code':>12}", separator]
+        for package, results in packages.items():
+            totals: dict = cls.get_totals(results)
+            package_name: str = package if len(package) < name_width else "..." + package[-(name_width - 4):]
+            rows.append(f"{package_name:<{name_width}}{len(results):>12}{totals['blank']:>12}{totals['comment']:>12}{totals['code']:>12}")
+        all_results: list[dict] = [result for results in packages.values() for result in results]
+        totals: dict = cls.get_totals(all_results)
+        rows += [separator, f"{'SUM:':<{name_width}}{len(all_results):>12}{totals['blank']:>12}{totals['comment']:>12}{totals['code']:>12}", separator]
+        return "\n".join(rows) + "\n"
+
+
+    @staticmethod
+    def from_cloc_json(cloc_counts: dict) -> list[dict]:
+        """
+        Returns the per-file results of a cloc `--by-file --json` output
+        Args:
+            cloc_counts (dict): The parsed output
+        Returns:
+            list[dict]: One {"file", "blank", "comment", "code"} result per file, paths relative to the counted directory
+        """
+        return [
+            {"file": file.removeprefix("./"), **{key: counts.get(key, 0) for key in ("blank", "comment", "code")}}
+            for file, counts in cloc_counts.items() if file not in ("header", "SUM")
+        ]
+
+
+    def compare_with_cloc(self, repo_path: str, files: list[str]) -> list[dict]:
+        """
+        Counts the files with both engines and returns the files where they disagree
+        Args:
+            repo_path (str): The path to the repository
+            files (list[str]): The files to compare, relative to the repository root
+        Returns:
+            list[dict]: {"file", "python", "cloc"} for every mismatch
+        """
+        result: subprocess.CompletedProcess = subprocess.run(
+            ["cloc", "--by-file", "--json", *files],
+            cwd=repo_path,
+            check=True,
+            capture_output=True,
+            text=True
+        )
+        return self.compare(repo_path, files, json.loads(result.stdout or "{}"))
+
+
+    def compare(self, repo_path: str, files: list[str], cloc_counts: dict) -> list[dict]:
+        """
+        Counts the unique files and returns the files where the counts disagree with a cloc `--by-file --json` output
+        Args:
+            repo_path (str): The path to the repository
+            files (list[str]): The files to compare, relative to the repository root
+            cloc_counts (dict): The output of cloc for the same files
+        Returns:
+            list[dict]: {"file", "python", "cloc"} for every mismatch, a count is None for a file the engine skipped
+        """
+        expected: dict[str, dict] = {
+            counts["file"]: {key: counts[key] for key in ("blank", "comment", "code")}
+            for counts in self.from_cloc_json(cloc_counts)
+        }
+        actual: dict[str, dict] = {
+            counts["file"]: {key: counts[key] for key in ("blank", "comment", "code")}
+            for counts in self.count_files(repo_path, self.unique_files(repo_path, files))
+        }
+        return [
+            {"file": file, "python": actual.get(file), "cloc": expected.get(file)}
+            for file in sorted(expected.keys() | actual.keys()) if actual.get(file) != expected.get(file)
+        ]
+
+
+if __name__ == "__main__":
+    # Conformance check against cloc: python -m modules.loc_counter_module <directory with .sol files>
+    # Without the cloc binary the counts are checked against the hand-derived expected.json of the directory
+    corpus_path: str = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "..", "conformance", "solidity")
+    corpus_files: list[str] = sorted(
+        os.path.relpath(os.path.join(directory, file_name), corpus_path)
+        for directory, _, file_names in os.walk(corpus_path) for file_name in file_names if file_name.endswith(".sol")
+    )
+    counter: LocCounter = LocCounter()
+    reference: str = "cloc" if shutil.which("cloc") else LocCounter.EXPECTED_FILE
+    if reference == "cloc":
+        corpus_mismatches: list[dict] = counter.compare_with_cloc(corpus_path, corpus_files)
+    else:
+        with open(os.path.join(corpus_path, LocCounter.EXPECTED_FILE), "r") as expected_file:
+            corpus_mismatches: list[dict] = counter.compare(corpus_path, corpus_files, json.load(expected_file))
+    for mismatch in corpus_mismatches:
+        counter.log_error("Mismatch: ", json.dumps(mismatch))
+    if corpus_mismatches:
+        sys.exit(1)
+    counter.log_success(f"All files match {reference}: ", str(len(corpus_files)))
@@ -1,9 +1,24 @@
+import contextvars
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator
 from rich.console import Console
 from rich.theme import Theme
+from modules.cancel_module import Cancellation
+from modules.config_module import Config
+from modules.metrics_module import Metrics
+from modules.progress_module import Progress
+from modules.stage_limit_module import StageLimits
 
 custom_theme: Theme = Theme({"success": "bold green", "error": "bold red"})
 console: Console = Console(theme=custom_theme)
 
+LOG_FORMAT: str = Config.get_str("LOG_FORMAT", "rich")  # "rich" for colored lines, "json" for one JSON object per line
+# Fields (repo, commit, job, ...) attached to every span and JSON line of the current analysis
+log_context: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+
 class Log(Console):
     """
     A class that extends the Console class to provide a more user-friendly logging system.
@@ -12,16 +27,90 @@ class Log(Console):
         super().__init__(theme=custom_theme)
 
 
-    def log_success(self, message: str) -> None:
-        console.log(f"[success]{message}[/success]")
+    def log_json(self, event: str, **fields) -> None:
+        """
+        Writes a structured log line with the fields of the current context
+        Args:
+            event (str): The event name, e.g. `span` or `log`
+            fields: The fields of the event
+        """
+        record: dict = {"timestamp": round(time.time(), 3), "event": event, **log_context.get(), **fields}
+        sys.stdout.write(json.dumps(record, default=str) + "\n")
+        sys.stdout.flush()
+
 
+    def log_success(self, message: str, args: str = "") -> None:
+        if LOG_FORMAT == "json":
+            self.log_json("log", level="success", message=f"{message}{args}")
+        elif args:
+            console.log(f"[success]{message}[/success] [underline]{args}[/underline]")
+        else:
+            console.log(f"[success]{message}[/success]")
 
-    def log_error(self, message: str) -> None:
-        console.log(f"[error]{message}[/error]")
+
+    def log_error(self, message: str, args: str = "") -> None:
+        if LOG_FORMAT == "json":
+            self.log_json("log", level="error", message=f"{message}{args}")
+        elif args:
+            console.log(f"[error]{message}[/error] [underline]{args}[/underline]")
+        else:
+            console.log(f"[error]{message}[/error]")
 
 
     def log_info(self, message: str, args: str = "") -> None:
-        if args:
+        if LOG_FORMAT == "json":
+            self.log_json("log", level="info", message=f"{message}{args}")
+        elif args:
             console.log(f"[bold white]{message}[/bold white] [underline]{args}[/underline]")
         else:
             console.log(f"[bold white]{message}[/bold white]")
+
+
+    @contextmanager
+    def bind(self, **fields) -> Iterator[None]:
+        """
+        Attaches fields to every span and JSON line logged inside the block
+        """
+        token: contextvars.Token = log_context.set({**log_context.get(), **fields})
+        try:
+            yield
+        finally:
+            log_context.reset(token)
+
+
+    @contextmanager
+    def span(self, stage: str, **attributes) -> Iterator[dict]:
+        """
+        Times a stage of the analysis, logs it as JSON and records its duration in the
+        `analysis_stage_duration_seconds` histogram. If the stage has a concurrency limit (StageLimits),
+        the span waits for a slot first, the wait is logged as `wait_seconds` and not part of the duration.
+        The start and end of the stage are reported as progress of the job bound to the context, a stage of
+        a cancelled or timed out job doesn't start
+        Args:
+            stage (str): The stage name, e.g. `clone` or `format`
+            attributes: Fields of the span, more can be added to the yielded dict (file and byte counts, ...),
+                a `status` set there marks a stage that failed without raising
+        Returns:
+            dict: The attributes of the span
+        """
+        attributes: dict = dict(attributes)
+        status: str = "ok"
+        job_id: str | None = log_context.get().get("job")
+        Cancellation.check(job_id)
+        # A job waiting for a slot still stops on a cancellation or at its deadline
+        with StageLimits.acquire(stage, check=lambda: Cancellation.check(job_id)) as wait_seconds:
+            if wait_seconds:
+                attributes["wait_seconds"] = round(wait_seconds, 4)
+            start: float = time.perf_counter()
+            Progress.report(job_id, stage, "running")
+            try:
+                yield attributes
+            except BaseException:
+                status = "error"
+                raise
+            finally:
+                duration: float = time.perf_counter() - start
+                status = attributes.pop("status", status)
+                self.log_json("span", stage=stage, status=status, duration_seconds=round(duration, 4), **attributes)
+                Metrics().observe("analysis_stage_duration_seconds", {"stage": stage, "status": status}, duration)
+                Progress.report(job_id, stage, status, seconds=duration)
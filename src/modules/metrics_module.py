@@ -0,0 +1,133 @@
+from modules.config_module import Config
+from modules.sqlite_module import SqliteDatabase
+
+class Metrics:
+    """
+    A small Prometheus style metrics registry (counters and histograms) persisted in SQLite,
+    so the worker processes and the web server share the same numbers. Every thread writes through
+    one connection it keeps open.
+    """
+    DB_PATH: str = Config.get_path("METRICS_PATH", "~/.cache/pre-audit-bot/metrics.sqlite")
+    ENABLED: bool = Config.get_bool("METRICS_ENABLED", True)
+    # Histogram buckets in seconds, stages range from milliseconds (cache lookups) to minutes (installs)
+    BUCKETS: tuple = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+    databases: dict = {}  # The databases initialised in this process, {path: SqliteDatabase}
+
+
+    def __init__(self, db_path: str | None = None) -> None:
+        """
+        Initialize the registry and create its tables once per process
+        Args:
+            db_path (str): The path to the SQLite database
+        """
+        self.db_path: str = db_path or self.DB_PATH
+        self.database: SqliteDatabase | None = Metrics.databases.get(self.db_path)
+        if self.ENABLED and self.database is None:
+            self.database = SqliteDatabase(self.db_path)
+            with self.database.connect() as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels))")
+                connection.execute("CREATE TABLE IF NOT EXISTS histograms (name TEXT NOT NULL, labels TEXT NOT NULL, bucket TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels, bucket))")
+            Metrics.databases[self.db_path] = self.database
+
+
+
+    @staticmethod
+    def format_labels(labels: dict | None) -> str:
+        """
+        Returns the labels in Prometheus exposition format, e.g. `stage="clone",status="ok"`
+        """
+        if not labels:
+            return ""
+        return ",".join(f'{key}="{str(value)}"'.replace("\n", " ") for key, value in sorted(labels.items()))
+
+
+    def inc(self, name: str, labels: dict | None = None, value: float = 1) -> None:
+        """
+        Increments a counter
+        Args:
+            name (str): The metric name, e.g. `cache_requests_total`
+            labels (dict): The metric labels
+            value (float): The increment
+        """
+        if not self.ENABLED:
+            return
+        with self.database.transaction() as connection:
+            connection.execute(
+                "INSERT INTO counters (name, labels, value) VALUES (?, ?, ?) ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                (name, self.format_labels(labels), value)
+            )
+
+
+    def observe(self, name: str, labels: dict | None, value: float) -> None:
+        """
+        Records a value in a histogram (cumulative buckets plus `_sum` and `_count`)
+        Args:
+            name (str): The metric name, e.g. `analysis_stage_duration_seconds`
+            labels (dict): The metric labels
+            value (float): The observed value
+        """
+        if not self.ENABLED:
+            return
+        label_text: str = self.format_labels(labels)
+        buckets: list[str] = [str(bucket) for bucket in self.BUCKETS if value <= bucket] + ["+Inf"]
+        with self.database.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO histograms (name, labels, bucket, value) VALUES (?, ?, ?, 1) ON CONFLICT (name, labels, bucket) DO UPDATE SET value = value + 1",
+                [(name, label_text, bucket) for bucket in buckets]
+            )
+            connection.executemany(
+                "INSERT INTO counters (name, labels, value) VALUES (?, ?, ?) ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                [(f"{name}_sum", label_text, value), (f"{name}_count", label_text, 1)]
+            )
+
+
+    def get_counter(self, name: str, labels: dict | None = None) -> float:
+        """
+        Returns the current value of a counter
+        """
+        if not self.ENABLED:
+            return 0.0
+        with self.database.transaction() as connection:
+            row: tuple | None = connection.execute("SELECT value FROM counters WHERE name = ? AND labels = ?", (name, self.format_labels(labels))).fetchone()
+        return row[0] if row else 0.0
+
+
+    def render(self, gauges: dict[str, list[tuple[dict, float]]] | None = None) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format
+        Args:
+            gauges (dict): Point-in-time values of this process, {name: [(labels, value)]}
+        Returns:
+            str: The exposition text
+        """
+        lines: list[str] = []
+        for name, samples in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            lines += [f"{name}{{{self.format_labels(labels)}}} {value}" if labels else f"{name} {value}" for labels, value in samples]
+        if not self.ENABLED:
+            return "\n".join(lines) + "\n"
+        with self.database.transaction() as connection:
+            histograms: list[tuple] = connection.execute("SELECT name, labels, bucket, value FROM histograms ORDER BY name, labels").fetchall()
+            counters: list[tuple] = connection.execute("SELECT name, labels, value FROM counters ORDER BY name, labels").fetchall()
+        histogram_names: set[str] = {name for name, _, _, _ in histograms}
+        for histogram_name in sorted(histogram_names):
+            lines.append(f"# TYPE {histogram_name} histogram")
+            rows: list[tuple] = [row for row in histograms if row[0] == histogram_name]
+            # Emit every bucket of every label set, buckets below all observations were never written and are 0
+            for labels in sorted({row[1] for row in rows}):
+                bucket_values: dict[str, float] = {row[2]: row[3] for row in rows if row[1] == labels}
+                for bucket in [str(bucket) for bucket in self.BUCKETS] + ["+Inf"]:
+                    bucket_labels: str = f'{labels},le="{bucket}"' if labels else f'le="{bucket}"'
+                    lines.append(f"{histogram_name}_bucket{{{bucket_labels}}} {bucket_values.get(bucket, 0):g}")
+                for suffix in ("_sum", "_count"):
+                    value: float = next((row[2] for row in counters if row[0] == f"{histogram_name}{suffix}" and row[1] == labels), 0.0)
+                    lines.append(f"{histogram_name}{suffix}{{{labels}}} {value:g}" if labels else f"{histogram_name}{suffix} {value:g}")
+        typed_counters: set[str] = set()
+        for name, labels, value in counters:
+            if any(name == f"{histogram_name}{suffix}" for histogram_name in histogram_names for suffix in ("_sum", "_count")):
+                continue
+            if name not in typed_counters:
+                lines.append(f"# TYPE {name} counter")
+                typed_counters.add(name)
+            lines.append(f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
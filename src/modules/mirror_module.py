@@ -0,0 +1,135 @@
+import git
+import hashlib
+import os
+import re
+import shutil
+from contextlib import contextmanager
+from typing import Iterator
+from modules.cache_module import DiskCache
+from modules.config_module import Config
+from modules.metrics_module import Metrics
+from modules.process_module import ProcessRunner
+
+class MirrorCache(DiskCache):
+    """
+    A persistent cache of bare mirrors keyed by the normalised repository URL.
+    The first request clones the mirror, later requests only fetch new refs and
+    create the working copy with a local (hardlinked) clone of the mirror.
+    Only branches and tags are kept, not the `refs/pull/*` GitHub also serves.
+    """
+    REFSPECS: list[str] = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+    CACHE_DIR: str = Config.get_path("MIRROR_CACHE_DIR", "~/.cache/pre-audit-bot/mirrors")
+    MAX_BYTES: int = Config.get_int("MIRROR_CACHE_MAX_BYTES", 20 * 1024 ** 3)
+
+
+    def __init__(self, root: str | None = None, max_bytes: int | None = None) -> None:
+        super().__init__(root or self.CACHE_DIR, max_bytes or self.MAX_BYTES)
+
+
+    @staticmethod
+    def normalise_url(repo_url: str) -> str:
+        """
+        Normalises a repository URL so SSH, scp-like and HTTPS forms of the same repository share a mirror
+        Args:
+            repo_url (str): The repository URL
+        Returns:
+            str: The normalised URL, e.g. `github.com/hknio/sthai-contract`
+        """
+        url: str = repo_url.strip().rstrip("/")
+        url = re.sub(r"\.git$", "", url)
+        url = re.sub(r"^[a-z+]+://", "", url)   # ssh://, https://
+        url = re.sub(r"^[^@/]+@", "", url)      # git@
+        url = re.sub(r"^([^/:]+):(?!\d+/)", r"\1/", url)  # scp-like host:path, but not host:port/path
+        url = re.sub(r"^([^/:]+):\d+/", r"\1/", url)
+        return url.lower()
+
+
+    def get_mirror_name(self, repo_url: str) -> str:
+        """
+        Returns the cache entry name of the mirror for a repository
+        """
+        normalised_url: str = self.normalise_url(repo_url)
+        slug: str = re.sub(r"[^a-z0-9._-]+", "_", normalised_url.split("/")[-1])[:40]
+        return f"{slug}-{hashlib.sha256(normalised_url.encode()).hexdigest()[:16]}"
+
+
+    def __configure_remote(self, mirror: git.Repo, repo_url: str) -> None:
+        """
+        Points the mirror at the repository and limits its fetches to branches and tags
+        """
+        mirror.git.remote("set-url", "origin", repo_url)
+        mirror.git.config("--replace-all", "remote.origin.fetch", self.REFSPECS[0])
+        for refspec in self.REFSPECS[1:]:
+            mirror.git.config("--add", "remote.origin.fetch", refspec)
+        if mirror.git.config("--bool", "--default", "false", "remote.origin.mirror") == "true":
+            # Created by `git clone --mirror`: drop the pull request (and other) refs it fetched
+            mirror.git.config("--unset-all", "remote.origin.mirror")
+            stale_refs: list[str] = [ref for ref in mirror.git.for_each_ref("--format=%(refname)").splitlines() if not ref.startswith(("refs/heads/", "refs/tags/"))]
+            if stale_refs:
+                ProcessRunner().run_git(["update-ref", "--stdin"], cwd=mirror.git_dir, input="".join(f"delete {ref}\n" for ref in stale_refs))
+
+
+    def __update_mirror(self, repo_url: str, mirror_path: str, env: dict) -> None:
+        """
+        Creates the mirror or fetches the refs that changed since the last request (the caller holds the entry lock)
+        """
+        Metrics().inc("cache_requests_total", {"cache": "mirror", "outcome": "hit" if os.path.isdir(mirror_path) else "miss"})
+        if os.path.isdir(mirror_path):
+            self.log_info("Fetching new refs into mirror: ", mirror_path)
+            mirror: git.Repo = git.Repo(mirror_path)
+            self.__configure_remote(mirror, repo_url)
+            ProcessRunner().run_git(["fetch", "--prune", "origin"], cwd=mirror_path, env=env)
+            return
+        self.log_info("Creating mirror: ", mirror_path)
+        partial_path: str = f"{mirror_path}.partial"
+        shutil.rmtree(partial_path, ignore_errors=True)
+        # A bare clone fetches branches and tags only, the refspecs keep later fetches to the same refs
+        ProcessRunner().run_git(["clone", "--bare", repo_url, partial_path], env=env)
+        self.__configure_remote(git.Repo(partial_path), repo_url)
+        os.rename(partial_path, mirror_path)
+
+
+    @contextmanager
+    def open(self, repo_url: str, env: dict) -> Iterator[str]:
+        """
+        Brings the mirror of a repository up to date and holds it while the caller reads from it
+        Args:
+            repo_url (str): The repository URL
+            env (dict): Extra environment for git, e.g. GIT_SSH_COMMAND
+        Yields:
+            str: The path to the bare mirror
+        """
+        name: str = self.get_mirror_name(repo_url)
+        mirror_path: str = self.get_entry_path(name)
+        for _ in range(3):
+            with self.lock(name):
+                self.__update_mirror(repo_url, mirror_path, env)
+            # Only the fetch needs the mirror to itself, readers share it (and keep it from being evicted)
+            with self.lock(name, exclusive=False):
+                if not os.path.isdir(mirror_path):
+                    continue  # Evicted between the fetch and the read
+                yield mirror_path
+                self.touch(name)
+                self.record_size(name)
+                break
+        else:
+            raise OSError(f"Mirror {name} was evicted while it was being opened")
+        self.evict()
+
+
+    def checkout(self, repo_url: str, destination: str, env: dict) -> git.Repo:
+        """
+        Brings the mirror of a repository up to date and creates a working copy from it
+        Args:
+            repo_url (str): The repository URL
+            destination (str): The (empty) directory for the working copy
+            env (dict): Extra environment for git, e.g. GIT_SSH_COMMAND
+        Returns:
+            git.Repo: The working copy, with `origin` pointing at the repository URL
+        """
+        with self.open(repo_url, env) as mirror_path:
+            # A local clone hardlinks the objects, so the working copy stays valid even if the mirror is evicted later
+            ProcessRunner().run_git(["clone", "--local", mirror_path, destination])
+            repo: git.Repo = git.Repo(destination)
+            repo.git.remote("set-url", "origin", repo_url)
+        return repo
@@ -0,0 +1,71 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Any, Callable
+from modules.config_module import Config
+from modules.log_module import Log
+
+class Pipeline(Log):
+    """
+    The stages of an analysis declared as a DAG and run in threads: a stage starts as soon as the stages it
+    depends on finished, so independent stages (e.g. the dependency install and the unformatted count) run
+    at the same time. Every stage runs in a copy of the caller's context, so its spans still report to the
+    job and stop on a cancellation. On the first failure no further stage starts and the error is raised
+    once the running ones finished.
+    """
+    WORKERS: int = Config.get_int("PIPELINE_WORKERS", 4)  # Stages running at the same time
+
+
+    def __init__(self) -> None:
+        self.stages: dict[str, dict] = {}  # {name: {"function", "after"}}, in declaration order
+
+
+    def add(self, name: str, function: Callable[[dict], Any], after: list[str] | None = None) -> "Pipeline":
+        """
+        Declares a stage, the stages it depends on must be declared before it, so the graph has no cycles
+        Args:
+            name (str): The stage name
+            function (Callable[[dict], Any]): Runs the stage, gets the results of the finished stages by name
+            after (list[str]): The stages that must finish first
+        Returns:
+            Pipeline: The pipeline itself
+        Raises:
+            ValueError: The name is taken or a dependency isn't declared
+        """
+        after = list(after or [])
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is declared twice")
+        unknown: list[str] = [dependency for dependency in after if dependency not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on undeclared stages: {', '.join(unknown)}")
+        self.stages[name] = {"function": function, "after": after}
+        return self
+
+
+    def run(self) -> dict[str, Any]:
+        """
+        Runs every stage once its dependencies finished
+        Returns:
+            dict[str, Any]: The return value of every stage by name
+        """
+        results: dict[str, Any] = {}
+        pending: dict[str, dict] = dict(self.stages)
+        running: dict[Future, str] = {}
+        error: BaseException | None = None
+        with ThreadPoolExecutor(max_workers=max(1, self.WORKERS)) as executor:
+            while pending or running:
+                ready: list[str] = [name for name, stage in pending.items() if all(dependency in results for dependency in stage["after"])]
+                for name in ready:
+                    stage: dict = pending.pop(name)
+                    running[executor.submit(copy_context().run, stage["function"], dict(results))] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name: str = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except BaseException as e:
+                        error = error or e
+                if error is not None:
+                    pending.clear()  # Let the running stages finish, start no others
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,213 @@
+import git
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+from modules.config_module import Config
+from modules.log_module import Log, log_context
+from modules.progress_module import Progress
+from modules.stage_limit_module import StageLimits
+
+class ProcessRunner(Log):
+    """
+    Runs every external command of the pipeline (npm, forge, prettier, cloc, ...) in its own process group
+    with a wall-clock timeout per stage and CPU/memory rlimits. Output is streamed line by line instead of
+    buffered, so memory stays flat on chatty installs: only the last lines are kept for the error message
+    and the latest one is reported as the progress detail of the running stage. On a timeout the whole
+    process group is terminated, so no postinstall script outlives its stage.
+    """
+    OUTPUT_TAIL_LINES: int = Config.get_int("PROCESS_OUTPUT_TAIL_LINES", 50)
+    # Wall-clock limits in seconds per stage, stages without one only end with the job (JOB_TIMEOUT_SECONDS)
+    STAGE_TIMEOUTS: dict = StageLimits.parse(Config.get_str("STAGE_TIMEOUTS", "clone=600,install=900,formatter_setup=600,format=600,count=300"))
+    MAX_CPU_SECONDS: int = Config.get_int("PROCESS_MAX_CPU_SECONDS", 1800)  # RLIMIT_CPU of every command, 0 for no limit
+    MAX_MEMORY_BYTES: int = Config.get_int("PROCESS_MAX_MEMORY_BYTES", 0)  # RLIMIT_AS of every command, 0 for no limit
+    KILL_GRACE_SECONDS: float = 5.0  # Between SIGTERM and SIGKILL of a timed out process group
+    PROGRESS_INTERVAL_SECONDS: float = 1.0  # Output lines are reported at most this often
+
+
+    @classmethod
+    def limit_resources(cls, pid: int) -> None:
+        """
+        Applies the rlimits to a started command with `prlimit`, a `preexec_fn` isn't safe in a process
+        with threads. The command only runs unlimited for the moment between its start and this call
+        Args:
+            pid (int): The process ID of the command
+        """
+        try:
+            if cls.MAX_CPU_SECONDS:
+                resource.prlimit(pid, resource.RLIMIT_CPU, (cls.MAX_CPU_SECONDS, cls.MAX_CPU_SECONDS))
+            if cls.MAX_MEMORY_BYTES:
+                resource.prlimit(pid, resource.RLIMIT_AS, (cls.MAX_MEMORY_BYTES, cls.MAX_MEMORY_BYTES))
+        except ProcessLookupError:
+            pass  # Already exited
+
+
+    def kill_group(self, process: subprocess.Popen) -> None:
+        """
+        Terminates the process group of a command, forcefully if it doesn't exit within KILL_GRACE_SECONDS
+        """
+        for sig, grace in ((signal.SIGTERM, self.KILL_GRACE_SECONDS), (signal.SIGKILL, None)):
+            try:
+                os.killpg(process.pid, sig)
+            except OSError:
+                return  # Already gone
+            try:
+                process.wait(timeout=grace)
+                return
+            except subprocess.TimeoutExpired:
+                continue
+
+
+    def run(self, command: list[str], cwd: str | None = None, env: dict | None = None, stage: str | None = None, timeout: float | None = None, keep_output: bool = False, input: str | None = None) -> str:
+        """
+        Runs a command to completion, standard error is merged into the streamed output
+        Args:
+            command (list[str]): The command and its arguments
+            cwd (str): The working directory
+            env (dict): The full environment of the command, the current one by default
+            stage (str): The stage the command belongs to, for its timeout and progress reports
+            timeout (float): The wall-clock limit in seconds, the one of the stage by default
+            keep_output (bool): Return the whole output (e.g. a cloc table) instead of the last lines
+            input (str): Written to the standard input of the command, e.g. for `git update-ref --stdin`
+        Returns:
+            str: The output, or its last OUTPUT_TAIL_LINES lines
+        Raises:
+            subprocess.CalledProcessError: The command failed, `output` holds the last lines
+            subprocess.TimeoutExpired: The command ran over the timeout and was killed
+        """
+        timeout = timeout if timeout is not None else self.STAGE_TIMEOUTS.get(stage)
+        lines: deque[str] = deque() if keep_output else deque(maxlen=self.OUTPUT_TAIL_LINES)
+        job_id: str | None = log_context.get().get("job")
+        process: subprocess.Popen = subprocess.Popen(
+            command, cwd=cwd, env=env, stdin=subprocess.PIPE if input is not None else None, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, errors="replace", start_new_session=True
+        )
+        self.limit_resources(process.pid)
+
+        def write_input() -> None:
+            try:
+                process.stdin.write(input)
+                process.stdin.close()
+            except OSError:
+                pass  # The command exited without reading it all
+
+        def read_output() -> None:
+            reported_at: float = 0.0
+            try:
+                for line in process.stdout:
+                    line = line.rstrip("\n")
+                    if not keep_output and not line.strip():
+                        continue
+                    lines.append(line)
+                    if stage and line.strip() and time.monotonic() - reported_at >= self.PROGRESS_INTERVAL_SECONDS:
+                        Progress.report(job_id, stage, "output", detail=line.strip()[:200])
+                        reported_at = time.monotonic()
+            except (OSError, ValueError):
+                pass  # The pipe was closed after a kill
+
+        reader: threading.Thread = threading.Thread(target=read_output, daemon=True)
+        reader.start()
+        if input is not None:
+            threading.Thread(target=write_input, daemon=True).start()
+        try:
+            return_code: int = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.log_error("Command timed out, killing its process group: ", f"{' '.join(command[:3])} ({timeout:.0f}s)")
+            self.kill_group(process)
+            reader.join(timeout=self.KILL_GRACE_SECONDS)
+            raise subprocess.TimeoutExpired(command, timeout, output="\n".join(lines))
+        except BaseException:
+            self.kill_group(process)  # Interrupted, don't leave the command running
+            raise
+        finally:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)  # Background processes the command left behind in its group
+            except OSError:
+                pass
+            reader.join(timeout=self.KILL_GRACE_SECONDS)  # A daemon that escaped the group may hold the pipe open
+            process.stdout.close()
+        output: str = "\n".join(lines)
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, command, output=output)
+        return output
+
+
+    def run_git(self, args: list[str], cwd: str | None = None, env: dict | None = None, stage: str = "clone", input: str | None = None) -> str:
+        """
+        Runs a git command that may wait on a remote (clone, fetch, ls-remote, the checkout of a partial clone)
+        with the timeout and the rlimits of `run`, failing like the GitPython calls around it
+        Args:
+            args (list[str]): The arguments of git
+            cwd (str): The working directory
+            env (dict): Extra environment on top of the current one, e.g. GIT_SSH_COMMAND
+            stage (str): The stage the command belongs to, for its timeout
+            input (str): Written to the standard input of the command
+        Returns:
+            str: The whole output, standard error included
+        Raises:
+            git.GitCommandError: git failed
+            subprocess.TimeoutExpired: git ran over the timeout of the stage and was killed
+        """
+        command: list[str] = ["git", *args]
+        try:
+            return self.run(command, cwd=cwd, env={**os.environ, **(env or {})}, stage=stage, keep_output=True, input=input)
+        except subprocess.CalledProcessError as e:
+            raise git.GitCommandError(command, e.returncode, e.output) from e
+
+
+    @contextmanager
+    def open(self, command: list[str], cwd: str | None = None, env: dict | None = None, stage: str | None = None, timeout: float | None = None) -> Iterator[subprocess.Popen]:
+        """
+        Starts a command the caller talks to through its binary standard input and output (e.g. `git cat-file --batch`),
+        in its own process group with the rlimits and the timeout of `run`; the group is killed when the block ends
+        Args:
+            command (list[str]): The command and its arguments
+            cwd (str): The working directory
+            env (dict): The full environment of the command, the current one by default
+            stage (str): The stage the command belongs to, for its timeout
+            timeout (float): The wall-clock limit in seconds, the one of the stage by default
+        Yields:
+            subprocess.Popen: The process, with `stdin` and `stdout` pipes
+        Raises:
+            subprocess.TimeoutExpired: The command ran over the timeout and was killed
+        """
+        timeout = timeout if timeout is not None else self.STAGE_TIMEOUTS.get(stage)
+        process: subprocess.Popen = subprocess.Popen(command, cwd=cwd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, start_new_session=True)
+        self.limit_resources(process.pid)
+        timed_out: threading.Event = threading.Event()
+
+        def expire() -> None:
+            timed_out.set()
+            self.log_error("Command timed out, killing its process group: ", f"{' '.join(command[:3])} ({timeout:.0f}s)")
+            self.kill_group(process)
+
+        timer: threading.Timer | None = threading.Timer(timeout, expire) if timeout else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            yield process
+        except Exception as e:
+            if timed_out.is_set():  # The pipes broke because the command was killed
+                raise subprocess.TimeoutExpired(command, timeout) from e
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            for pipe in (process.stdin, process.stdout):
+                try:
+                    pipe.close()
+                except OSError:
+                    pass  # A broken pipe
+            process.wait()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(command, timeout)
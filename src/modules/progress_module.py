@@ -0,0 +1,64 @@
+import multiprocessing
+import time
+
+class Progress:
+    """
+    Reports the stages of a job running in a worker process back to the process that owns the job queue.
+    The queue is created in the parent and handed to the workers through the pool initializer, like the
+    StageLimits semaphores; `Log.span` reports the start and end of every stage of the bound job.
+    Plain class (not Log) because the log module reports through it.
+    """
+    queue = None  # The queue of this process, None when nobody listens (batch, benchmark module stages)
+
+
+    @staticmethod
+    def create(context=None):
+        """
+        Creates the queue the workers report to
+        Args:
+            context: The multiprocessing context the workers are started with, the default one if not given
+        """
+        return (context or multiprocessing).Queue()
+
+
+    @classmethod
+    def configure(cls, queue) -> None:
+        """
+        Installs the queue in this process, used by the initializer of worker pools
+        """
+        cls.queue = queue
+
+
+    @classmethod
+    def report(cls, job_id: str | None, stage: str, state: str, seconds: float | None = None, detail: str | None = None) -> None:
+        """
+        Sends a progress event of a job, events outside of a job or without a listener are dropped
+        Args:
+            job_id (str): The ID of the job (the `job` field bound to the log context)
+            stage (str): The stage name, as used by `Log.span`
+            state (str): "running" when the stage starts, its status ("ok", "error", ...) when it ends, "output" for a line of its output
+            seconds (float): The duration of a finished stage
+            detail (str): The latest output line of a running stage
+        """
+        if cls.queue is None or job_id is None:
+            return
+        try:
+            cls.queue.put_nowait({"job": job_id, "stage": stage, "state": state, "seconds": seconds, "detail": detail, "at": time.time()})
+        except (OSError, ValueError):
+            pass  # The listener went away (shutdown), progress is best effort
+
+
+    @classmethod
+    def report_result(cls, job_id: str | None, result: str) -> None:
+        """
+        Sends the early answer of a job, posted before the stages after it finished
+        Args:
+            job_id (str): The ID of the job (the `job` field bound to the log context)
+            result (str): The reply text of the early answer
+        """
+        if cls.queue is None or job_id is None:
+            return
+        try:
+            cls.queue.put_nowait({"job": job_id, "stage": None, "state": "early_result", "result": result, "at": time.time()})
+        except (OSError, ValueError):
+            pass
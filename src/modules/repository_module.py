@@ -1,12 +1,25 @@
 import git
 import os
-import tempfile
+import re
+import shutil
+import subprocess
 import time
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
+from typing import Iterator
+from modules.config_module import Config
+from modules.framework_module import Framework
 from modules.log_module import Log
+from modules.mirror_module import MirrorCache
+from modules.process_module import ProcessRunner
+from modules.scope_module import Scope
 
-class Repository(Log):
-    all = {}
+class RemoteRepository(Log):
+    """
+    A repository as requested in a message, before anything is checked out: resolves the requested commit
+    remotely and reads the git objects from the mirror cache, so the work can be keyed and deduplicated
+    before a workspace is leased (or without one at all, for an estimate)
+    """
     def __init__(self, repo_ssh: str, client: str, language: str, branch: str = "main", commit: str = "latest", scope: str = "all") -> None:
         if not all([client, repo_ssh, language]):
             raise ValueError("Client, repo_ssh, and language must be non-empty strings")
@@ -17,9 +30,86 @@ class Repository(Log):
         self.branch: str = branch.lower()
         self.commit: str = commit.lower()
         self.scope: str = scope
+
+
+    def get_remote_url(self) -> str:
+        """
+        Returns the modified repository SSH URL for a given repository SSH URL(for this you need to set up your SSH keys)
+        """
+        return self.repo_ssh.replace("git@github.com:hknio", "git@github.com-hacken:hknio")
+
+
+    def get_git_env(self) -> dict:
+        """
+        Returns the environment for the git processes we spawn, with the SSH command using the specific key
+        """
+        # Constructing a file path to an SSH key in the home directory | os.path.expanduser() - converts ~ into an absolute path like '/home/username/.ssh/'
+        ssh_key_path = os.path.join(os.path.expanduser("~/.ssh/"), "id_rsa_hacken_1")
+        return {"GIT_SSH_COMMAND": f"ssh -i {ssh_key_path} -o StrictHostKeyChecking=no"}
+
+
+    def resolve_commit(self) -> str | None:
+        """
+        Resolves the requested commit to a full SHA without cloning (`git ls-remote` for the latest commit of a branch)
+        Returns:
+            str: The commit SHA, or None if it can't be resolved remotely (e.g. an abbreviated hash)
+        """
+        if re.fullmatch(r"[0-9a-f]{40}", self.commit):
+            return self.commit
+        if self.commit != "latest":
+            return None
+        ref: str = self.branch if self.branch != "main" else "HEAD"
+        try:
+            output: str = ProcessRunner().run_git(["ls-remote", self.get_remote_url(), ref], env=self.get_git_env())
+        except (git.GitCommandError, subprocess.TimeoutExpired) as e:
+            self.log_error("Failed to resolve commit: ", str(e))
+            return None
+        refs: dict = {line.split("\t")[1]: line.split("\t")[0] for line in output.splitlines() if "\t" in line}
+        for candidate in (ref, f"refs/heads/{ref}", f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}"):
+            if candidate in refs:
+                return refs[candidate]
+        return None
+
+
+    @contextmanager
+    def open_objects(self) -> Iterator[tuple[str, str]]:
+        """
+        Fetches the repository into the mirror cache without creating a working tree and resolves the
+        requested commit there, for reading its tree and blobs directly
+        Yields:
+            tuple[str, str]: The path to the bare mirror and the full commit SHA
+        Raises:
+            git.GitCommandError: The repository can't be fetched or the commit doesn't exist
+            subprocess.TimeoutExpired: The fetch ran over the timeout of the clone stage
+        """
+        with ExitStack() as stack:
+            with self.span("clone", strategy="objects") as span:
+                mirror_path: str = stack.enter_context(MirrorCache().open(self.get_remote_url(), self.get_git_env()))
+                if self.commit == "latest":
+                    ref: str = f"refs/heads/{self.branch}" if self.branch != "main" else "HEAD"
+                else:
+                    ref: str = self.commit
+                commit_sha: str = git.Repo(mirror_path).git.rev_parse("--verify", f"{ref}^{{commit}}")
+                span["bytes"] = MirrorCache.get_dir_size(mirror_path)
+            self.log_info("Resolved commit in mirror: ", commit_sha)
+            yield mirror_path, commit_sha
+
+
+class Repository(RemoteRepository):
+    # How the repository is fetched: "mirror" (local mirror cache), "shallow" (requested commit only, sparse when scoped) or "full"
+    CLONE_STRATEGY: str = Config.get_str("CLONE_STRATEGY", "mirror").lower()
+    # Files needed to resolve dependencies in a sparse checkout, next to the framework config files
+    DEPENDENCY_FILES: list[str] = ["package.json", "package-lock.json", "yarn.lock", "pnpm-lock.yaml", ".npmrc", "tsconfig.json", ".gitmodules", ".prettierrc"]
+    all = {}
+    def __init__(self, repo_ssh: str, client: str, language: str, branch: str = "main", commit: str = "latest", scope: str = "all", *, workspace: str) -> None:
+        super().__init__(repo_ssh, client, language, branch, commit, scope)
+        # The checkout lives in a workspace leased from the WorkspaceManager, which holds its lock, quota and cleanup
+        if not workspace:
+            raise ValueError("A workspace leased from the WorkspaceManager is required")
         self.timestamp: float = time.time()
         self.created_at: str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.temp_dir: str = tempfile.mkdtemp(prefix=f"repo_clone_{self.client}") # create an instance 
+        # Possibly holding a warm checkout of the repository left by the previous job
+        self.temp_dir: str = workspace
 
         Repository.all[self.client] = {
             "repo_ssh": self.repo_ssh,
@@ -40,13 +130,6 @@ class Repository(Log):
         return Repository.all[client]
 
 
-    def __get_modified_repo_ssh(self) -> str:
-        """
-        Returns the modified repository SSH URL for a given repository SSH URL(for this you need to set up your SSH keys)
-        """
-        return self.repo_ssh.replace("git@github.com:hknio", "git@github.com-hacken:hknio")
-
-
     def __checkout_branch(self, repo: git.Repo) -> None:
         """
         Checks out to a new branch if the client provided a branch name
@@ -73,34 +156,185 @@ class Repository(Log):
         """
         Clones a repository to a temporary directory and returns the path
         """
-        # Constructing a file path to an SSH key in the home directory | os.path.expanduser() - converts ~ into an absolute path like '/home/username/.ssh/'
-        ssh_key_path = os.path.join(os.path.expanduser("~/.ssh/"), "id_rsa_hacken_1")
         # Modify the repo SSH URL if needed
-        modified_repo_ssh = self.__get_modified_repo_ssh() 
+        modified_repo_ssh = self.get_remote_url() 
 
         self.log_info("Cloning repository: ", modified_repo_ssh)
+        env: dict = self.get_git_env()
 
-        # Store original environment
-        original_env = os.environ.copy()
+        with self.span("clone", strategy=self.CLONE_STRATEGY) as span:
+            try:
+                span["warm"] = os.path.isdir(os.path.join(self.temp_dir, ".git"))
+                if span["warm"]:
+                    try:
+                        self.__update_checkout(modified_repo_ssh, env)
+                        span["bytes"] = MirrorCache.get_dir_size(self.temp_dir)
+                        self.log_success("Warm checkout updated successfully!")
+                        return self.temp_dir
+                    except git.GitCommandError as e:
+                        self.log_error("Failed to update the warm checkout, cloning again: ", str(e))
+                        shutil.rmtree(self.temp_dir, ignore_errors=True)
+                        os.makedirs(self.temp_dir, exist_ok=True)
+                if self.CLONE_STRATEGY == "shallow":
+                    self.__shallow_clone(modified_repo_ssh, env)
+                else:
+                    repo: git.Repo = self.__clone(modified_repo_ssh, env)
+                    # Checkout to a specific branch and commit if provided
+                    self.__checkout_branch(repo)
+                    self.__checkout_commit(repo)
 
-        try:
-            # Create the SSH command with the specific key
-            ssh_command = f"ssh -i {ssh_key_path} -o StrictHostKeyChecking=no"
-            os.environ["GIT_SSH_COMMAND"] = ssh_command
+                span["bytes"] = MirrorCache.get_dir_size(self.temp_dir)
+                self.log_success("Repository cloned successfully!")
+                return self.temp_dir
+            except (git.GitCommandError, subprocess.TimeoutExpired) as e:  # A stalled remote fails the clone, it isn't retried
+                span["status"] = "error"
+                self.log_error("Failed to clone repository: ", str(e))
+                return None
+
+
+    def __clone(self, repo_url: str, env: dict) -> git.Repo:
+        """
+        Clones the repository into the temporary directory, through the local mirror cache if it is enabled
+        """
+        if self.CLONE_STRATEGY == "mirror":
+            try:
+                return MirrorCache().checkout(repo_url, self.temp_dir, env)
+            except (git.GitCommandError, OSError) as e:
+                self.log_error("Mirror cache unavailable, cloning directly: ", str(e))
+                shutil.rmtree(self.temp_dir, ignore_errors=True)
+                os.makedirs(self.temp_dir, exist_ok=True)
+        ProcessRunner().run_git(["clone", repo_url, self.temp_dir], env=env)
+        return git.Repo(self.temp_dir)
+
+
+
+    def __update_checkout(self, repo_url: str, env: dict) -> git.Repo:
+        """
+        Brings the checkout a previous job of the same repository left in the workspace to the requested commit.
+        Tracked files are reset and untracked ones removed, ignored directories (`node_modules`, build output)
+        are kept so the dependency install only has to apply the difference.
+        """
+        repo: git.Repo = git.Repo(self.temp_dir)
+        repo.git.remote("set-url", "origin", repo_url)
+        depth: list[str] = ["--depth=1"] if self.CLONE_STRATEGY == "shallow" else []
+        with ExitStack() as stack:
+            source: str = "origin"
+            if self.CLONE_STRATEGY == "mirror":
+                # Like a fresh checkout, only the mirror talks to the remote and the checkout fetches from it
+                try:
+                    source = stack.enter_context(MirrorCache().open(repo_url, env))
+                except (git.GitCommandError, OSError) as e:
+                    self.log_error("Mirror cache unavailable, fetching directly: ", str(e))
+            if re.fullmatch(r"[0-9a-f]{40}", self.commit):
+                ProcessRunner().run_git(["fetch", *depth, source, self.commit], cwd=self.temp_dir, env=env)
+                target: str = "FETCH_HEAD"
+            elif self.commit == "latest":
+                ProcessRunner().run_git(["fetch", *depth, source, self.branch if self.branch != "main" else "HEAD"], cwd=self.temp_dir, env=env)
+                target: str = "FETCH_HEAD"
+            else:  # An abbreviated hash needs the history of all branches
+                ProcessRunner().run_git(["fetch", source, "+refs/heads/*:refs/remotes/origin/*"], cwd=self.temp_dir, env=env)
+                target: str = self.commit
+
+        # Undo the formatting of the previous job
+        repo.git.worktree("prune")
+        repo.git.reset("--hard")
+        repo.git.clean("-ffd")
+        if self.CLONE_STRATEGY == "shallow":
+            sparse_patterns: list[str] = self.__get_sparse_patterns()
+            if sparse_patterns:
+                repo.git.sparse_checkout("set", "--no-cone", *sparse_patterns)
+            elif repo.git.config("--bool", "--default", "false", "core.sparseCheckout") == "true":
+                repo.git.sparse_checkout("disable")
+        ProcessRunner().run_git(["checkout", "--force", "--detach", target], cwd=self.temp_dir, env=env)  # A partial clone downloads the blobs
+        repo.git.clean("-ffd")
+        self.log_info("Checked out commit: ", repo.head.commit.hexsha)
+        return repo
+
+
+    def __get_sparse_patterns(self) -> list[str]:
+        """
+        Returns the sparse checkout patterns for the scope, or an empty list if the whole tree is checked out.
+        Cloc matches the scope as unanchored regexes (`--match-f` on file names, `--match-d` on directory paths),
+        so every entry becomes a glob matching at least the same paths: `.` may be any character and the
+        match may start and end anywhere. Entries with other regex syntax check out the whole tree.
+        The config and dependency files are checked out at any depth, for the sub-projects of a monorepo.
+        """
+        scope: list[str] = Scope.normalise(self.scope)
+        if scope == ["all"]:
+            return []
+        if any(re.search(r"[^A-Za-z0-9_./-]", item) for item in scope):
+            self.log_info("Scope isn't a plain path, checking out the whole tree: ", ", ".join(scope))
+            return []
+        globs: list[str] = [re.sub(r"^(\./)+", "", item).replace(".", "?").strip("/") for item in scope]
+        if ".sol" in scope[0]:  # File names, like `Scope.is_files_scope`
+            patterns: list[str] = [f"**/*{glob}*" for glob in globs]
+        else:
+            patterns: list[str] = [f"**/*{glob}*/" for glob in globs]
+        config_files: list[str] = [config for info in Framework.FRAMEWORK_DEFINITIONS.values() for config in info["config_files"]]
+        patterns += config_files + self.DEPENDENCY_FILES
+        return patterns
+
+
+    def __shallow_clone(self, repo_url: str, env: dict) -> git.Repo:
+        """
+        Fetches only the requested commit without blobs (depth 1 when the commit can be addressed directly)
+        and checks out the scoped paths, blobs are then downloaded on demand for the checked out files
+        """
+        repo: git.Repo = git.Repo.init(self.temp_dir)
+        repo.git.remote("add", "origin", repo_url)
+        if re.fullmatch(r"[0-9a-f]{40}", self.commit):
+            ProcessRunner().run_git(["fetch", "--depth=1", "--filter=blob:none", "origin", self.commit], cwd=self.temp_dir, env=env)
+            target: str = "FETCH_HEAD"
+        elif self.commit == "latest":
+            ProcessRunner().run_git(["fetch", "--depth=1", "--filter=blob:none", "origin", self.branch if self.branch != "main" else "HEAD"], cwd=self.temp_dir, env=env)
+            target: str = "FETCH_HEAD"
+        else:  # An abbreviated hash can't be fetched by itself, fetch the history of all branches without blobs
+            ProcessRunner().run_git(["fetch", "--filter=blob:none", "origin", "+refs/heads/*:refs/remotes/origin/*"], cwd=self.temp_dir, env=env)
+            target: str = self.commit
+
+        sparse_patterns: list[str] = self.__get_sparse_patterns()
+        if sparse_patterns:
+            self.log_info("Sparse checkout of paths: ", ", ".join(sparse_patterns))
+            repo.git.sparse_checkout("set", "--no-cone", *sparse_patterns)
+        ProcessRunner().run_git(["checkout", "--detach", target], cwd=self.temp_dir, env=env)  # Downloads the blobs of the checked out files
 
-            # Clone the repository using GitPython
-            git.Repo.clone_from(modified_repo_ssh, self.temp_dir)
-            repo = git.Repo(self.temp_dir)
+        # Submodules are resolved by `forge install`, so their paths must be part of the sparse checkout
+        gitmodules_path: str = os.path.join(self.temp_dir, ".gitmodules")
+        if sparse_patterns and os.path.exists(gitmodules_path):
+            submodule_paths: list[str] = [line.split(" ", 1)[1] for line in repo.git.config("-f", gitmodules_path, "--get-regexp", r"\.path$").splitlines()]
+            if submodule_paths:
+                ProcessRunner().run_git(["sparse-checkout", "add", *[f"/{path}/" for path in submodule_paths]], cwd=self.temp_dir, env=env)
+        self.log_info("Checked out commit: ", repo.head.commit.hexsha)
+        return repo
 
-            # Checkout to a specific branch and commit if provided
-            self.__checkout_branch(repo)
-            self.__checkout_commit(repo)
 
-            self.log_success("Repository cloned successfully!")
+    def get_head_sha(self) -> str:
+        """
+        Returns the full SHA of the checked out commit
+        """
+        return git.Repo(self.temp_dir).head.commit.hexsha
+
+
+    def ensure_commit(self, commit: str) -> str | None:
+        """
+        Resolves another commit of the cloned repository, fetching it if the clone doesn't have it (shallow clones)
+        Args:
+            commit (str): A commit hash or ref
+        Returns:
+            str: The full commit SHA, or None if the commit can't be found
+        """
+        repo: git.Repo = git.Repo(self.temp_dir)
+        try:
+            return repo.git.rev_parse("--verify", f"{commit}^{{commit}}")
+        except git.GitCommandError:
+            pass
+        # A partial clone applies its blob filter to these fetches by itself
+        try:
+            if re.fullmatch(r"[0-9a-f]{40}", commit.lower()):
+                ProcessRunner().run_git(["fetch", "--depth=1", "origin", commit.lower()], cwd=self.temp_dir, env=self.get_git_env())
+            else:
+                ProcessRunner().run_git(["fetch", "origin", "+refs/heads/*:refs/remotes/origin/*"], cwd=self.temp_dir, env=self.get_git_env())
+            return repo.git.rev_parse("--verify", f"{commit}^{{commit}}")
         except git.GitCommandError as e:
-            self.log_error("Failed to clone repository: ", {str(e)})
+            self.log_error("Failed to resolve commit: ", f"{commit} ({e})")
             return None
-        finally:
-            # Restore original environment
-            os.environ.clear()
-            os.environ.update(original_env)
\ No newline at end of file
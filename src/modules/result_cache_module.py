@@ -0,0 +1,155 @@
+import hashlib
+import json
+import subprocess
+import time
+from functools import lru_cache
+from modules.cloc_module import Cloc
+from modules.config_module import Config
+from modules.framework_module import Framework
+from modules.log_module import Log
+from modules.metrics_module import Metrics
+from modules.repository_module import Repository
+from modules.scope_module import Scope
+from modules.sqlite_module import SqliteDatabase
+from modules.toolchain_module import FormatterToolchain
+
+class ResultCache(Log):
+    """
+    A persistent cache of analysis results keyed by everything that can change the cloc output:
+    resolved commit SHA, scope, language, cloc exclusions, formatter config and tool versions.
+    """
+    DB_PATH: str = Config.get_path("RESULT_CACHE_PATH", "~/.cache/pre-audit-bot/results.sqlite")
+    TTL_SECONDS: int = Config.get_int("RESULT_CACHE_TTL", 7 * 24 * 3600)
+    MAX_ENTRIES: int = Config.get_int("RESULT_CACHE_MAX_ENTRIES", 1000)
+    BYPASS_KEYWORD: str = Config.get_str("RESULT_CACHE_BYPASS_KEYWORD", "no-cache")
+    # Tools whose version can change the formatted code or the count
+    TOOL_VERSION_COMMANDS: dict = {
+        "cloc": ["cloc", "--version"],
+        "node": ["node", "--version"],
+        "forge": ["forge", "--version"]
+    }
+    # Bumped whenever the counting or the reply format changes, so older results aren't served
+    KEY_VERSION: int = 3
+
+
+    def __init__(self, db_path: str | None = None) -> None:
+        """
+        Initialize the cache and create its table if needed
+        Args:
+            db_path (str): The path to the SQLite database
+        """
+        self.db_path: str = db_path or self.DB_PATH
+        self.database: SqliteDatabase = SqliteDatabase(self.db_path)
+        with self.database.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at)")
+
+
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def get_tool_versions() -> dict:
+        """
+        Returns the versions of the external tools (computed once per process)
+        """
+        versions: dict = {}
+        for tool, command in ResultCache.TOOL_VERSION_COMMANDS.items():
+            try:
+                result: subprocess.CompletedProcess = subprocess.run(command, capture_output=True, text=True, timeout=30)
+                versions[tool] = result.stdout.strip().splitlines()[0] if result.stdout.strip() else "unknown"
+            except (OSError, subprocess.SubprocessError):
+                versions[tool] = "missing"
+        return versions
+
+
+    @staticmethod
+    def normalise_scope(scope) -> list[str]:
+        """
+        Returns the scope as a sorted list without duplicates, ["all"] if everything is in scope
+        """
+        return sorted(set(Scope.normalise(scope)))
+
+
+    def get_settings_key(self, scope, language: str) -> str:
+        """
+        Builds the part of the key that doesn't depend on the commit: everything that changes
+        which files are counted and how they are formatted
+        Args:
+            scope (list[str] | str): The scope from the message
+            language (str): The language of the repository
+        Returns:
+            str: The settings key
+        """
+        language = language.lower()
+        key_data: dict = {
+            "version": self.KEY_VERSION,
+            "engine": Cloc.ENGINE,  # The engines count differently
+            "scope": self.normalise_scope(scope),
+            "language": language,
+            "cloc_config": Cloc.CLOC_CONFIG.get(language, {}),
+            "prettier_config": Framework.PRETTIER_CONFIG_PATH.read_text() if Framework.PRETTIER_CONFIG_PATH.exists() else "",
+            "foundry_fmt_line_length": Framework.FOUNDRY_FMT_LINE_LENGTH,
+            "install_mode": Framework.INSTALL_MODE,
+            "clone_strategy": Repository.CLONE_STRATEGY,  # A sparse checkout only has the scope candidates
+            "formatter_toolchain": FormatterToolchain.get_versions(),
+            "tool_versions": self.get_tool_versions()
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+    def build_key(self, commit_sha: str, scope, language: str) -> str:
+        """
+        Builds the cache key of an analysis
+        Args:
+            commit_sha (str): The resolved commit SHA (or "<base>..<target>" for an incremental recount)
+            scope (list[str] | str): The scope from the message
+            language (str): The language of the repository
+        Returns:
+            str: The cache key
+        """
+        return hashlib.sha256(f"{commit_sha}:{self.get_settings_key(scope, language)}".encode()).hexdigest()
+
+
+    @classmethod
+    def is_bypassed(cls, slack_message: str) -> bool:
+        """
+        Check if the message asks to skip the cache
+        """
+        return cls.BYPASS_KEYWORD.lower() in slack_message.lower()
+
+
+    def get(self, key: str, not_before: float | None = None) -> str | None:
+        """
+        Returns a cached result that hasn't expired
+        Args:
+            key (str): The cache key
+            not_before (float): Only return a result stored at or after this time
+        Returns:
+            str: The cached result, or None on a miss
+        """
+        with self.database.connect() as connection:
+            row: tuple | None = connection.execute(
+                "SELECT result FROM results WHERE key = ? AND created_at > ? AND created_at >= ?",
+                (key, time.time() - self.TTL_SECONDS, not_before or 0)
+            ).fetchone()
+        Metrics().inc("cache_requests_total", {"cache": "result", "outcome": "miss" if row is None else "hit"})
+        if row is None:
+            return None
+        self.log_info("Result cache hit: ", key[:12])
+        return row[0]
+
+
+    def put(self, key: str, result: str) -> None:
+        """
+        Stores a result and evicts expired and excess entries
+        Args:
+            key (str): The cache key
+            result (str): The analysis result
+        """
+        with self.database.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO results (key, result, created_at) VALUES (?, ?, ?)", (key, result, time.time()))
+            connection.execute("DELETE FROM results WHERE created_at <= ?", (time.time() - self.TTL_SECONDS,))
+            connection.execute(
+                "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY created_at DESC LIMIT ?)",
+                (self.MAX_ENTRIES,)
+            )
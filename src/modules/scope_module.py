@@ -0,0 +1,100 @@
+import os
+import re
+from modules.cloc_module import Cloc
+from modules.log_module import Log
+from modules.tree_index_module import TreeIndex
+
+class Scope(Log):
+    """
+    Resolves the files in scope the same way the cloc command selects them:
+    the language extension, the scope (file names or directories) and the cloc exclusions.
+    """
+
+    def __init__(self, repo_path: str, scope, language: str, index: TreeIndex | None = None) -> None:
+        """
+        Initialize the scope of a cloned repository
+        Args:
+            repo_path (str): The path to the cloned repository
+            scope (list[str] | str): The scope from the message, "all" by default
+            language (str): The language of the repository
+            index (TreeIndex): An index of the checkout shared with other stages (see `Framework.build_index`),
+                it may include excluded directories
+        """
+        self.repo_path: str = repo_path
+        self.scope: list[str] = self.normalise(scope)
+        self.language: str = language.lower()
+        self.extension: str = f".{Cloc.CLOC_CONFIG[self.language]['extension']}"
+        self.exclude_dirs: re.Pattern = re.compile("|".join(Cloc.CLOC_CONFIG[self.language]["exclude_dirs"]))
+        self.exclude_files: re.Pattern = re.compile("|".join(Cloc.CLOC_CONFIG[self.language]["exclude_files"]))
+        self.files: list[str] | None = None
+        self.index: TreeIndex | None = index
+
+
+    @staticmethod
+    def normalise(scope) -> list[str]:
+        """
+        Returns the scope as a list, ["all"] if everything is in scope
+        """
+        items: list[str] = [scope] if isinstance(scope, str) else list(scope)
+        items = [item.strip() for item in items if item.strip()]
+        if not items or "all" in (item.lower() for item in items):
+            return ["all"]
+        return items
+
+
+    def is_files_scope(self) -> bool:
+        """
+        Check if the scope lists files rather than directories
+        """
+        return ".sol" in self.scope[0]
+
+
+    def is_excluded_dir(self, dir_name: str) -> bool:
+        """
+        Check if a directory is excluded (cloc compares only the directory name)
+        """
+        return self.exclude_dirs.search(dir_name) is not None
+
+
+    def is_in_scope(self, relative_path: str) -> bool:
+        """
+        Check if a file is in scope
+        Args:
+            relative_path (str): The path of the file relative to the repository root
+        Returns:
+            bool: True if the file is counted
+        """
+        directory, file_name = os.path.split(relative_path)
+        if not file_name.endswith(self.extension) or self.exclude_files.search(file_name):
+            return False
+        if any(self.is_excluded_dir(part) for part in directory.split(os.sep) if part):
+            return False
+        if self.scope == ["all"]:
+            return True
+        if self.is_files_scope():
+            return re.search("|".join(self.scope), file_name) is not None
+        return re.search("|".join(self.scope), os.path.join(".", directory)) is not None
+
+
+    def get_index(self) -> TreeIndex:
+        """
+        Returns the shared index, or walks the repository once with the excluded directories pruned during the walk
+        Returns:
+            TreeIndex: The index of the checkout
+        """
+        if self.index is None:
+            self.index = TreeIndex(self.repo_path, self.is_excluded_dir).build()
+        return self.index
+
+
+    def get_files(self) -> list[str]:
+        """
+        Returns the files in scope from the index of the repository
+        Returns:
+            list[str]: The sorted paths of the files in scope, relative to the repository root
+        """
+        if self.files is not None:
+            return self.files
+        self.files = [file for file in self.get_index().files if self.is_in_scope(file)]
+        self.log_info("Files in scope: ", str(len(self.files)))
+        return self.files
@@ -0,0 +1,75 @@
+import fcntl
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from modules.cancel_module import Cancellation
+from modules.config_module import Config
+from modules.log_module import Log, log_context
+
+class SingleFlight(Log):
+    """
+    Cross-process locks that let only one worker run an analysis of the same key at a time,
+    identical requests wait for it and then take its result from the result cache.
+    """
+    LOCKS_DIR: str = Config.get_path("SINGLE_FLIGHT_DIR", "~/.cache/pre-audit-bot/in-flight")
+    POLL_SECONDS: float = 0.2  # How often a waiter retries the lock and checks if its job was cancelled or timed out
+
+
+    def __init__(self, locks_dir: str | None = None) -> None:
+        self.locks_dir: str = locks_dir or self.LOCKS_DIR
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+
+    @staticmethod
+    def __is_current(lock_file, lock_path: str) -> bool:
+        """
+        Returns True if the locked file is still the one at the lock path, i.e. the previous holder didn't delete it
+        """
+        try:
+            return os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino
+        except FileNotFoundError:
+            return False
+
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[bool]:
+        """
+        Holds the lock of a key with `flock`, waiting if another process holds it. The holder deletes the lock
+        file before releasing it, a waiter that then gets the lock of the deleted file locks the new one instead.
+        A waiter polls the lock, so the job it waits for stops waiting when it is cancelled or past its deadline
+        Args:
+            key (str): The key of the work, e.g. a result cache key
+        Yields:
+            bool: True if another process held the lock and this one waited for it
+        Raises:
+            JobCancelledError, JobTimeoutError: The job was cancelled or timed out while waiting
+        """
+        lock_path: str = os.path.join(self.locks_dir, f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.lock")
+        job_id: str | None = log_context.get().get("job")
+        waited: bool = False
+        while True:
+            lock_file = open(lock_path, "a")
+            try:
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if not waited:
+                            self.log_info("Identical analysis in progress, waiting for it: ", key[:12])
+                        waited = True
+                        Cancellation.check(job_id)
+                        time.sleep(self.POLL_SECONDS)
+            except BaseException:
+                lock_file.close()
+                raise
+            if self.__is_current(lock_file, lock_path):
+                break
+            lock_file.close()
+        try:
+            yield waited
+        finally:
+            os.remove(lock_path)  # Still locked, so no other process holds the lock of this path
+            lock_file.close()
@@ -0,0 +1,230 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from modules.config_module import Config
+from modules.log_module import Log
+from modules.metrics_module import Metrics
+
+class SlackApiError(Exception):
+    """
+    Slack answered a Web API call with `ok: false`, or kept failing after the retries
+    """
+
+
+class SlackRateLimitedError(Exception):
+    """
+    Slack answered with HTTP 429, `retry_after` is the number of seconds it asked us to wait
+    """
+    def __init__(self, method: str, retry_after: float) -> None:
+        super().__init__(f"{method} rate limited for {retry_after:.1f}s")
+        self.retry_after: float = retry_after
+
+
+class SlackClient(Log):
+    """
+    The Slack Web API client of the bot: one pooled `requests.Session` shared by every thread, retries with
+    backoff on network and server errors, and `Retry-After` honoured on HTTP 429. Messages are sent one at a
+    time per channel: while a channel is rate limited, the updates of the same message collapse into the newest
+    text and the mergeable posts queued for the same thread are merged into one post, so a burst of progress
+    updates costs one call once the limit lifts. A post is only mergeable if its caller doesn't keep its `ts`,
+    merged posts share one. The bot's user ID is looked up on first use, not at import.
+    """
+    API_URL: str = Config.get_str("SLACK_API_URL", "https://www.slack.com/api/")  # Points the bot at a stand-in, e.g. in benchmarks
+    POOL_SIZE: int = Config.get_int("SLACK_POOL_SIZE", 16)  # Kept-alive connections to Slack
+    TIMEOUT_SECONDS: float = Config.get_float("SLACK_TIMEOUT_SECONDS", 10.0)
+    MAX_RETRIES: int = Config.get_int("SLACK_MAX_RETRIES", 5)
+    BACKOFF_SECONDS: float = 0.5  # The first retry waits this long, every further one twice as long
+    MAX_BACKOFF_SECONDS: float = 30.0
+    MAX_BATCH_CHARS: int = 30000  # Merged posts stay below Slack's 40000 character limit
+    bot_id: str | None = Config.get_str("SLACK_BOT_ID", "") or None  # Set to skip the `auth.test` lookup
+
+
+    def __init__(self, token: str, api_url: str | None = None) -> None:
+        """
+        Initialize the client, no request is made until the first call
+        Args:
+            token (str): The bot token
+            api_url (str): The Web API base URL, API_URL by default
+        """
+        self.api_url: str = (api_url or self.API_URL).rstrip("/") + "/"
+        self.session: requests.Session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+        adapter: HTTPAdapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.lock: threading.Lock = threading.Lock()
+        self.channels: dict[str, dict] = {}  # {channel: {"lock", "next_at"}}, calls to a channel are sent one at a time
+        self.pending: dict[tuple, list[dict]] = {}  # Requests waiting for their channel, {(method, channel, thread or message ts): [request]}
+
+
+    def __request(self, method: str, params: dict) -> dict:
+        """
+        Makes one Web API call, retrying network and server errors with exponential backoff
+        Raises:
+            SlackRateLimitedError: Slack answered with HTTP 429
+            SlackApiError: Slack rejected the call, or it still failed after MAX_RETRIES retries
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            started_at: float = time.perf_counter()
+            try:
+                response: requests.Response = self.session.post(self.api_url + method, json=params, timeout=self.TIMEOUT_SECONDS)
+            except requests.RequestException as e:
+                error: str = str(e)
+            else:
+                Metrics().observe("slack_request_duration_seconds", {"method": method}, time.perf_counter() - started_at)
+                if response.status_code == 429:
+                    Metrics().inc("slack_rate_limited_total", {"method": method})
+                    raise SlackRateLimitedError(method, float(response.headers.get("Retry-After") or 1))
+                if response.status_code < 500:
+                    try:
+                        data: dict = response.json()
+                    except ValueError:  # E.g. the HTML error page of a proxy
+                        raise SlackApiError(f"{method} failed: HTTP {response.status_code} without a JSON body")
+                    if data.get("ok"):
+                        return data
+                    raise SlackApiError(f"{method} failed: {data.get('error')}")
+                error: str = f"HTTP {response.status_code}"
+            if attempt < self.MAX_RETRIES:
+                backoff: float = min(self.BACKOFF_SECONDS * 2 ** attempt, self.MAX_BACKOFF_SECONDS)
+                self.log_error(f"Slack call {method} failed, retrying in {backoff:.1f}s: ", error)
+                time.sleep(backoff)
+        raise SlackApiError(f"{method} failed after {self.MAX_RETRIES} retries: {error}")
+
+
+    def call(self, method: str, **params) -> dict:
+        """
+        Makes a Web API call, waiting out rate limits
+        Args:
+            method (str): The API method, e.g. `auth.test`
+            params: The parameters of the call
+        Returns:
+            dict: The response
+        """
+        for _ in range(self.MAX_RETRIES):
+            try:
+                return self.__request(method, params)
+            except SlackRateLimitedError as e:
+                time.sleep(e.retry_after)
+        return self.__request(method, params)
+
+
+    def get_bot_id(self) -> str:
+        """
+        Returns the user ID of the bot, looked up once per process
+        """
+        if SlackClient.bot_id is None:
+            with self.lock:
+                if SlackClient.bot_id is None:
+                    SlackClient.bot_id = self.call("auth.test")["user_id"]
+        return SlackClient.bot_id
+
+
+    def __merge(self, method: str, batch: list[dict]) -> dict:
+        """
+        Returns the parameters of one call sending a batch of requests
+        """
+        if method == "chat.update":
+            return batch[-1]["params"]  # Only the newest text of a message matters
+        return {**batch[0]["params"], "text": "\n\n".join(request["params"]["text"] for request in batch)}
+
+
+    def __take_batch(self, key: tuple, batch: list[dict]) -> None:
+        """
+        Moves the requests waiting under a key into the batch, up to MAX_BATCH_CHARS of text (the caller holds the channel lock)
+        """
+        with self.lock:
+            waiting: list[dict] = self.pending.get(key, [])
+            size: int = sum(len(request["params"].get("text") or "") for request in batch)
+            while waiting and (not batch or key[0] == "chat.update" or (
+                batch[0]["mergeable"] and waiting[0]["mergeable"] and size + len(waiting[0]["params"].get("text") or "") <= self.MAX_BATCH_CHARS
+            )):
+                request: dict = waiting.pop(0)
+                size += len(request["params"].get("text") or "")
+                batch.append(request)
+            if not waiting:
+                self.pending.pop(key, None)
+
+
+    def __flush(self, method: str, channel: str, key: str, state: dict) -> None:
+        """
+        Sends the oldest requests waiting under a key in one call, waiting out the rate limit of the channel
+        (the caller holds the channel lock)
+        """
+        batch: list[dict] = []
+        try:
+            for _ in range(self.MAX_RETRIES + 1):
+                time.sleep(max(0.0, state["next_at"] - time.monotonic()))
+                self.__take_batch((method, channel, key), batch)
+                try:
+                    response: dict = self.__request(method, self.__merge(method, batch))
+                    break
+                except SlackRateLimitedError as e:
+                    # Everything queued for this thread until the limit lifts goes out in one call
+                    state["next_at"] = time.monotonic() + e.retry_after
+            else:
+                raise SlackApiError(f"{method} still rate limited after {self.MAX_RETRIES} retries")
+            if len(batch) > 1:
+                Metrics().inc("slack_messages_batched_total", {"method": method}, len(batch) - 1)
+                self.log_info("Merged Slack messages into one call: ", f"{method} {len(batch)}")
+            for request in batch:
+                request["response"] = response
+        except Exception as e:
+            for request in batch:
+                request["error"] = e
+        finally:
+            for request in batch:
+                request["done"].set()
+
+
+    def __send(self, method: str, channel: str, key: str, params: dict, mergeable: bool = True) -> dict:
+        """
+        Sends a message call, merged with the calls for the same thread (or message) that queue up meanwhile
+        Args:
+            method (str): `chat.postMessage` or `chat.update`
+            channel (str): The channel ID
+            key (str): The thread of a post, the timestamp of an update
+            params (dict): The parameters of the call
+            mergeable (bool): A post may go out in one call with other mergeable posts
+        Returns:
+            dict: The response of the call that carried this message
+        """
+        request: dict = {"params": params, "mergeable": mergeable, "done": threading.Event(), "response": None, "error": None}
+        with self.lock:
+            self.pending.setdefault((method, channel, key), []).append(request)
+            state: dict = self.channels.setdefault(channel, {"lock": threading.Lock(), "next_at": 0.0})
+        while not request["done"].is_set():
+            with state["lock"]:
+                # Another thread may have sent this request with its own while we waited for the channel
+                if not request["done"].is_set():
+                    self.__flush(method, channel, key, state)
+        if request["error"] is not None:
+            raise request["error"]
+        return request["response"]
+
+
+    def post_message(self, channel: str, text: str, thread_ts: str | None = None, mergeable: bool = False) -> dict:
+        """
+        Posts a message, in a thread if `thread_ts` is given
+        Args:
+            channel (str): The channel ID
+            text (str): The text of the message
+            thread_ts (str): The message to reply to
+            mergeable (bool): While the channel is rate limited the message may be merged into one post with
+                other mergeable replies to the thread, only for messages that are never updated
+        Returns:
+            dict: The response, `ts` is the timestamp of the posted message (of the merged post for a merged message)
+        """
+        params: dict = {"channel": channel, "text": text}
+        if thread_ts:
+            params["thread_ts"] = thread_ts
+        return self.__send("chat.postMessage", channel, thread_ts or "", params, mergeable)
+
+
+    def update_message(self, channel: str, ts: str, text: str) -> dict:
+        """
+        Replaces the text of a message the bot posted
+        Returns:
+            dict: The response
+        """
+        return self.__send("chat.update", channel, ts, {"channel": channel, "ts": ts, "text": text})
@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+class SqliteDatabase:
+    """
+    A SQLite database shared by the web process and the worker processes, used by the result and format
+    caches, the count store, the metrics and the message de-duplication. The database runs in WAL mode,
+    so readers don't block the writer, and a writer waits up to TIMEOUT_SECONDS for the others.
+    Plain class (not Log) because the metrics, which the log module reports to, keep one.
+    """
+    TIMEOUT_SECONDS: float = 30.0
+
+
+    def __init__(self, db_path: str) -> None:
+        """
+        Initialize the database, creating its directory if needed
+        Args:
+            db_path (str): The path to the SQLite database
+        """
+        self.db_path: str = db_path
+        self.local: threading.local = threading.local()  # The connection kept open by each thread, see transaction
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a transaction that tolerates concurrent writers from other processes
+        """
+        connection: sqlite3.Connection = sqlite3.connect(self.db_path, timeout=self.TIMEOUT_SECONDS)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a transaction on a connection the calling thread keeps open, for frequent small writes (the
+        metrics) that would otherwise pay for a connection each. The commits don't wait for an fsync: an
+        application crash loses nothing, a power loss only the last transactions
+        """
+        connection: sqlite3.Connection | None = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():  # Not inherited from the parent of a fork
+            connection = sqlite3.connect(self.db_path, timeout=self.TIMEOUT_SECONDS)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        with connection:
+            yield connection
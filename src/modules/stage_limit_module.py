@@ -0,0 +1,79 @@
+import multiprocessing
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from modules.config_module import Config
+
+class StageLimits:
+    """
+    Per-stage concurrency limits shared by the worker processes, e.g. at most 2 clones and 1 dependency
+    install at a time while 4 jobs run. The semaphores are created in the parent process and handed to
+    the workers through the pool initializer; `Log.span` holds the slot of its stage while it runs.
+    """
+    STAGE_LIMITS: str = Config.get_str("STAGE_LIMITS", "")  # e.g. "clone=2,install=1,format=2,count=4"
+    POLL_SECONDS: float = 1.0  # How often a stage waiting for a slot checks if it should stop waiting
+    semaphores: dict = {}  # The semaphores of this process, {stage: semaphore}
+
+
+    @staticmethod
+    def parse(spec: str) -> dict[str, int]:
+        """
+        Parses a limits spec like `clone=2,install=1`
+        Args:
+            spec (str): The spec
+        Returns:
+            dict[str, int]: {stage: limit}
+        """
+        limits: dict[str, int] = {}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            stage, _, limit = item.partition("=")
+            if int(limit) < 1:
+                raise ValueError(f"The limit of stage {stage} must be at least 1")
+            limits[stage.strip()] = int(limit)
+        return limits
+
+
+    @classmethod
+    def create(cls, spec: str | None = None, context=None) -> dict:
+        """
+        Creates the semaphores of a limits spec, STAGE_LIMITS by default
+        Args:
+            spec (str): The limits spec
+            context: The multiprocessing context the workers are started with, the default one if not given
+        Returns:
+            dict: {stage: semaphore}, to be passed to `configure` in every worker
+        """
+        return {stage: (context or multiprocessing).BoundedSemaphore(limit) for stage, limit in cls.parse(cls.STAGE_LIMITS if spec is None else spec).items()}
+
+
+    @classmethod
+    def configure(cls, semaphores: dict) -> None:
+        """
+        Installs the semaphores in this process, used as the initializer of worker pools
+        """
+        cls.semaphores = semaphores
+
+
+    @classmethod
+    @contextmanager
+    def acquire(cls, stage: str, check: Callable[[], None] | None = None) -> Iterator[float]:
+        """
+        Holds a slot of a stage for the duration of the block, stages without a limit pass straight through
+        Args:
+            stage (str): The stage name, as used by `Log.span`
+            check (Callable[[], None]): Called every POLL_SECONDS while waiting, raises to stop waiting (e.g. on a cancellation)
+        Yields:
+            float: The seconds spent waiting for the slot
+        """
+        semaphore = cls.semaphores.get(stage)
+        if semaphore is None:
+            yield 0.0
+            return
+        start: float = time.perf_counter()
+        while not semaphore.acquire(timeout=cls.POLL_SECONDS):
+            if check is not None:
+                check()
+        try:
+            yield time.perf_counter() - start
+        finally:
+            semaphore.release()
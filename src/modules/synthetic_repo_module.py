@@ -0,0 +1,142 @@
+import json
+import os
+import random
+import shutil
+import subprocess
+from modules.log_module import Log
+
+class SyntheticRepo(Log):
+    """
+    Generates a local git repository with a Hardhat or Foundry layout for benchmarks:
+    N contracts, a vendored dependency tree (`node_modules` / `lib`) committed into the
+    repository and a history of commits that each modify one contract.
+    The repository is written with a single `git fast-import` stream, so deep histories are cheap.
+    """
+    LAYOUTS: dict = {
+        "hardhat": {"contracts_dir": "contracts", "vendored_dir": "node_modules/@openzeppelin/contracts/token", "tests_dir": "test"},
+        "foundry": {"contracts_dir": "src", "vendored_dir": "lib/forge-std/src", "tests_dir": "test"}
+    }
+    COMMIT_TIME: int = 1700000000  # Fixed timestamps keep the generated SHAs reproducible
+    SPEC_FILE: str = "synthetic-spec.json"
+
+
+    def __init__(self, layout: str = "hardhat", contracts: int = 20, lines: int = 150, vendored: int = 50, history: int = 20, seed: int = 1) -> None:
+        """
+        Initialize the generator
+        Args:
+            layout (str): "hardhat" or "foundry"
+            contracts (int): The number of in-scope contracts
+            lines (int): The approximate number of lines per contract
+            vendored (int): The number of vendored dependency files
+            history (int): The number of commits after the initial one
+            seed (int): The seed of the generated content
+        """
+        if layout not in self.LAYOUTS:
+            raise ValueError(f"Unknown layout {layout}, expected one of {', '.join(self.LAYOUTS)}")
+        self.spec: dict = {"layout": layout, "contracts": contracts, "lines": lines, "vendored": vendored, "history": history, "seed": seed}
+
+
+    def get_name(self) -> str:
+        """
+        Returns a name describing the repository, e.g. `hardhat-c20-l150-v50-h20-s1`
+        """
+        spec: dict = self.spec
+        return f"{spec['layout']}-c{spec['contracts']}-l{spec['lines']}-v{spec['vendored']}-h{spec['history']}-s{spec['seed']}"
+
+
+    @staticmethod
+    def build_contract(name: str, lines: int, rng: random.Random) -> str:
+        """
+        Builds a contract with NatSpec, comments, string literals and inconsistent spacing for the formatter
+        Args:
+            name (str): The contract name
+            lines (int): The approximate number of lines
+            rng (random.Random): The random generator
+        Returns:
+            str: The Solidity source
+        """
+        source: list[str] = ["// SPDX-License-Identifier: MIT", "pragma solidity ^0.8.20;", "", "/**", f" * @title {name}", " * @notice Synthetic benchmark contract", " */", f"contract {name} {{"]
+        source += [f"    uint256 public value{index};" for index in range(4)]
+        source.append(f"    mapping(address=>uint256) internal balances; // balances of {name}")
+        function_index: int = 0
+        while len(source) < lines - 2:
+            source += [
+                "",
+                f"    /// @notice Updates the state, variant {rng.randint(0, 10 ** 6)}",
+                f"    function update{function_index}(uint256 amount,address account) external returns(uint256) {{",
+                f"        require(amount>{rng.randint(0, 1000)}, \"{name}: amount // too low\");",
+                "        /* adjust the balance */",
+                f"        balances[account]+=amount*{rng.randint(1, 9)};",
+                f"        value{function_index % 4} = balances[account]  ;",
+                f"        return value{function_index % 4};",
+                "    }"
+            ]
+            function_index += 1
+        source += ["}", ""]
+        return "\n".join(source)
+
+
+    def __get_files(self, rng: random.Random) -> dict[str, str]:
+        """
+        Returns the files of the initial commit, {path: content}
+        """
+        layout: dict = self.LAYOUTS[self.spec["layout"]]
+        files: dict[str, str] = {}
+        if self.spec["layout"] == "hardhat":
+            files["hardhat.config.js"] = "module.exports = { solidity: \"0.8.20\" };\n"
+            package: dict = {"name": "synthetic-protocol", "version": "1.0.0", "devDependencies": {"hardhat": "^2.22.0", "@openzeppelin/contracts": "^5.0.0"}}
+            files["package.json"] = json.dumps(package, indent=2) + "\n"
+            files["package-lock.json"] = json.dumps({"name": "synthetic-protocol", "lockfileVersion": 3, "requires": True, "packages": {"": package}}, indent=2) + "\n"
+        else:
+            files["foundry.toml"] = "[profile.default]\nsrc = \"src\"\nout = \"out\"\nlibs = [\"lib\"]\n"
+        for index in range(self.spec["contracts"]):
+            files[f"{layout['contracts_dir']}/Contract{index}.sol"] = self.build_contract(f"Contract{index}", self.spec["lines"], rng)
+        for index in range(min(5, self.spec["contracts"])):
+            files[f"{layout['tests_dir']}/Contract{index}.t.sol"] = self.build_contract(f"Contract{index}Test", 40, rng)
+        for index in range(self.spec["vendored"]):
+            files[f"{layout['vendored_dir']}/Vendor{index}.sol"] = self.build_contract(f"Vendor{index}", self.spec["lines"], rng)
+        return files
+
+
+    @staticmethod
+    def __add_commit(stream: list[bytes], message: str, timestamp: int, files: dict[str, str]) -> None:
+        """
+        Appends a commit of the `main` branch to a fast-import stream
+        """
+        message_bytes: bytes = message.encode()
+        stream.append(f"commit refs/heads/main\ncommitter Benchmark <benchmark@example.com> {timestamp} +0000\ndata {len(message_bytes)}\n".encode() + message_bytes + b"\n")
+        for path, content in files.items():
+            content_bytes: bytes = content.encode()
+            stream.append(f"M 100644 inline {path}\ndata {len(content_bytes)}\n".encode() + content_bytes + b"\n")
+
+
+    def generate(self, path: str) -> str:
+        """
+        Creates the repository as a bare repository, reusing it if it was generated with the same spec
+        Args:
+            path (str): The directory of the bare repository
+        Returns:
+            str: The path, usable as the repository URL
+        """
+        spec_path: str = os.path.join(path, self.SPEC_FILE)
+        if os.path.isfile(spec_path):
+            with open(spec_path, "r") as spec_file:
+                if json.load(spec_file) == self.spec:
+                    return path
+        shutil.rmtree(path, ignore_errors=True)
+        self.log_info("Generating synthetic repository: ", self.get_name())
+        subprocess.run(["git", "init", "--quiet", "--bare", "--initial-branch=main", path], check=True)
+        # Shallow clones fetch with a blob filter
+        subprocess.run(["git", "config", "uploadpack.allowFilter", "true"], cwd=path, check=True)
+        rng: random.Random = random.Random(self.spec["seed"])
+        stream: list[bytes] = []
+        self.__add_commit(stream, "Initial commit", self.COMMIT_TIME, self.__get_files(rng))
+        contracts_dir: str = self.LAYOUTS[self.spec["layout"]]["contracts_dir"]
+        for index in range(self.spec["history"]):
+            contract_index: int = index % max(1, self.spec["contracts"])
+            changed: dict[str, str] = {f"{contracts_dir}/Contract{contract_index}.sol": self.build_contract(f"Contract{contract_index}", self.spec["lines"], rng)}
+            self.__add_commit(stream, f"Update Contract{contract_index}", self.COMMIT_TIME + index + 1, changed)
+        subprocess.run(["git", "fast-import", "--quiet"], cwd=path, input=b"".join(stream), check=True)
+        with open(spec_path, "w") as spec_file:
+            json.dump(self.spec, spec_file)
+        return path
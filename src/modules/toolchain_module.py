@@ -0,0 +1,108 @@
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from modules.config_module import Config
+from modules.log_module import Log
+from modules.process_module import ProcessRunner
+
+class FormatterToolchain(Log):
+    """
+    A pinned prettier + prettier-plugin-solidity install owned by the bot, shared by all jobs,
+    so formatting a Hardhat project doesn't need the project's own dependencies.
+    """
+    TOOLCHAIN_DIR: str = Config.get_path("FORMATTER_TOOLCHAIN_DIR", "~/.cache/pre-audit-bot/toolchain")
+    PRETTIER_VERSION: str = Config.get_str("PRETTIER_VERSION", "3.3.3")
+    PRETTIER_SOLIDITY_VERSION: str = Config.get_str("PRETTIER_SOLIDITY_VERSION", "1.4.1")
+    BOT_PRETTIER_CONFIG: str = ".prettierrc.bot.json"  # Written into the checkout, so `overrides` resolve relative to the project
+
+
+    def __init__(self, toolchain_dir: str | None = None) -> None:
+        """
+        Initialize the toolchain handler for the pinned versions
+        Args:
+            toolchain_dir (str): The directory holding the toolchain installs
+        """
+        self.install_path: str = os.path.join(toolchain_dir or self.TOOLCHAIN_DIR, f"prettier-{self.PRETTIER_VERSION}-solidity-{self.PRETTIER_SOLIDITY_VERSION}")
+        self.prettier_bin: str = os.path.join(self.install_path, "node_modules", ".bin", "prettier")
+        self.plugin_path: str | None = None
+
+
+    @classmethod
+    def get_versions(cls) -> dict:
+        """
+        Returns the pinned versions (part of the result cache key)
+        """
+        return {"prettier": cls.PRETTIER_VERSION, "prettier-plugin-solidity": cls.PRETTIER_SOLIDITY_VERSION}
+
+
+    def __resolve_plugin(self) -> str:
+        """
+        Returns the absolute entry point of the solidity plugin, prettier can't resolve it by name from the project directory
+        """
+        return ProcessRunner().run(["node", "-e", "console.log(require.resolve('prettier-plugin-solidity'))"], cwd=self.install_path, timeout=60).strip()
+
+
+    def ensure(self) -> bool:
+        """
+        Installs the pinned toolchain once (other processes wait on the lock and reuse it)
+        Returns:
+            bool: True if the toolchain is ready to use
+        """
+        if self.plugin_path:
+            return True
+        os.makedirs(os.path.dirname(self.install_path), exist_ok=True)
+        try:
+            with open(f"{self.install_path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if not os.path.exists(self.prettier_bin):
+                    self.log_info("Installing formatter toolchain: ", os.path.basename(self.install_path))
+                    partial_path: str = f"{self.install_path}.partial"
+                    shutil.rmtree(partial_path, ignore_errors=True)
+                    os.makedirs(partial_path)
+                    ProcessRunner().run(
+                        ["npm", "install", "--prefix", partial_path, "--no-audit", "--no-fund",
+                         f"prettier@{self.PRETTIER_VERSION}", f"prettier-plugin-solidity@{self.PRETTIER_SOLIDITY_VERSION}"],
+                        stage="formatter_setup"
+                    )
+                    shutil.rmtree(self.install_path, ignore_errors=True)
+                    os.rename(partial_path, self.install_path)
+                    self.log_success("Formatter toolchain installed successfully")
+            self.plugin_path = self.__resolve_plugin()
+            return True
+        except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            self.log_error("Error installing formatter toolchain: ", str(e))
+            return False
+
+
+    def write_prettier_config(self, repo_path: str, default_config_path: Path) -> str:
+        """
+        Writes the prettier config used with the toolchain: the project's JSON .prettierrc if it has one,
+        the bot's default config otherwise, with the plugin pointing at the toolchain install
+        Args:
+            repo_path (str): The path to the cloned repository
+            default_config_path (Path): The bot's default prettier config
+        Returns:
+            str: The path to the written config
+        """
+        with open(default_config_path, "r") as config_file:
+            prettier_config: dict = json.load(config_file)
+        project_config_path: Path = Path(repo_path) / ".prettierrc"
+        if project_config_path.exists():
+            try:
+                prettier_config = json.loads(project_config_path.read_text())
+            except ValueError:
+                self.log_info("Project .prettierrc is not JSON, using the default configuration")
+        prettier_config["plugins"] = [self.plugin_path]
+        config_path: Path = Path(repo_path) / self.BOT_PRETTIER_CONFIG
+        config_path.write_text(json.dumps(prettier_config, indent=2))
+        return str(config_path)
+
+
+    def get_prettier_command(self, config_path: str) -> list[str]:
+        """
+        Returns the prettier command line, the files to format are appended by the caller
+        """
+        return [self.prettier_bin, "--config", config_path, "--no-editorconfig", "--write"]
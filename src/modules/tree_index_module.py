@@ -0,0 +1,76 @@
+import os
+from typing import Callable
+from modules.log_module import Log
+
+class TreeIndex(Log):
+    """
+    One `os.scandir` walk of a checkout, shared by the stages that need the file tree: the framework detection
+    looks up the config files of every directory, the scope filters the files. `.git` and `node_modules`
+    are never walked, callers prune more directories (e.g. the cloc exclusions) and may bound the depth.
+    Symbolic links aren't followed, so the walk ends without a depth limit.
+    """
+    ALWAYS_PRUNED: set = {".git", "node_modules"}
+
+
+    def __init__(self, repo_path: str, prune: Callable[[str], bool] | None = None, max_depth: int | None = None) -> None:
+        """
+        Initialize the index of a checkout, `build` walks it
+        Args:
+            repo_path (str): The path to the checkout
+            prune (Callable[[str], bool]): Tells by its name if a directory is skipped with everything below it
+            max_depth (int): The deepest directory walked, the whole tree if not given
+        """
+        self.repo_path: str = repo_path
+        self.prune: Callable[[str], bool] | None = prune
+        self.max_depth: int | None = max_depth
+        self.files: list[str] = []  # Every file, relative to the checkout root, sorted
+        self.dir_files: dict[str, set[str]] = {}  # The file names of every walked directory ("" for the root)
+
+
+    def build(self) -> "TreeIndex":
+        """
+        Walks the checkout once
+        Returns:
+            TreeIndex: The index itself
+        """
+        files: list[str] = []
+        stack: list[tuple[str, int]] = [("", 0)]
+        while stack:
+            relative_dir, depth = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(self.repo_path, relative_dir)))
+            except OSError:
+                continue
+            names: set[str] = set()
+            for entry in entries:
+                relative_path: str = os.path.join(relative_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if (self.max_depth is None or depth < self.max_depth) and entry.name not in self.ALWAYS_PRUNED and not (self.prune and self.prune(entry.name)):
+                        stack.append((relative_path, depth + 1))
+                elif entry.is_file(follow_symlinks=False):
+                    names.add(entry.name)
+                    files.append(relative_path)
+            self.dir_files[relative_dir] = names
+        self.files = sorted(files)
+        self.log_info("Indexed files: ", f"{len(self.files)} in {len(self.dir_files)} directories")
+        return self
+
+
+    def find_dirs_with(self, file_names: list[str], max_depth: int) -> dict[str, str]:
+        """
+        Returns the directories that contain one of the given files
+        Args:
+            file_names (list[str]): The file names to look for, in order of preference
+            max_depth (int): The deepest directory to return, 0 for the root only
+        Returns:
+            dict[str, str]: {directory: the first matching file name}, "" is the root
+        """
+        found: dict[str, str] = {}
+        for directory, names in self.dir_files.items():
+            if directory and directory.count(os.sep) + 1 > max_depth:
+                continue
+            for file_name in file_names:
+                if file_name in names:
+                    found[directory] = file_name
+                    break
+        return found
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from typing import Iterator
+from modules.cache_module import DiskCache
+from modules.config_module import Config
+
+class WorkspaceQuotaError(Exception):
+    """
+    A job's checkout grew over the per-job disk quota
+    """
+
+
+class WorkspaceManager(DiskCache):
+    """
+    Allocates the checkout directories of the analysis jobs. A workspace is leased with an exclusive
+    lock for the duration of a job: when the job finishes it is kept warm (checkout and `node_modules`)
+    for the next job of the same repository, when the job's process dies the lock is released by the
+    kernel and the leftover workspace is reclaimed. Idle workspaces are evicted in LRU order to keep
+    the root under the global quota.
+    """
+    ROOT: str = Config.get_path("WORKSPACE_ROOT", "~/.cache/pre-audit-bot/workspaces")
+    MAX_BYTES: int = Config.get_int("WORKSPACE_MAX_BYTES", 50 * 1024 ** 3)  # Global quota of the root
+    JOB_MAX_BYTES: int = Config.get_int("WORKSPACE_JOB_MAX_BYTES", 5 * 1024 ** 3)  # Quota of a single job
+    WARM_PER_REPO: int = Config.get_int("WORKSPACE_WARM_PER_REPO", 1)  # Idle workspaces kept per repository
+    # Repositories whose last checkout was smaller than TMPFS_MAX_REPO_BYTES get a workspace on tmpfs, if configured
+    TMPFS_ROOT: str = Config.get_path("WORKSPACE_TMPFS_ROOT", "") if Config.get_str("WORKSPACE_TMPFS_ROOT", "") else ""
+    TMPFS_MAX_BYTES: int = Config.get_int("WORKSPACE_TMPFS_MAX_BYTES", 2 * 1024 ** 3)
+    TMPFS_MAX_REPO_BYTES: int = Config.get_int("WORKSPACE_TMPFS_MAX_REPO_BYTES", 200 * 1024 ** 2)
+    # New jobs are held back when the root is this full or the filesystem has less free space
+    PRESSURE_RATIO: float = Config.get_float("WORKSPACE_PRESSURE_RATIO", 0.9)
+    MIN_FREE_BYTES: int = Config.get_int("WORKSPACE_MIN_FREE_BYTES", 5 * 1024 ** 3)
+
+
+    def __init__(self, root: str | None = None, max_bytes: int | None = None) -> None:
+        super().__init__(root or self.ROOT, max_bytes or self.MAX_BYTES)
+
+
+    @classmethod
+    def for_repo(cls, repo_key: str) -> "WorkspaceManager":
+        """
+        Returns the manager to allocate a workspace of a repository from: tmpfs for repositories known
+        to be small while tmpfs has room, the disk root otherwise
+        Args:
+            repo_key (str): The normalised repository URL
+        """
+        disk: WorkspaceManager = cls()
+        if not cls.TMPFS_ROOT:
+            return disk
+        known_size: int | None = disk.read_meta(cls.get_stats_name(repo_key)).get("size")
+        tmpfs: WorkspaceManager = cls(cls.TMPFS_ROOT, cls.TMPFS_MAX_BYTES)
+        if known_size is not None and known_size <= cls.TMPFS_MAX_REPO_BYTES and tmpfs.get_usage()["used_bytes"] + known_size <= cls.TMPFS_MAX_BYTES:
+            return tmpfs
+        return disk
+
+
+    @staticmethod
+    def get_stats_name(repo_key: str) -> str:
+        """
+        Returns the metadata name the last checkout size of a repository is recorded under
+        """
+        return f"repo-stats-{hashlib.sha256(repo_key.encode()).hexdigest()[:16]}"
+
+
+    @staticmethod
+    def new_workspace_name(repo_key: str) -> str:
+        """
+        Returns a new workspace name, e.g. `sthai-contract-3f2a9c1d`
+        """
+        slug: str = re.sub(r"[^a-z0-9._-]+", "_", repo_key.lower().split("/")[-1])[:40]
+        return f"{slug}-{uuid.uuid4().hex[:8]}"
+
+
+    def reclaim(self) -> list[str]:
+        """
+        Removes the workspaces of jobs that died without releasing them (marked busy, but nobody holds the lock)
+        Returns:
+            list[str]: The names of the reclaimed workspaces
+        """
+        reclaimed: list[str] = []
+        for name in self.list_entries():
+            if self.read_meta(name).get("state") != "busy":
+                continue
+            with self.lock(name, blocking=False) as acquired:
+                if acquired and self.read_meta(name).get("state") == "busy":
+                    self.remove(name)
+                    reclaimed.append(name)
+        if reclaimed:
+            self.log_info("Reclaimed workspaces of crashed jobs: ", ", ".join(reclaimed))
+        return reclaimed
+
+
+    def __trim_warm(self, repo_key: str) -> None:
+        """
+        Removes the oldest idle workspaces of a repository beyond WARM_PER_REPO
+        """
+        idle: list[tuple[float, str]] = []
+        for name in self.list_entries():
+            meta: dict = self.read_meta(name)
+            if meta.get("repo") == repo_key and meta.get("state") == "idle":
+                idle.append((meta.get("last_used", 0.0), name))
+        for _, name in sorted(idle, reverse=True)[self.WARM_PER_REPO:]:
+            with self.lock(name, blocking=False) as acquired:
+                if acquired:
+                    self.remove(name)
+
+
+    def check_quota(self, path: str) -> int:
+        """
+        Measures a leased workspace, records its size and enforces the per-job quota
+        Args:
+            path (str): The workspace path
+        Returns:
+            int: The size in bytes
+        """
+        name: str = os.path.basename(path)
+        size: int = self.record_size(name)
+        if size > self.JOB_MAX_BYTES:
+            raise WorkspaceQuotaError(f"The checkout uses {size / 1024 ** 2:.0f} MiB, over the per-job quota of {self.JOB_MAX_BYTES / 1024 ** 2:.0f} MiB")
+        return size
+
+
+    @contextmanager
+    def acquire(self, repo_key: str) -> Iterator[str]:
+        """
+        Leases a workspace for a job, a warm one of the same repository if one is idle
+        Args:
+            repo_key (str): The normalised repository URL
+        Yields:
+            str: The workspace path, it still holds the checkout of the previous job of the repository if it was warm
+        """
+        self.reclaim()
+        with ExitStack() as stack:
+            name: str | None = None
+            for candidate in self.list_entries():
+                meta: dict = self.read_meta(candidate)
+                if meta.get("repo") != repo_key or meta.get("state") != "idle":
+                    continue
+                # Check again under the lock, the workspace may have been leased or evicted in between
+                if stack.enter_context(self.lock(candidate, blocking=False)) and self.read_meta(candidate).get("state") == "idle" and os.path.isdir(self.get_entry_path(candidate)):
+                    name = candidate
+                    self.log_info("Reusing warm workspace: ", name)
+                    break
+                stack.close()  # Leased by a concurrent job, try the next one
+            if name is None:
+                self.evict()  # Make room for the new checkout
+                name = self.new_workspace_name(repo_key)
+                stack.enter_context(self.lock(name))
+                os.makedirs(self.get_entry_path(name), exist_ok=True)
+            self.write_meta(name, repo=repo_key, state="busy", pid=os.getpid(), leased_at=time.time(), last_used=time.time())
+            try:
+                yield self.get_entry_path(name)
+            except BaseException:
+                # A failed job may leave a half-updated checkout, don't hand it to the next job
+                self.remove(name)
+                raise
+            size: int = self.record_size(name)
+            self.write_meta(self.get_stats_name(repo_key), size=size)
+            if size > self.JOB_MAX_BYTES:
+                self.remove(name)
+            else:
+                self.write_meta(name, state="idle", pid=None, last_used=time.time())
+        self.__trim_warm(repo_key)
+        self.evict()
+
+
+    def get_usage(self) -> dict:
+        """
+        Returns the disk usage of the workspaces, from the sizes recorded at the last checkpoint of every workspace
+        """
+        states: dict = {"busy": 0, "idle": 0}
+        used_bytes: int = 0
+        for name in self.list_entries():
+            meta: dict = self.read_meta(name)
+            used_bytes += meta.get("size", 0)
+            if meta.get("state") in states:
+                states[meta["state"]] += 1
+        free_disk_bytes: int = shutil.disk_usage(self.root).free
+        return {
+            "root": self.root,
+            "used_bytes": used_bytes,
+            "max_bytes": self.max_bytes,
+            "free_disk_bytes": free_disk_bytes,
+            "busy": states["busy"],
+            "idle": states["idle"]
+        }
+
+
+    def is_under_pressure(self) -> bool:
+        """
+        Tells if new jobs should wait: the root is near its quota after evicting idle workspaces, or the disk is nearly full
+        """
+        usage: dict = self.get_usage()
+        if usage["used_bytes"] >= self.max_bytes * self.PRESSURE_RATIO and usage["idle"]:
+            self.evict()
+            usage = self.get_usage()
+        return usage["used_bytes"] >= self.max_bytes * self.PRESSURE_RATIO or usage["free_disk_bytes"] < self.MIN_FREE_BYTES
@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+from modules.job_module import JobQueue
+
+
+def slow_worker(text: str) -> str:
+    """
+    The analysis of the tests, runs in a worker process so it must be importable from this module
+    """
+    time.sleep(1)
+    return f"result of {text}"
+
+
+class JobQueueTest(unittest.TestCase):
+    """
+    Coalescing of identical requests and cancellation of jobs that share an analysis
+    """
+
+    def setUp(self) -> None:
+        self.finished: dict[str, dict] = {}
+        self.finished_lock: threading.Condition = threading.Condition()
+        self.queue: JobQueue = JobQueue(worker=slow_worker, on_done=self.on_done, max_workers=1, max_queue_size=2)
+
+
+    def tearDown(self) -> None:
+        self.queue.shutdown()
+
+
+    def on_done(self, job: dict) -> None:
+        with self.finished_lock:
+            self.finished[job["id"]] = job
+            self.finished_lock.notify_all()
+
+
+    def wait_for(self, *job_ids: str, timeout: float = 30) -> None:
+        with self.finished_lock:
+            self.assertTrue(self.finished_lock.wait_for(lambda: all(job_id in self.finished for job_id in job_ids), timeout))
+
+
+    def test_identical_jobs_share_one_analysis(self) -> None:
+        leader: dict = self.queue.submit("C", "1", "a", key="k")
+        follower: dict = self.queue.submit("C", "2", "b", key="k")
+        self.assertEqual(follower["coalesced_with"], leader["id"])
+        self.wait_for(leader["id"], follower["id"])
+        self.assertEqual(self.finished[leader["id"]]["state"], "done")
+        self.assertEqual(self.finished[follower["id"]]["result"], "result of a")
+
+
+    def test_cancelled_follower_leaves_the_analysis_running(self) -> None:
+        leader: dict = self.queue.submit("C", "1", "a", key="k")
+        follower: dict = self.queue.submit("C", "2", "b", key="k")
+        self.assertTrue(self.queue.cancel(follower["id"]))
+        self.wait_for(leader["id"], follower["id"])
+        self.assertEqual(self.finished[follower["id"]]["state"], "cancelled")
+        self.assertEqual(self.finished[leader["id"]]["result"], "result of a")
+
+
+    def test_cancelled_leader_hands_the_analysis_over(self) -> None:
+        leader: dict = self.queue.submit("C", "1", "a", key="k")
+        follower: dict = self.queue.submit("C", "2", "b", key="k")
+        other: dict = self.queue.submit("C", "3", "c", key="k")
+        time.sleep(0.5)  # Running
+        self.assertTrue(self.queue.cancel(leader["id"]))
+        self.assertIsNone(self.queue.get_job(follower["id"])["coalesced_with"])
+        self.assertEqual(self.queue.get_job(other["id"])["coalesced_with"], follower["id"])
+        self.wait_for(leader["id"], follower["id"], other["id"])
+        self.assertEqual(self.finished[leader["id"]]["state"], "cancelled")
+        self.assertEqual(self.finished[follower["id"]]["result"], "result of a")
+        self.assertEqual(self.finished[other["id"]]["result"], "result of a")
+
+
+    def test_cancelled_queued_job_never_runs(self) -> None:
+        running: dict = self.queue.submit("C", "1", "a", key="k1")
+        queued: dict = self.queue.submit("C", "2", "b", key="k2")
+        self.assertTrue(self.queue.cancel(queued["id"]))
+        self.wait_for(running["id"], queued["id"])
+        self.assertEqual(self.finished[queued["id"]]["state"], "cancelled")
+        self.assertIsNone(self.finished[queued["id"]]["result"])
+        self.assertFalse(self.queue.cancel(queued["id"]))
+
+
+    def test_full_queue_rejects_but_coalesces(self) -> None:
+        jobs: list[dict | None] = [self.queue.submit("C", str(index), "a", key=f"k{index}") for index in range(3)]
+        self.assertIsNone(self.queue.submit("C", "4", "d", key="k4"))
+        self.assertIsNotNone(self.queue.submit("C", "5", "e", key="k0"))
+        self.wait_for(*(job["id"] for job in jobs))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import os
+import unittest
+from modules.loc_counter_module import LocCounter
+
+CORPUS_PATH: str = os.path.join(os.path.dirname(__file__), "..", "..", "conformance", "solidity")
+
+
+class LocCounterTest(unittest.TestCase):
+    """
+    The in-process counter against the hand-derived counts of the conformance corpus
+    """
+
+    def setUp(self) -> None:
+        self.files: list[str] = sorted(file_name for file_name in os.listdir(CORPUS_PATH) if file_name.endswith(".sol"))
+        with open(os.path.join(CORPUS_PATH, LocCounter.EXPECTED_FILE), "r") as expected_file:
+            self.expected: dict = json.load(expected_file)
+
+
+    def test_corpus_matches_expected_counts(self) -> None:
+        self.assertEqual(LocCounter().compare(CORPUS_PATH, self.files, self.expected), [])
+
+
+    def test_totals_match_expected_counts(self) -> None:
+        results: list[dict] = LocCounter().count_files(CORPUS_PATH, LocCounter.unique_files(CORPUS_PATH, self.files))
+        self.assertEqual(len(results), self.expected["SUM"]["nFiles"])
+        self.assertEqual(LocCounter.get_totals(results), {key: self.expected["SUM"][key] for key in ("blank", "comment", "code")})
+
+
+    def test_duplicate_content_is_counted_once(self) -> None:
+        unique: list[str] = LocCounter.unique_files(CORPUS_PATH, self.files)
+        self.assertIn("CrLf.sol", unique)
+        self.assertNotIn("CrLfCopy.sol", unique)
+        self.assertEqual(len(unique), len(self.files) - 1)
+
+
+    def test_process_pool_matches_in_process(self) -> None:
+        counter: LocCounter = LocCounter()
+        counter.PARALLEL_THRESHOLD, counter.WORKERS = 1, 2
+        self.assertEqual(counter.count_files(CORPUS_PATH, self.files), LocCounter().count_files(CORPUS_PATH, self.files))
+        sources: list[str] = ["a = 1;\n", "// b\n\n"]
+        self.assertEqual(counter.count_sources(sources), [LocCounter.count_source(source) for source in sources])
+
+
+    def test_comment_markers_in_strings(self) -> None:
+        source: str = 'string a = "// not a comment";\nstring b = "/* nor this */";\n/* a\n\n comment */\n'
+        self.assertEqual(LocCounter.count_source(source), {"blank": 1, "comment": 2, "code": 2})
+
+
+    def test_from_cloc_json(self) -> None:
+        results: list[dict] = LocCounter.from_cloc_json({"header": {}, "./src/A.sol": {"blank": 1, "comment": 2, "code": 3, "language": "Solidity"}, "SUM": {}})
+        self.assertEqual(results, [{"file": "src/A.sol", "blank": 1, "comment": 2, "code": 3}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import tempfile
+import threading
+import time
+import unittest
+from modules.cancel_module import Cancellation, JobCancelledError, JobTimeoutError
+from modules.log_module import Log
+from modules.single_flight_module import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    """
+    A job waiting behind an identical analysis stops waiting when it is cancelled or timed out
+    """
+
+    def setUp(self) -> None:
+        self.temp_dir: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.cancel_dir: str = Cancellation.CANCEL_DIR
+        Cancellation.CANCEL_DIR = self.temp_dir.name + "/cancel"
+        self.single_flight: SingleFlight = SingleFlight(self.temp_dir.name + "/locks")
+        self.held: threading.Event = threading.Event()
+        self.release: threading.Event = threading.Event()
+        self.holder: threading.Thread = threading.Thread(target=self.hold, args=("key",))
+        self.holder.start()
+        self.held.wait()
+
+
+    def tearDown(self) -> None:
+        self.release.set()
+        self.holder.join()
+        Cancellation.CANCEL_DIR = self.cancel_dir
+        self.temp_dir.cleanup()
+
+
+    def hold(self, key: str) -> None:
+        with self.single_flight.lock(key):
+            self.held.set()
+            self.release.wait()
+
+
+    def wait_for_lock(self, job_id: str) -> float:
+        """
+        Waits for the held lock as a job, returns how long it waited
+        """
+        started_at: float = time.monotonic()
+        with Log().bind(job=job_id), self.single_flight.lock("key"):
+            pass
+        return time.monotonic() - started_at
+
+
+    def test_cancelled_waiter_stops_waiting(self) -> None:
+        threading.Timer(0.3, Cancellation.request, args=("waiter",)).start()
+        started_at: float = time.monotonic()
+        with self.assertRaises(JobCancelledError):
+            self.wait_for_lock("waiter")
+        self.assertLess(time.monotonic() - started_at, 2)
+        self.release.set()
+        self.assertLess(self.wait_for_lock("next"), 2)  # The cancelled waiter doesn't keep the lock file locked
+
+
+    def test_waiter_stops_at_its_deadline(self) -> None:
+        Cancellation.deadlines["late"] = time.time() + 0.3
+        try:
+            with self.assertRaises(JobTimeoutError):
+                self.wait_for_lock("late")
+        finally:
+            Cancellation.deadlines.pop("late", None)
+
+
+    def test_waiter_gets_the_lock_once_released(self) -> None:
+        threading.Timer(0.3, self.release.set).start()
+        self.assertGreaterEqual(self.wait_for_lock("waiter"), 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
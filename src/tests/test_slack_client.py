@@ -0,0 +1,113 @@
+import threading
+import time
+import unittest
+from modules.slack_client_module import SlackApiError, SlackClient
+
+
+class FakeResponse:
+    """
+    A Web API response, `body` is a dict for JSON and a str for anything else
+    """
+
+    def __init__(self, status_code: int, body: dict | str, headers: dict | None = None) -> None:
+        self.status_code: int = status_code
+        self.body: dict | str = body
+        self.headers: dict = headers or {}
+
+
+    def json(self) -> dict:
+        if isinstance(self.body, str):
+            raise ValueError("Not JSON")
+        return self.body
+
+
+class FakeSession:
+    """
+    Stands in for the `requests.Session` of the client: rate limits the first call for a moment, then
+    answers every post with a new `ts`
+    """
+
+    def __init__(self, rate_limit_seconds: float = 0.5) -> None:
+        self.calls: list[tuple[str, dict]] = []
+        self.rate_limit_seconds: float = rate_limit_seconds
+        self.posted: int = 0
+
+
+    def post(self, url: str, json: dict, timeout: float) -> FakeResponse:
+        self.calls.append((url.rsplit("/", 1)[1], json))
+        if self.rate_limit_seconds:
+            retry_after, self.rate_limit_seconds = self.rate_limit_seconds, 0.0
+            return FakeResponse(429, {}, {"Retry-After": str(retry_after)})
+        self.posted += 1
+        return FakeResponse(200, {"ok": True, "ts": f"{self.posted}.0"})
+
+
+class SlackClientTest(unittest.TestCase):
+    """
+    Merging of the messages queued while a channel is rate limited
+    """
+
+    def setUp(self) -> None:
+        self.client: SlackClient = SlackClient("token", "http://slack.invalid/api/")
+        self.session: FakeSession = FakeSession()
+        self.client.session = self.session
+
+
+    def send_while_limited(self, *sends) -> dict[str, dict]:
+        """
+        Sends the first message, which hits the rate limit, and the others while the channel is limited
+        Args:
+            sends: (name, function) pairs
+        Returns:
+            dict[str, dict]: {name: the response of its call}
+        """
+        responses: dict[str, dict] = {}
+
+        def send(name: str, function) -> None:
+            responses[name] = function()
+
+        threads: list[threading.Thread] = []
+        for index, (name, function) in enumerate(sends):
+            threads.append(threading.Thread(target=send, args=(name, function)))
+            threads[-1].start()
+            if index == 0:
+                time.sleep(0.1)  # The first call takes the channel and gets rate limited
+        for thread in threads:
+            thread.join()
+        return responses
+
+
+    def test_posts_are_not_merged_by_default(self) -> None:
+        responses: dict[str, dict] = self.send_while_limited(
+            *((name, lambda name=name: self.client.post_message("C", name, thread_ts="1.0")) for name in ("a", "b", "c"))
+        )
+        self.assertEqual(len({response["ts"] for response in responses.values()}), 3)
+        self.assertEqual([params["text"] for _, params in self.session.calls[1:]], ["a", "b", "c"])
+
+
+    def test_mergeable_posts_are_merged(self) -> None:
+        responses: dict[str, dict] = self.send_while_limited(
+            ("status", lambda: self.client.post_message("C", "status", thread_ts="1.0")),
+            ("b", lambda: self.client.post_message("C", "b", thread_ts="1.0", mergeable=True)),
+            ("c", lambda: self.client.post_message("C", "c", thread_ts="1.0", mergeable=True))
+        )
+        self.assertEqual([params["text"] for _, params in self.session.calls[1:]], ["status", "b\n\nc"])
+        self.assertNotEqual(responses["status"]["ts"], responses["b"]["ts"])
+        self.assertEqual(responses["b"]["ts"], responses["c"]["ts"])
+
+
+    def test_updates_collapse_into_the_newest_text(self) -> None:
+        self.send_while_limited(
+            *((text, lambda text=text: self.client.update_message("C", "1.0", text)) for text in ("first", "second", "third"))
+        )
+        self.assertEqual([params["text"] for _, params in self.session.calls[1:]], ["third"])
+
+
+    def test_error_without_json_body(self) -> None:
+        self.session.post = lambda url, json, timeout: FakeResponse(403, "<html>Forbidden</html>")
+        with self.assertRaises(SlackApiError):
+            self.client.post_message("C", "text")
+
+
+if __name__ == "__main__":
+    unittest.main()